@@ -0,0 +1,106 @@
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Sequence, Tuple
+
+BENCHMARKS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, 'baselines')
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    # Nearest-rank percentile of already sorted values
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(
+    latencies: List[float],
+    percentiles: Sequence[float] = (50, 99)
+) -> Dict[str, float]:
+    values = sorted(latencies)
+    summary = {
+        'p{}_ms'.format(str(p).replace('.', '')):
+            1000.0 * percentile(values, p)
+        for p in percentiles
+    }
+    summary['max_ms'] = 1000.0 * values[-1] if values else 0.0
+    return summary
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def report_meta(**kwargs) -> Dict:
+    return {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        **kwargs
+    }
+
+
+def write_report(report: Dict, path: str = None) -> None:
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, mode='w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def load_report(path: str) -> Dict:
+    with open(path, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(
+    results: List[Dict],
+    baseline: List[Dict],
+    key_fields: Sequence[str],
+    higher_is_better: Sequence[str],
+    lower_is_better: Sequence[str],
+    tolerance: float
+) -> List[Dict]:
+    '''
+    Returns the regressions of `results` against `baseline` rows matched
+    on `key_fields`: metrics that got worse by more than `tolerance`.
+    '''
+    def key(row: Dict) -> Tuple:
+        return tuple(row.get(k) for k in key_fields)
+
+    base_rows = {key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        base = base_rows.get(key(row))
+        if base is None:
+            continue
+
+        checks = [(m, True) for m in higher_is_better] + \
+            [(m, False) for m in lower_is_better]
+        for metric, higher in checks:
+            new, old = row.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if (higher and change < -tolerance) or \
+                    (not higher and change > tolerance):
+                regressions.append({
+                    **{k: row.get(k) for k in key_fields},
+                    'metric': metric,
+                    'baseline': old,
+                    'current': new,
+                    'change': round(change, 4)
+                })
+
+    return regressions
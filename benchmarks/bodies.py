@@ -0,0 +1,150 @@
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from benchmarks import latency_summary, report_meta, write_report
+from benchmarks.storage import list_notes, make_engine_config
+from data.synthetic import generate_notes
+from notesservice.database.db_engines import create_notes_db
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import run_coroutine
+
+BODY_ALGORITHMS = ['none', 'zlib', 'lzma']
+
+DEFAULT_BODY_SIZE = 'lognormal:8192:1.0'
+
+
+def store_bytes(path: str) -> int:
+    # Note files, or the SQLite file, without the auxiliary files
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path)
+        if entry.is_file()
+    )
+
+
+def prefixed(prefix: str, values: Dict) -> Dict:
+    return {prefix + k: v for k, v in values.items()}
+
+
+def make_notes(
+    count: int,
+    seed: int,
+    body_size: str,
+    corpus: str = None
+) -> List[Note]:
+    # Bodies from the synthetic word mix, or slices of a text file at
+    # random offsets (e.g. prose or source code) when `corpus` is given
+    notes = list(generate_notes(count, seed=seed, body_size=body_size))
+    if corpus is not None:
+        with open(corpus, encoding='utf-8') as f:
+            text = f.read()
+        rng = random.Random(seed)
+        for note in notes:
+            size = len(note['body'])
+            # Wraps around for bodies longer than the corpus
+            text_at = text * (size // len(text) + 2)
+            start = rng.randrange(len(text))
+            note['body'] = text_at[start:start + size]
+    return [Note.from_api_dm(note) for note in notes]
+
+
+async def bench_bodies(
+    engine: str,
+    algorithm: str,
+    notes: List[Note],
+    reads: int,
+    list_ops: int,
+    min_size: int,
+    seed: int
+) -> Dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory(prefix='notesservice-bodies') as tmp:
+        config = make_engine_config(engine, tmp)
+        if algorithm != 'none':
+            config['body-compression'] = {
+                'algorithm': algorithm, 'min-size': min_size
+            }
+        notes_db = create_notes_db(config)
+        await notes_db.start()
+        try:
+            write_latencies = []
+            for note in notes:
+                start = time.perf_counter()
+                await notes_db.create_note(note, note.id)
+                write_latencies.append(time.perf_counter() - start)
+
+            read_latencies = []
+            for _ in range(reads):
+                id_ = rng.choice(notes).id
+                start = time.perf_counter()
+                await notes_db.read_note(id_)
+                read_latencies.append(time.perf_counter() - start)
+
+            list_latencies = []
+            for _ in range(list_ops):
+                start = time.perf_counter()
+                await list_notes(notes_db)
+                list_latencies.append(time.perf_counter() - start)
+
+            stats = notes_db.stats()
+        finally:
+            await notes_db.stop()
+
+        size = store_bytes(config[engine])
+
+    body_bytes = sum(len(note.body.encode('utf-8')) for note in notes)
+    return {
+        'engine': engine,
+        'algorithm': algorithm,
+        'notes': len(notes),
+        'body_bytes': body_bytes,
+        'store_bytes': size,
+        'bodies_compressed': stats.get('bodies_compressed', 0),
+        'body_bytes_saved': stats.get('body_bytes_saved', 0),
+        **prefixed('write_', latency_summary(write_latencies)),
+        **prefixed('read_', latency_summary(read_latencies)),
+        **prefixed('list_', latency_summary(list_latencies))
+    }
+
+
+def run_body_benchmark(
+    engines: Sequence[str],
+    sizes: Sequence[int],
+    reads: int,
+    list_ops: int,
+    body_size: str = DEFAULT_BODY_SIZE,
+    algorithms: Sequence[str] = BODY_ALGORITHMS,
+    min_size: int = 4096,
+    corpus: str = None,
+    seed: int = 0,
+    output: str = None
+) -> Dict:
+    '''
+    Writes the same notes to a fresh store per engine, size and body
+    compression algorithm, and reports the store size, and write, read
+    and full list latencies.
+    '''
+    results = []
+    for size in sizes:
+        notes = make_notes(size, seed, body_size, corpus)
+        for engine in engines:
+            for algorithm in algorithms:
+                results.append(run_coroutine(bench_bodies(
+                    engine, algorithm, notes, reads, list_ops, min_size,
+                    seed
+                )))
+
+    report = {
+        'meta': report_meta(
+            benchmark='bodies', reads=reads,
+            list_ops=list_ops, body_size=body_size, min_size=min_size,
+            corpus=corpus, seed=seed
+        ),
+        'results': results
+    }
+    write_report(report, output)
+    return report
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import tempfile
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple
+)
+
+from benchmarks import latency_summary, report_meta, write_report
+from benchmarks.storage import load_notes, make_engine_config
+from data.synthetic import generate_notes
+from notesservice import LOGGER_NAME
+from notesservice.service import NotesService
+from notesservice.utils.asyncutils import run_coroutine
+from notesservice.utils.metrics import Histogram
+
+HERD_WORKLOADS = ['note', 'note_with_writes', 'list']
+
+Request = Callable[[], Awaitable[Any]]
+
+
+def db_reads(service: NotesService, operation: str) -> int:
+    histogram = service.metrics.get(
+        'notesservice_db_operation_duration_seconds'
+    )
+    assert isinstance(histogram, Histogram)
+    engine = type(service.notes_db.engine).__name__
+    return histogram.count((engine, operation, 'ok'))
+
+
+async def run_herd(
+    request: Request,
+    rounds: int,
+    herd_size: int,
+    write: Optional[Request] = None
+) -> Dict:
+    # Every round `herd_size` identical requests arrive at once, with an
+    # optional write racing them
+    latencies: List[float] = []
+
+    async def timed() -> None:
+        start = time.perf_counter()
+        await request()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        herd: List[Awaitable[Any]] = [timed() for _ in range(herd_size)]
+        if write is not None:
+            herd.insert(herd_size // 2, write())
+        await asyncio.gather(*herd)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        **latency_summary(latencies)
+    }
+
+
+async def bench_herd(
+    engine: str,
+    size: int,
+    rounds: int,
+    list_rounds: int,
+    herd_size: int,
+    coalesce: bool,
+    seed: int
+) -> List[Dict]:
+    notes = generate_notes(size + rounds, seed=seed)
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix='notesservice-herd') as tmp:
+        service = NotesService(
+            config={
+                'service': {'coalesce-reads': coalesce},
+                'notes-db': make_engine_config(engine, tmp)
+            },
+            logger=logging.getLogger(LOGGER_NAME)
+        )
+        await service.notes_db.start()
+        try:
+            ids = await load_notes(service.notes_db, notes, size)
+            hot_id = ids[0]
+            updates = iter(list(notes))
+
+            async def get_list() -> int:
+                count = 0
+                async for _ in service.get_notes():
+                    count += 1
+                return count
+
+            workloads: Dict[
+                str, Tuple[str, Request, int, Optional[Request]]
+            ] = {
+                'note': (
+                    'read_note', lambda: service.get_note(hot_id),
+                    rounds, None
+                ),
+                'note_with_writes': (
+                    'read_note', lambda: service.get_note(hot_id),
+                    rounds, lambda: service.update_note(hot_id, next(updates))
+                ),
+                'list': ('read_all_notes', get_list, list_rounds, None)
+            }
+
+            for workload in HERD_WORKLOADS:
+                operation, request, workload_rounds, write = (
+                    workloads[workload]
+                )
+                reads_before = db_reads(service, operation)
+                result = await run_herd(
+                    request, workload_rounds, herd_size, write
+                )
+                results.append({
+                    'engine': engine,
+                    'size': size,
+                    'workload': workload,
+                    'herd_size': herd_size,
+                    'coalesce': coalesce,
+                    **result,
+                    'db_reads': db_reads(service, operation) - reads_before
+                })
+        finally:
+            await service.notes_db.stop()
+
+    return results
+
+
+def run_herd_benchmark(
+    engines: Sequence[str],
+    sizes: Sequence[int],
+    rounds: int,
+    list_rounds: int,
+    herd_size: int,
+    seed: int = 0,
+    output: str = None
+) -> Dict:
+    '''
+    Thundering herd: bursts of identical reads of one hot note (with and
+    without a racing write) and of the full list, with read coalescing
+    off and on, reporting latency and the DB reads actually issued.
+    '''
+    results: List[Dict] = []
+    for engine in engines:
+        for size in sizes:
+            for coalesce in (False, True):
+                results.extend(run_coroutine(bench_herd(
+                    engine, size, rounds, list_rounds, herd_size,
+                    coalesce, seed
+                )))
+
+    report = {
+        'meta': report_meta(
+            benchmark='herd', rounds=rounds, list_rounds=list_rounds,
+            herd_size=herd_size, seed=seed
+        ),
+        'results': results
+    }
+    write_report(report, output)
+    return report
@@ -0,0 +1,424 @@
+import asyncio
+import bisect
+import json
+import logging
+import logging.config
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from benchmarks import latency_summary, report_meta, write_report
+from benchmarks.storage import make_engine_config
+
+DEFAULT_MIX = 'get=60,list=2,post=15,put=18,delete=5'
+
+LOAD_PERCENTILES = (50, 90, 99, 99.9)
+
+# Upper bounds (ms) of the latency histogram in the report
+HISTOGRAM_BOUNDS_MS = (
+    0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000
+)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ['get', 'list', 'post', 'put', 'delete']:
+            raise ValueError('Unknown operation {}'.format(name))
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _serve(config: Dict, port: int) -> None:
+    # Runs in the server process: the same code path as server.py
+    from notesservice import LOGGER_NAME
+    from notesservice.tornado.app import make_notesservice_app
+    from notesservice.tornado.server import run_server
+
+    logging.config.dictConfig(config['logging'])
+    logger = logging.getLogger(LOGGER_NAME)
+    service, app = make_notesservice_app(config, False, logger)
+    run_server(app, service, config, port, False, logger)
+
+
+# Creating KeepAliveConnection class
+class KeepAliveConnection:
+    '''
+    Minimal HTTP/1.1 client connection that is reused across requests.
+    '''
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def open(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer is not None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b''
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        assert self.reader is not None and self.writer is not None
+        head = (
+            '{} {} HTTP/1.1\r\n'
+            'Host: {}:{}\r\n'
+            'Content-Type: application/json; charset=UTF-8\r\n'
+            'Content-Length: {}\r\n'
+            '\r\n'
+        ).format(method, path, self.host, self.port, len(body))
+        self.writer.write(head.encode('latin-1') + body)
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            payload = b''.join(chunks)
+        else:
+            length = int(headers.get('content-length', 0))
+            payload = await self.reader.readexactly(length) if length else b''
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return status, headers, payload
+
+
+# Creating ConnectionPool class
+class ConnectionPool:
+    def __init__(self, host: str, port: int, max_connections: int) -> None:
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self._idle: List[KeepAliveConnection] = []
+        self._opened = 0
+        self._available = asyncio.Condition()
+
+    @property
+    def opened(self) -> int:
+        return self._opened
+
+    async def acquire(self) -> KeepAliveConnection:
+        async with self._available:
+            while not self._idle and self._opened >= self.max_connections:
+                await self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+
+        conn = KeepAliveConnection(self.host, self.port)
+        try:
+            await conn.open()
+        except Exception:
+            await self.release(conn)
+            raise
+        return conn
+
+    async def release(self, conn: KeepAliveConnection) -> None:
+        async with self._available:
+            if conn.is_open:
+                self._idle.append(conn)
+            else:
+                self._opened -= 1
+            self._available.notify()
+
+    def close(self) -> None:
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+def histogram_ms(latencies: Sequence[float]) -> List[Dict]:
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for latency in latencies:
+        counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, 1000.0 * latency)] += 1
+    bounds: List[Union[float, str]] = [*HISTOGRAM_BOUNDS_MS, '+Inf']
+    return [{'le': b, 'count': c} for b, c in zip(bounds, counts)]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count else 0.0,
+        'throughput': count / duration if duration > 0 else 0.0,
+        **latency_summary(latencies, LOAD_PERCENTILES),
+        'histogram_ms': histogram_ms(latencies)
+    }
+
+
+# Creating LoadGenerator class
+class LoadGenerator:
+    '''
+    Open-loop load generator: requests are issued on a fixed (or Poisson)
+    schedule regardless of how fast earlier ones complete, and latency is
+    measured from the scheduled start so queueing delay is not hidden.
+    '''
+    def __init__(
+        self,
+        port: int,
+        rate: float,
+        duration: float,
+        mix: Dict[str, float],
+        connections: int,
+        poisson: bool,
+        seed: int
+    ) -> None:
+        self.pool = ConnectionPool('127.0.0.1', port, connections)
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.poisson = poisson
+        self.rng = random.Random(seed)
+        self.note_ids: List[str] = []      # preloaded, never deleted
+        self.created_ids: List[str] = []   # created by the run, deletable
+        # Every op that can be issued: a delete with nothing to delete
+        # creates a note instead, whether or not the mix has posts
+        ops = list(mix) + (['post'] if 'post' not in mix else [])
+        self.latencies: Dict[str, List[float]] = {op: [] for op in ops}
+        self.errors: Dict[str, int] = {op: 0 for op in ops}
+
+    def _note_body(self) -> bytes:
+        return json.dumps({
+            'title': 'Note {}'.format(self.rng.randrange(1 << 30)),
+            'body': 'lorem ipsum ' * self.rng.randint(1, 50),
+            'note_type': self.rng.choice(['personal', 'work'])
+        }).encode('utf-8')
+
+    def _next_request(self) -> Tuple[str, str, str, bytes]:
+        op = self.rng.choices(
+            list(self.mix), weights=list(self.mix.values())
+        )[0]
+        if op == 'delete' and not self.created_ids:
+            op = 'post'
+
+        if op == 'get':
+            path = '/v1/notes/' + self.rng.choice(self.note_ids)
+            return op, 'GET', path, b''
+        if op == 'list':
+            return op, 'GET', '/v1/notes', b''
+        if op == 'post':
+            return op, 'POST', '/v1/notes', self._note_body()
+        if op == 'put':
+            path = '/v1/notes/' + self.rng.choice(self.note_ids)
+            return op, 'PUT', path, self._note_body()
+
+        id_ = self.created_ids.pop(self.rng.randrange(len(self.created_ids)))
+        return op, 'DELETE', '/v1/notes/' + id_, b''
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        body: bytes
+    ) -> Tuple[int, Dict[str, str]]:
+        conn = await self.pool.acquire()
+        try:
+            status, headers, _ = await conn.request(method, path, body)
+        except Exception:
+            conn.close()
+            raise
+        finally:
+            await self.pool.release(conn)
+        return status, headers
+
+    async def preload(self, count: int) -> None:
+        for _ in range(count):
+            status, headers = await self._send(
+                'POST', '/v1/notes', self._note_body()
+            )
+            if status != 201:
+                raise RuntimeError('Preload failed with {}'.format(status))
+            self.note_ids.append(headers['location'].rsplit('/', 1)[-1])
+
+    async def _issue(
+        self,
+        op: str,
+        method: str,
+        path: str,
+        body: bytes,
+        scheduled: float
+    ) -> None:
+        ok = False
+        try:
+            status, headers = await self._send(method, path, body)
+            ok = status < 400
+            if op == 'post' and status == 201:
+                self.created_ids.append(
+                    headers['location'].rsplit('/', 1)[-1]
+                )
+        except Exception:
+            ok = False
+        finally:
+            self.latencies[op].append(time.perf_counter() - scheduled)
+            if not ok:
+                self.errors[op] += 1
+
+    async def run(self) -> Dict:
+        tasks = []
+        start = time.perf_counter()
+        scheduled = start
+        end = start + self.duration
+        while True:
+            if self.poisson:
+                scheduled += self.rng.expovariate(self.rate)
+            else:
+                scheduled += 1.0 / self.rate
+            if scheduled >= end:
+                break
+
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            op, method, path, body = self._next_request()
+            tasks.append(asyncio.ensure_future(
+                self._issue(op, method, path, body, scheduled)
+            ))
+
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        self.pool.close()
+
+        all_latencies = [v for values in self.latencies.values()
+                         for v in values]
+        return {
+            'duration': elapsed,
+            'connections': self.pool.opened,
+            'overall': summarize(
+                all_latencies, sum(self.errors.values()), elapsed
+            ),
+            'operations': {
+                op: summarize(self.latencies[op], self.errors[op], elapsed)
+                for op in self.latencies if self.latencies[op]
+                or op in self.mix
+            }
+        }
+
+
+def run_load_test(
+    engine: str,
+    rate: float,
+    duration: float,
+    mix: str = DEFAULT_MIX,
+    connections: int = 16,
+    preload: int = 100,
+    poisson: bool = True,
+    seed: int = 0,
+    output: str = None
+) -> Dict:
+    '''
+    Starts the notes service on a local port in a child process, drives it
+    with the open-loop load generator and writes the JSON report.
+    '''
+    with tempfile.TemporaryDirectory(prefix='notesservice-load') as tmp:
+        config = {
+            'service': {'name': 'Notes'},
+            'notes-db': make_engine_config(engine, tmp),
+            'instrumentation': {'slow-callback-ms': 0},
+            'logging': {'version': 1, 'root': {'level': 'ERROR'}}
+        }
+        port = free_port()
+        server = multiprocessing.Process(
+            target=_serve, args=(config, port), daemon=True
+        )
+        server.start()
+        try:
+            loop = asyncio.new_event_loop()
+            try:
+                results = loop.run_until_complete(drive(
+                    port, rate, duration, parse_mix(mix), connections,
+                    preload, poisson, seed
+                ))
+            finally:
+                loop.close()
+        finally:
+            if server.pid is not None:
+                os.kill(server.pid, signal.SIGINT)
+            server.join(10)
+            if server.is_alive():
+                server.terminate()
+
+    report = {
+        'meta': report_meta(
+            benchmark='http', engine=engine, rate=rate, duration=duration,
+            mix=mix, max_connections=connections, preload=preload,
+            arrivals='poisson' if poisson else 'uniform', seed=seed
+        ),
+        'results': results
+    }
+    write_report(report, output)
+    return report
+
+
+async def drive(
+    port: int,
+    rate: float,
+    duration: float,
+    mix: Dict[str, float],
+    connections: int,
+    preload: int,
+    poisson: bool,
+    seed: int
+) -> Dict:
+    await wait_for_port(port)
+    generator = LoadGenerator(
+        port, rate, duration, mix, connections, poisson, seed
+    )
+    await generator.preload(preload)
+    return await generator.run()
+
+
+async def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
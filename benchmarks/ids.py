@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from benchmarks import latency_summary, report_meta, write_report
+from data.synthetic import generate_notes
+from notesservice.database.db_engines import create_notes_db
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import run_coroutine
+from notesservice.utils.idutils import ID_SCHEMES, id_generator
+
+# Throughput is also reported for the last 10% of the rows, where random
+# ids suffer most once the index no longer fits the page cache
+TAIL_FRACTION = 0.1
+
+
+def btree_sizes(db_path: str) -> Dict[str, Dict]:
+    # Size and fill factor of every table and index B-tree (needs the
+    # dbstat virtual table; falls back to the file size)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('''
+            SELECT name, COUNT(*), SUM(pgsize), SUM(unused)
+            FROM dbstat GROUP BY name;
+        ''').fetchall()
+    except sqlite3.OperationalError:
+        return {'file': {'bytes': os.path.getsize(db_path)}}
+    finally:
+        conn.close()
+
+    return {
+        name: {
+            'pages': pages,
+            'bytes': size,
+            'fill': round(1.0 - unused / size, 4) if size else 0.0
+        }
+        for name, pages, size, unused in rows
+    }
+
+
+async def bench_id_scheme(
+    scheme: str,
+    rows: int,
+    batch_size: int,
+    seed: int,
+    db_path: str
+) -> Dict:
+    new_id = id_generator(scheme)
+    notes = generate_notes(rows, seed=seed, body_size='fixed:64')
+    notes_db = create_notes_db({'sql': db_path})
+    await notes_db.start()
+
+    latencies: List[float] = []
+    tail_start = int(rows * (1.0 - TAIL_FRACTION))
+    tail_seconds = 0.0
+    tail_rows = 0
+    inserted = 0
+    try:
+        while inserted < rows:
+            batch = []
+            for note in notes:
+                batch.append(Note.from_api_dm({**note, 'id': new_id()}))
+                if len(batch) == batch_size:
+                    break
+            if not batch:
+                break
+
+            start = time.perf_counter()
+            await notes_db.create_notes(batch)
+            elapsed = time.perf_counter() - start
+
+            latencies.append(elapsed)
+            inserted += len(batch)
+            if inserted > tail_start:
+                tail_seconds += elapsed
+                tail_rows += len(batch)
+    finally:
+        await notes_db.stop()
+
+    total = sum(latencies)
+    return {
+        'scheme': scheme,
+        'rows': inserted,
+        'batch_size': batch_size,
+        'insert_seconds': total,
+        'rows_per_sec': inserted / total if total else 0.0,
+        'tail_rows_per_sec': tail_rows / tail_seconds if tail_seconds else 0.0,
+        **{
+            'batch_' + k: v
+            for k, v in latency_summary(latencies).items()
+        },
+        'file_bytes': os.path.getsize(db_path),
+        'btrees': btree_sizes(db_path)
+    }
+
+
+def run_id_benchmark(
+    rows: int,
+    batch_size: int = 1000,
+    schemes: Sequence[str] = ID_SCHEMES,
+    seed: int = 0,
+    output: str = None
+) -> Dict:
+    '''
+    Inserts `rows` notes into a fresh SQLite store per id scheme and
+    reports insert throughput and B-tree (table and index) sizes.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory(prefix='notesservice-ids') as tmp:
+        for scheme in schemes:
+            db_path = os.path.join(tmp, scheme + '.db')
+            results.append(run_coroutine(bench_id_scheme(
+                scheme, rows, batch_size, seed, db_path
+            )))
+            os.remove(db_path)
+
+    report = {
+        'meta': report_meta(
+            benchmark='ids', rows=rows, batch_size=batch_size, seed=seed
+        ),
+        'results': results
+    }
+    write_report(report, output)
+    return report
@@ -0,0 +1,96 @@
+import random
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from benchmarks import latency_summary, report_meta, write_report
+from benchmarks.bodies import prefixed
+from benchmarks.storage import list_notes, make_engine_config, run_workload
+from data.synthetic import generate_notes
+from notesservice.database.db_engines import create_notes_db
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import run_coroutine
+
+SHARD_COUNTS = [1, 2, 4, 8]
+
+
+async def bench_shards(
+    shards: int,
+    notes: List[Note],
+    concurrency: int,
+    reads: int,
+    list_ops: int,
+    seed: int
+) -> Dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory(prefix='notesservice-shards') as tmp:
+        config = {**make_engine_config('sql', tmp), 'shards': shards}
+        notes_db = create_notes_db(config)
+        await notes_db.start()
+        try:
+            # One transaction per note: the writer lock and commit of
+            # every shard are what the concurrent writes contend for
+            writes = await run_workload(
+                notes_db.create_note,
+                ((note, note.id) for note in notes),
+                concurrency
+            )
+            ids = [note.id for note in notes]
+            point_reads = await run_workload(
+                notes_db.read_note,
+                ((rng.choice(ids),) for _ in range(reads)),
+                concurrency
+            )
+
+            list_latencies = []
+            for _ in range(list_ops):
+                start = time.perf_counter()
+                await list_notes(notes_db)
+                list_latencies.append(time.perf_counter() - start)
+        finally:
+            await notes_db.stop()
+
+    return {
+        'shards': shards,
+        'notes': len(notes),
+        'concurrency': concurrency,
+        **prefixed('write_', writes),
+        **prefixed('read_', point_reads),
+        **prefixed('list_', latency_summary(list_latencies))
+    }
+
+
+def run_shard_benchmark(
+    shard_counts: Sequence[int],
+    sizes: Sequence[int],
+    concurrency: int,
+    reads: int,
+    list_ops: int,
+    seed: int = 0,
+    output: str = None
+) -> Dict:
+    '''
+    Writes the same notes with `concurrency` concurrent writers to a fresh
+    SQLite store per shard count and size, then reports write and read
+    throughput and latency, and full list latency.
+    '''
+    results = []
+    for size in sizes:
+        notes = [
+            Note.from_api_dm(note)
+            for note in generate_notes(size, seed=seed)
+        ]
+        for shards in shard_counts:
+            results.append(run_coroutine(bench_shards(
+                shards, notes, concurrency, reads, list_ops, seed
+            )))
+
+    report = {
+        'meta': report_meta(
+            benchmark='shards', concurrency=concurrency, reads=reads,
+            list_ops=list_ops, seed=seed
+        ),
+        'results': results
+    }
+    write_report(report, output)
+    return report
@@ -0,0 +1,246 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Sequence,
+    Tuple
+)
+
+from benchmarks import (
+    BASELINES_DIR,
+    compare_results,
+    latency_summary,
+    load_report,
+    peak_rss_kb,
+    report_meta,
+    write_report
+)
+from data.synthetic import bulk_load, generate_notes
+from notesservice.database.db_engines import create_notes_db
+from notesservice.database.notes_db import AbstractNotesDB
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import run_coroutine
+
+ENGINES = ['memory', 'fs', 'sql']
+
+WORKLOADS = ['create', 'read_hot', 'read_cold', 'update', 'list', 'delete']
+
+STORAGE_BASELINE = os.path.join(BASELINES_DIR, 'storage.json')
+
+KEY_FIELDS = ['engine', 'size', 'workload', 'concurrency']
+
+# Fraction of the ids that receive the hot reads
+HOT_FRACTION = 0.01
+
+
+def make_engine_config(engine: str, store_dir: str) -> Dict:
+    configs: Dict[str, Dict] = {
+        'memory': {'memory': None},
+        'fs': {'fs': os.path.join(store_dir, 'fs')},
+        'sql': {'sql': os.path.join(store_dir, 'store.db')}
+    }
+    return configs[engine]
+
+
+async def run_workload(
+    operation: Callable[..., Awaitable[Any]],
+    args: Iterable[Sequence],
+    concurrency: int
+) -> Dict:
+    latencies: List[float] = []
+    work = iter(args)
+
+    async def worker() -> None:
+        for op_args in work:
+            start = time.perf_counter()
+            await operation(*op_args)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        **latency_summary(latencies)
+    }
+
+
+async def load_notes(
+    notes_db: AbstractNotesDB,
+    notes: Iterator[Mapping],
+    size: int
+) -> List[str]:
+    # Bulk load the preloaded notes, keeping their ids for the workloads
+    ids: List[str] = []
+
+    def tap(notes: Iterable[Mapping]) -> Iterator[Mapping]:
+        for note in notes:
+            ids.append(note['id'])
+            yield note
+
+    await bulk_load(notes_db, tap(itertools.islice(notes, size)))
+    return ids
+
+
+async def list_notes(notes_db: AbstractNotesDB) -> int:
+    count = 0
+    async for _ in notes_db.read_all_notes():
+        count += 1
+    return count
+
+
+async def bench_engine(
+    engine: str,
+    size: int,
+    ops: int,
+    list_ops: int,
+    concurrency: int,
+    seed: int
+) -> List[Dict]:
+    rng = random.Random(seed)
+    notes = generate_notes(size + 2 * ops, seed=seed)
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix='notesservice-bench') as tmp:
+        notes_db = create_notes_db(make_engine_config(engine, tmp))
+        await notes_db.start()
+        try:
+            ids = await load_notes(notes_db, notes, size)
+            hot_ids = ids[:max(1, int(len(ids) * HOT_FRACTION))]
+            new_notes = [
+                Note.from_api_dm(note)
+                for note in itertools.islice(notes, ops)
+            ]
+            updates = [
+                Note.from_api_dm({**note, 'id': rng.choice(ids)})
+                for note in itertools.islice(notes, ops)
+            ]
+
+            workloads: Dict[
+                str, Tuple[Callable[..., Awaitable[Any]], List[Sequence]]
+            ] = {
+                'create': (
+                    notes_db.create_note,
+                    [(note, note.id) for note in new_notes]
+                ),
+                'read_hot': (
+                    notes_db.read_note,
+                    [(rng.choice(hot_ids),) for _ in range(ops)]
+                ),
+                'read_cold': (
+                    notes_db.read_note,
+                    [(rng.choice(ids),) for _ in range(ops)]
+                ),
+                'update': (
+                    notes_db.update_note,
+                    [(note.id, note) for note in updates]
+                ),
+                'list': (
+                    lambda: list_notes(notes_db),
+                    [() for _ in range(list_ops)]
+                ),
+                # Deletes what 'create' added, so the size stays constant
+                'delete': (
+                    notes_db.delete_note,
+                    [(note.id,) for note in new_notes]
+                )
+            }
+
+            for workload in WORKLOADS:
+                operation, args = workloads[workload]
+                result = await run_workload(operation, args, concurrency)
+                results.append({
+                    'engine': engine,
+                    'size': size,
+                    'workload': workload,
+                    'concurrency': concurrency,
+                    **result,
+                    # Of the case's own process, up to this workload
+                    'peak_rss_kb': peak_rss_kb()
+                })
+        finally:
+            await notes_db.stop()
+
+    return results
+
+
+def run_case(
+    engine: str,
+    size: int,
+    ops: int,
+    list_ops: int,
+    concurrency: int,
+    seed: int
+) -> List[Dict]:
+    # Entry point of the process running one engine and size
+    return run_coroutine(bench_engine(
+        engine, size, ops, list_ops, concurrency, seed
+    ))
+
+
+def run_storage_benchmark(
+    engines: Sequence[str],
+    sizes: Sequence[int],
+    ops: int,
+    list_ops: int,
+    concurrency: int,
+    seed: int = 0,
+    output: str = None,
+    baseline: str = STORAGE_BASELINE,
+    save_baseline: bool = False,
+    tolerance: float = 0.2
+) -> List[Dict]:
+    '''
+    Runs the standard workload mix for every engine and size, writes the
+    JSON report and returns the regressions against the baseline. Every
+    engine and size runs in a new process, so that its peak RSS is not
+    that of a larger case run before it.
+    '''
+    results: List[Dict] = []
+    context = multiprocessing.get_context('spawn')
+    for engine in engines:
+        for size in sizes:
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results.extend(pool.submit(
+                    run_case, engine, size, ops, list_ops, concurrency,
+                    seed
+                ).result())
+
+    report = {
+        'meta': report_meta(
+            benchmark='storage', ops=ops, list_ops=list_ops, seed=seed
+        ),
+        'results': results
+    }
+
+    regressions: List[Dict] = []
+    if save_baseline:
+        write_report(report, baseline)
+    elif baseline and os.path.exists(baseline):
+        regressions = compare_results(
+            results,
+            load_report(baseline)['results'],
+            key_fields=KEY_FIELDS,
+            higher_is_better=['ops_per_sec'],
+            lower_is_better=['p50_ms', 'p99_ms', 'peak_rss_kb'],
+            tolerance=tolerance
+        )
+    report['regressions'] = regressions
+
+    write_report(report, output)
+    return regressions
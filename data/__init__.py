@@ -15,6 +15,7 @@ NOTES_DATA_DIR = os.path.abspath(os.path.join(
 
 NOTES_FILES = glob.glob(NOTES_DATA_DIR + '/*.json')
 
+
 def notes_data_suite(
     json_files: Sequence[str] = NOTES_FILES
 ) -> Dict[str, Dict]:
@@ -27,3 +28,18 @@ def notes_data_suite(
             note_data_suite[note_id] = note_json
 
     return note_data_suite
+
+
+def synthetic_notes_data_suite(
+    count: int,
+    seed: int = 0,
+    **kwargs
+) -> Dict[str, Dict]:
+    # Same shape as notes_data_suite(), with generated notes;
+    # see data.synthetic.generate_notes() for the options
+    from data.synthetic import generate_notes
+
+    return {
+        note['id']: note
+        for note in generate_notes(count, seed=seed, **kwargs)
+    }
@@ -0,0 +1,153 @@
+# Copyright (c) 2020. All rights reserved.
+
+import itertools
+import math
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Tuple
+
+from notesservice.database.db_engines import create_notes_db
+from notesservice.database.notes_db import AbstractNotesDB
+from notesservice.datamodel import Note, NoteType
+
+# Fixed default end of the updated_on spread so that a seed always
+# produces the same notes
+DEFAULT_UPDATED_ON_END = 1663763935
+
+DEFAULT_BODY_SIZE = 'lognormal:400:1.0'
+
+DEFAULT_TYPE_MIX = 'personal=0.5,work=0.5'
+
+MAX_BODY_SIZE = 1 << 20
+
+CORPUS_SIZE = 1 << 20
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua enim ad minim '
+    'veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+    'commodo consequat duis aute irure in reprehenderit voluptate velit '
+    'esse cillum fugiat nulla pariatur excepteur sint occaecat cupidatat '
+    'non proident sunt culpa qui officia deserunt mollit anim id est '
+    'meeting agenda todo buy milk call review draft release notes budget '
+    'project deadline groceries ideas follow up\n- [ ] checklist'
+).split(' ')
+
+
+def parse_body_size(spec: str) -> Callable[[random.Random], int]:
+    '''
+    Body size distribution in characters:
+        fixed:N, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA
+    '''
+    kind, *params = spec.split(':')
+    try:
+        values = [float(p) for p in params]
+        if kind == 'fixed':
+            size = int(values[0])
+            return lambda rng: size
+        if kind == 'uniform':
+            low, high = int(values[0]), int(values[1])
+            return lambda rng: rng.randint(low, high)
+        if kind == 'lognormal':
+            mu, sigma = math.log(values[0]), values[1]
+            return lambda rng: min(
+                MAX_BODY_SIZE, int(rng.lognormvariate(mu, sigma))
+            )
+    except (IndexError, ValueError):
+        pass
+
+    raise ValueError('Invalid body size distribution {}'.format(spec))
+
+
+def parse_type_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        NoteType[name.strip()]  # raises KeyError for unknown types
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def make_corpus(rng: random.Random, size: int = CORPUS_SIZE) -> str:
+    # Bodies are slices of one pre-generated text: realistic (compressible)
+    # content without paying for random text generation per note
+    words: List[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def generate_notes(
+    count: int,
+    seed: int = 0,
+    body_size: str = DEFAULT_BODY_SIZE,
+    type_mix: str = DEFAULT_TYPE_MIX,
+    updated_on_days: float = 365,
+    updated_on_end: int = DEFAULT_UPDATED_ON_END
+) -> Iterator[Dict]:
+    '''
+    Generates `count` schema-valid notes (API dicts). The same arguments
+    always produce the same notes.
+    '''
+    rng = random.Random(seed)
+    corpus = make_corpus(rng)
+    corpus_len = len(corpus)
+    next_size = parse_body_size(body_size)
+    mix = parse_type_mix(type_mix)
+    types, weights = list(mix), list(itertools.accumulate(mix.values()))
+    spread = int(updated_on_days * 86400)
+    start = updated_on_end - spread
+
+    for _ in range(count):
+        size = next_size(rng)
+        if size < corpus_len:
+            offset = rng.randrange(corpus_len - size)
+            body = corpus[offset:offset + size]
+        else:
+            body = (corpus * (size // corpus_len + 1))[:size]
+
+        yield {
+            'id': '%032x' % rng.getrandbits(128),
+            'title': 'Note {}'.format(rng.randrange(1 << 30)),
+            'body': body,
+            'note_type': rng.choices(types, cum_weights=weights)[0],
+            'updated_on': start + rng.randint(0, spread)
+        }
+
+
+async def bulk_load(
+    notes_db: AbstractNotesDB,
+    notes: Iterable[Mapping],
+    batch_size: int = 10000
+) -> int:
+    count = 0
+    iterator = iter(notes)
+    while True:
+        batch = [
+            Note.from_api_dm(note)
+            for note in itertools.islice(iterator, batch_size)
+        ]
+        if not batch:
+            return count
+        count += await notes_db.create_notes(batch)
+
+
+async def load_store(
+    notes_db_config: Dict,
+    notes: Iterable[Mapping],
+    batch_size: int = 10000
+) -> Tuple[AbstractNotesDB, int]:
+    '''
+    Bulk loads notes into the store of a notes-db config section, e.g.
+    {'sql': './store.db'} or {'fs': './notes'}.
+    '''
+    notes_db = create_notes_db(notes_db_config)
+    await notes_db.start()
+    try:
+        count = await bulk_load(notes_db, notes, batch_size)
+    finally:
+        await notes_db.stop()
+
+    return notes_db, count
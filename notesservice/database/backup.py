@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+
+class BackupBusyError(RuntimeError):
+    pass
+
+
+def sqlite_backup(
+    source_path: str,
+    target_path: str,
+    step_pages: int,
+    step_pause: float
+) -> Dict[str, Any]:
+    '''
+    Copies the SQLite store at `source_path` to `target_path` with the
+    backup API, `step_pages` pages per step and a `step_pause` sleep after
+    each step. Blocking: run in an executor thread, with a connection of
+    its own.
+
+    The copy runs in one read transaction, which in WAL mode is a snapshot
+    of the store as of the start: writers neither wait for it nor make it
+    restart. The target is written aside and renamed when complete.
+
+    Returns:
+        the target path, its size, pages and backup steps, and the change
+        sequence number (newest sync token) of the snapshot
+
+    Raises:
+        FileExistsError: `target_path` exists already
+    '''
+    if os.path.exists(target_path):
+        raise FileExistsError('Backup {} exists already'.format(target_path))
+    tmp_path = target_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    start = time.perf_counter()
+    steps = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal steps
+        steps += 1
+        time.sleep(step_pause)
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.execute('BEGIN;')
+            # Opens the read transaction (the snapshot)
+            seq = source.execute('''
+                SELECT MAX(
+                    COALESCE((SELECT MAX(seq) FROM notes), 0),
+                    COALESCE((SELECT MAX(seq) FROM tombstones), 0),
+                    (SELECT value FROM sync_state WHERE name = 'horizon')
+                );
+            ''').fetchone()[0]
+            source.backup(target, pages=step_pages, progress=progress)
+            source.execute('COMMIT;')
+            pages = target.execute('PRAGMA page_count;').fetchone()[0]
+        finally:
+            target.close()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+
+    os.replace(tmp_path, target_path)
+    return {
+        'path': target_path,
+        'bytes': os.path.getsize(target_path),
+        'pages': pages,
+        'steps': steps,
+        'seq': seq,
+        'seconds': time.perf_counter() - start
+    }
+
+
+# Creating FilesystemSnapshot class
+class FilesystemSnapshot:
+    '''
+    Point-in-time copy of the files of a filesystem store, taken while the
+    store is written. The files to copy are fixed up front, as groups of
+    keys (note ids, body hashes) with the function that names their files;
+    the engine calls preserve() before it replaces or removes a file,
+    which copies the file first if the snapshot still needs it. Files are
+    hard linked where the filesystem allows, since the engine never writes
+    a file in place, and copied otherwise.
+    '''
+    def __init__(self, store: str, target: str) -> None:
+        self.store = store
+        self.target = target
+        self._pending: Dict[Callable[[str], str], Dict[str, Any]] = {}
+        self._files: List[Tuple[str, int]] = []
+        self._link = True
+        self._dirs: Set[str] = set()
+        self.linked = 0
+        self.copied = 0
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._pending.values())
+
+    def add(self, file_name: Callable[[str], str], keys: Dict) -> None:
+        # The snapshot takes `keys` over and empties it as it copies
+        self._pending[file_name] = keys
+
+    def _target(self, name: str) -> str:
+        target = os.path.join(self.target, name)
+        target_dir = os.path.dirname(target)
+        if target_dir not in self._dirs:
+            os.makedirs(target_dir, exist_ok=True)
+            self._dirs.add(target_dir)
+        return target
+
+    def _copy(self, file_name: str) -> int:
+        name = os.path.relpath(file_name, self.store)
+        target = self._target(name)
+        try:
+            size = os.path.getsize(file_name)
+            if self._link:
+                try:
+                    os.link(file_name, target)
+                    self.linked += 1
+                    self._files.append((name, size))
+                    return 0
+                except OSError:
+                    # Another device, or no hard links: copies from now on
+                    self._link = False
+            shutil.copyfile(file_name, target)
+        except FileNotFoundError:
+            # Not written yet when the snapshot was taken
+            return 0
+        self.copied += 1
+        self._files.append((name, size))
+        return size
+
+    def preserve(self, file_name: Callable[[str], str], key: str) -> None:
+        keys = self._pending.get(file_name)
+        if keys is not None and key in keys:
+            del keys[key]
+            self._copy(file_name(key))
+
+    async def run(self, slice_files: int, slice_bytes: int) -> None:
+        # Copies the pending files in slices of at most `slice_files`
+        # files or `slice_bytes` copied bytes, and lets the event loop run
+        # other tasks after each slice
+        for file_name, keys in self._pending.items():
+            while keys:
+                copied_bytes = 0
+                for _ in range(slice_files):
+                    if not keys or copied_bytes >= slice_bytes:
+                        break
+                    key, _ = keys.popitem()
+                    copied_bytes += self._copy(file_name(key))
+                await asyncio.sleep(0)
+
+    def write(self, name: str, contents: str) -> None:
+        # A file made for the snapshot, e.g. a log as of its start
+        with open(self._target(name), mode='w', encoding='utf-8') as f:
+            f.write(contents)
+        self._files.append((name, len(contents.encode('utf-8'))))
+
+    def write_manifest(self, name: str, **meta: Any) -> Dict[str, Any]:
+        # The manifest lists every file of the snapshot with its size
+        summary = {
+            **meta,
+            'files': len(self._files) + 1,
+            'bytes': sum(size for _, size in self._files),
+            'linked': self.linked,
+            'copied': self.copied
+        }
+        self.write(name, json.dumps({**summary, 'sizes': dict(self._files)}))
+        return summary
@@ -0,0 +1,124 @@
+import lzma
+from typing import Dict, Optional, Union
+import zlib
+
+# First byte of a compressed record, followed by the compressed UTF-8
+# data. Neither can start a plain record: JSON notes start with '{', and
+# the SQLite engine keeps plain bodies as TEXT, compressed ones as BLOB
+FORMAT_ZLIB = 0x01
+FORMAT_LZMA = 0x02
+
+ALGORITHMS = {
+    'zlib': FORMAT_ZLIB,
+    'lzma': FORMAT_LZMA
+}
+
+DEFAULT_MIN_SIZE = 4096
+DEFAULT_LEVELS = {
+    FORMAT_ZLIB: 6,
+    FORMAT_LZMA: 6
+}
+
+
+# Creating BodyCodec class
+class BodyCodec:
+    '''
+    At-rest compression of large note bodies, shared by the persistent
+    engines. Bodies of at least `min_size` characters are compressed with
+    `algorithm` (zlib or lzma, None to store everything plain) when that
+    makes them smaller; every record says how it was stored, so records
+    written with any setting, or before compression existed, stay
+    readable.
+    '''
+    def __init__(
+        self,
+        algorithm: Optional[str] = None,
+        min_size: int = DEFAULT_MIN_SIZE,
+        level: int = None
+    ) -> None:
+        if algorithm is not None and algorithm not in ALGORITHMS:
+            raise ValueError(
+                'Unknown body compression {}, expected one of {}'.format(
+                    algorithm, list(ALGORITHMS)
+                )
+            )
+        self.algorithm = algorithm
+        self.min_size = min_size
+        self._format: Optional[int] = (
+            ALGORITHMS[algorithm] if algorithm else None
+        )
+        self.level = (
+            level if level is not None
+            else DEFAULT_LEVELS[self._format] if self._format is not None
+            else 0
+        )
+        # Records written compressed and the bytes that saved, cumulative
+        # since start: every write counts, rewrites of a note included, so
+        # they are not what the store saves now
+        self.compressed = 0
+        self.saved_bytes = 0
+
+    def should_compress(self, body: str) -> bool:
+        return self._format is not None and len(body) >= self.min_size
+
+    def _compress(self, data: bytes) -> Optional[bytes]:
+        # Marker and compressed data, None if that is not smaller
+        format_ = self._format
+        if format_ is None:
+            return None
+        if format_ == FORMAT_ZLIB:
+            compressed = zlib.compress(data, self.level)
+        else:
+            compressed = lzma.compress(data, preset=self.level)
+        if len(compressed) + 1 >= len(data):
+            return None
+
+        self.compressed += 1
+        self.saved_bytes += len(data) - len(compressed) - 1
+        return bytes((format_,)) + compressed
+
+    def encode_body(self, body: str) -> Union[str, bytes]:
+        # Column value: the body as TEXT, or a compressed BLOB
+        if not self.should_compress(body):
+            return body
+        compressed = self._compress(body.encode('utf-8'))
+        return body if compressed is None else compressed
+
+    def encode_record(self, data: bytes, body: str) -> bytes:
+        # Whole serialized record, compressed when its body is large
+        if not self.should_compress(body):
+            return data
+        compressed = self._compress(data)
+        return data if compressed is None else compressed
+
+    @staticmethod
+    def decode(value: Union[str, bytes]) -> Union[str, bytes]:
+        '''
+        Inverse of encode_body (returns str) and encode_record (returns
+        the plain bytes); plain values are returned as they are.
+
+        Raises:
+            ValueError: unknown format marker
+        '''
+        if isinstance(value, str) or not value or value[0] == ord('{'):
+            return value
+
+        marker = value[0]
+        if marker == FORMAT_ZLIB:
+            data = zlib.decompress(memoryview(value)[1:])
+        elif marker == FORMAT_LZMA:
+            data = lzma.decompress(memoryview(value)[1:])
+        else:
+            raise ValueError('Unknown body format {:#04x}'.format(marker))
+        return data
+
+    def decode_body(self, value: Union[str, bytes]) -> str:
+        if isinstance(value, str):
+            return value
+        return self.decode(value).decode('utf-8')  # type: ignore
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'bodies_compressed': self.compressed,
+            'body_bytes_saved': self.saved_bytes
+        }
@@ -0,0 +1,129 @@
+from typing import Counter, Dict, Iterable, List, Optional, Tuple
+
+# Bodies of at least this many characters are stored once by content
+# hash when deduplication is on
+DEFAULT_DEDUP_MIN_SIZE = 1024
+
+
+# Creating BodyRefs class
+class BodyRefs:
+    '''
+    Shared bodies referenced by each note, by content hash, and the
+    reference count of every body, for the engines without transactions.
+    A write pins the hash of its new body before storing anything and
+    commits it once the note is stored, which releases the note's previous
+    body; in between the note holds both. A body is only unreferenced
+    when no note file can point to it, and a crash leaves at most an
+    extra reference, never a missing one.
+    '''
+    def __init__(self) -> None:
+        # id -> (committed hash or None, pinned hashes)
+        self._notes: Dict[str, Tuple[Optional[str], List[str]]] = {}
+        self._refs: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._notes)
+
+    def __contains__(self, id_: object) -> bool:
+        return id_ in self._notes
+
+    @property
+    def bodies(self) -> int:
+        return len(self._refs)
+
+    @property
+    def pending(self) -> bool:
+        # Writes pinned a body but have not committed (or crashed)
+        return any(pinned for _, pinned in self._notes.values())
+
+    def counts(self) -> Dict[str, int]:
+        # Reference counts by hash, as a new dict
+        return dict(self._refs)
+
+    def copy(self) -> 'BodyRefs':
+        # Entries are tuples, and replaced rather than changed in place
+        refs = BodyRefs()
+        refs._notes = dict(self._notes)
+        refs._refs = Counter(self._refs)
+        return refs
+
+    def refs(self, hash_: str) -> int:
+        return self._refs.get(hash_, 0)
+
+    def clear(self) -> None:
+        self._notes.clear()
+        self._refs.clear()
+
+    def pin(self, id_: str, hash_: str) -> None:
+        committed, pinned = self._notes.get(id_, (None, []))
+        self._notes[id_] = (committed, pinned + [hash_])
+        self._refs[hash_] += 1
+
+    def commit(self, id_: str, hash_: Optional[str]) -> List[str]:
+        '''
+        The note is stored with the body `hash_` (None: inline, or the note
+        is deleted); its pin becomes the reference.
+
+        Returns:
+            hashes of the bodies no note references any more
+        '''
+        committed, pinned = self._notes.get(id_, (None, []))
+        if hash_ is not None:
+            pinned = list(pinned)
+            pinned.remove(hash_)
+        self._set(id_, hash_, pinned)
+        return self._release(committed)
+
+    def unpin(self, id_: str, hash_: str) -> List[str]:
+        # The write failed: only the pin is dropped
+        committed, pinned = self._notes[id_]
+        pinned = list(pinned)
+        pinned.remove(hash_)
+        self._set(id_, committed, pinned)
+        return self._release(hash_)
+
+    def _set(
+        self,
+        id_: str,
+        committed: Optional[str],
+        pinned: List[str]
+    ) -> None:
+        if committed is None and not pinned:
+            self._notes.pop(id_, None)
+        else:
+            self._notes[id_] = (committed, pinned)
+
+    def _release(self, hash_: Optional[str]) -> List[str]:
+        if hash_ is None:
+            return []
+        self._refs[hash_] -= 1
+        if self._refs[hash_] > 0:
+            return []
+        del self._refs[hash_]
+        return [hash_]
+
+    def load(
+        self,
+        id_: str,
+        committed: Optional[str],
+        pinned: Iterable[str] = ()
+    ) -> None:
+        # Replaces the entry of a note, e.g. from a newer log line
+        old_committed, old_pinned = self._notes.get(id_, (None, []))
+        old_hashes: List[Optional[str]] = [old_committed, *old_pinned]
+        for hash_ in old_hashes:
+            self._release(hash_)
+        new_pinned = list(pinned)
+        self._set(id_, committed, new_pinned)
+        for hash_ in new_pinned:
+            self._refs[hash_] += 1
+        if committed is not None:
+            self._refs[committed] += 1
+
+    def entry(self, id_: str) -> List:
+        # [id, committed hash or None, pinned hashes], for the log
+        committed, pinned = self._notes.get(id_, (None, []))
+        return [id_, committed, pinned]
+
+    def entries(self) -> List[List]:
+        return [self.entry(id_) for id_ in self._notes]
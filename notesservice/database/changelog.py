@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from heapq import merge
+from itertools import dropwhile, islice
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from notesservice.datamodel import Note
+
+# Tombstones of deleted notes are kept this long, then compacted away
+DEFAULT_TOMBSTONE_RETENTION = 30 * 86400.0
+
+# Expired tombstones are looked for at most this often (seconds)
+COMPACTION_INTERVAL = 60.0
+
+
+class ChangesExpiredError(Exception):
+    '''
+    The sync token is older than the compacted tombstones (or does not
+    belong to this store): the client has to sync the full list again.
+    '''
+
+
+# Creating NoteChanges class
+class NoteChanges(NamedTuple):
+    notes: List[Tuple[str, Note]]   # created or updated, in change order
+    deleted: List[str]              # tombstones
+    token: int                      # `since` of the next call
+    more: bool                      # limit reached, call again with token
+
+
+# Creating ChangeLog class
+class ChangeLog:
+    '''
+    Change sequence numbers of live notes and tombstones of deleted notes
+    for the engines without a query language. An id is in at most one of
+    the two maps and moves to the end of it on every change, so both are
+    ordered by sequence number and only hold the latest change per id.
+    '''
+    def __init__(
+        self,
+        tombstone_retention: float = DEFAULT_TOMBSTONE_RETENTION
+    ) -> None:
+        self.tombstone_retention = tombstone_retention
+        self.seq = 0
+        # Tombstones up to this sequence number have been compacted
+        self.horizon = 0
+        self._live: 'OrderedDict[str, int]' = OrderedDict()
+        self._deleted: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+        self._last_compaction = 0.0
+
+    def __len__(self) -> int:
+        return len(self._live) + len(self._deleted)
+
+    def __contains__(self, id_: object) -> bool:
+        return id_ in self._live
+
+    @property
+    def tombstones(self) -> int:
+        return len(self._deleted)
+
+    def copy(self) -> 'ChangeLog':
+        changes = ChangeLog(self.tombstone_retention)
+        changes.seq = self.seq
+        changes.horizon = self.horizon
+        changes._live = OrderedDict(self._live)
+        changes._deleted = OrderedDict(self._deleted)
+        return changes
+
+    def live(self) -> Dict[str, int]:
+        # Sequence numbers of the live notes by id, as a new dict
+        return dict(self._live)
+
+    def clear(self) -> None:
+        self.seq = 0
+        self.horizon = 0
+        self._live.clear()
+        self._deleted.clear()
+
+    def record_change(self, id_: str, seq: int = None) -> int:
+        self.seq = max(self.seq + 1, seq or 0)
+        self._deleted.pop(id_, None)
+        self._live.pop(id_, None)
+        self._live[id_] = self.seq
+        return self.seq
+
+    def record_delete(
+        self,
+        id_: str,
+        deleted_on: float = None,
+        seq: int = None
+    ) -> int:
+        self.seq = max(self.seq + 1, seq or 0)
+        self._live.pop(id_, None)
+        self._deleted.pop(id_, None)
+        self._deleted[id_] = (
+            self.seq, time.time() if deleted_on is None else deleted_on
+        )
+        return self.seq
+
+    def entries(self) -> List[Tuple[int, str, Optional[float]]]:
+        # (seq, id, deleted_on or None), in sequence number order
+        live: List[Tuple[int, str, Optional[float]]] = [
+            (seq, id_, None) for id_, seq in self._live.items()
+        ]
+        deleted: List[Tuple[int, str, Optional[float]]] = [
+            (seq, id_, deleted_on)
+            for id_, (seq, deleted_on) in self._deleted.items()
+        ]
+        return sorted(live + deleted)
+
+    def due_for_compaction(self, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        return now - self._last_compaction >= COMPACTION_INTERVAL
+
+    def compact(self, now: float = None) -> int:
+        # Drops the expired tombstones; the oldest ones are at the front
+        now = time.time() if now is None else now
+        self._last_compaction = now
+        cutoff = now - self.tombstone_retention
+        removed = 0
+        while self._deleted:
+            id_, (seq, deleted_on) = next(iter(self._deleted.items()))
+            if deleted_on >= cutoff:
+                break
+            del self._deleted[id_]
+            self.horizon = max(self.horizon, seq)
+            removed += 1
+        return removed
+
+    def check_since(self, since: int) -> None:
+        # since=0 is a full sync, which needs no tombstones
+        if since < 0 or since > self.seq or 0 < since < self.horizon:
+            raise ChangesExpiredError(
+                'Sync token {} expired, sync the full list again'.format(
+                    since
+                )
+            )
+
+    def changes_since(
+        self,
+        since: int,
+        limit: int
+    ) -> Tuple[List[Tuple[int, str, bool]], int, bool]:
+        '''
+        Returns the oldest `limit` changes after `since` as (seq, id,
+        deleted) in sequence number order, the next token, and whether
+        more changes are left.
+        '''
+        self.check_since(since)
+
+        # Both maps are in sequence number order: skip what the client
+        # has already seen and merge the rest forward, stopping one change
+        # past the page instead of collecting and sorting every later one
+        live = dropwhile(
+            lambda change: change[0] <= since,
+            ((seq, id_, False) for id_, seq in self._live.items())
+        )
+        deleted = dropwhile(
+            lambda change: change[0] <= since,
+            ((seq, id_, True) for id_, (seq, _) in self._deleted.items())
+        )
+        changes = list(islice(merge(live, deleted), limit + 1))
+
+        if len(changes) > limit:
+            return changes[:limit], changes[limit - 1][0], True
+        return changes, self.seq, False
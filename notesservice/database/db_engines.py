@@ -1,19 +1,189 @@
-from typing import Dict
+import os
+from typing import Any, Callable, Dict, Optional
 
+from notesservice.database.bodycodec import BodyCodec, DEFAULT_MIN_SIZE
+from notesservice.database.bodyrefs import DEFAULT_DEDUP_MIN_SIZE
+from notesservice.database.changelog import DEFAULT_TOMBSTONE_RETENTION
+from notesservice.database.maintenance import MaintenancePolicy
 from notesservice.database.notes_db import (
     AbstractNotesDB,
     InMemoryNotesDB,
     FilesystemNotesDB,
     SQLiteNotesDB
 )
+from notesservice.database.sharded_db import (
+    RESHARD_BATCH_SIZE,
+    ShardedNotesDB,
+    reshard,
+    shard_paths
+)
+from notesservice.database.tiered_db import (
+    DEFAULT_HOT_TIER_MAX_BYTES,
+    TieredNotesDB
+)
+from notesservice.utils.tinylfu import DEFAULT_WINDOW_FRACTION
+
+ENGINES: Dict[str, Callable[..., AbstractNotesDB]] = {
+    # Bodies are kept as they are in memory
+    'memory': lambda cfg, body_codec, dedup_min_size, maintenance, **options:
+        create_memory_db(cfg, **options),
+    'fs': lambda cfg, maintenance, **options:
+        FilesystemNotesDB(cfg, **options),
+    'sql': lambda cfg, **options: SQLiteNotesDB(cfg, **options)
+}
+
+
+def create_memory_db(config: Dict = None, **options) -> InMemoryNotesDB:
+    # A memory section with max-bytes keeps the notes in memory within
+    # that budget and spills the others to a file in spill-dir; a null
+    # section keeps every note in memory
+    config = config or {}
+    return InMemoryNotesDB(
+        max_bytes=config.get('max-bytes'),
+        spill_dir=config.get('spill-dir'),
+        **options
+    )
+
+
+def create_body_codec(config: Dict = None) -> BodyCodec:
+    # A missing or null body-compression section stores bodies as they
+    # are; compressed bodies are read back either way
+    config = config or {}
+    return BodyCodec(
+        algorithm=config.get('algorithm'),
+        min_size=config.get('min-size', DEFAULT_MIN_SIZE),
+        level=config.get('level')
+    )
 
 
 def create_notes_db(notes_db_config: Dict) -> AbstractNotesDB:
-    db_type = list(notes_db_config.keys())[0]
+    # The engine key (memory, fs or sql) selects the engine, the other
+    # keys of the section are options common to all engines
+    db_types = [k for k in notes_db_config if k in ENGINES]
+    if not db_types:
+        raise KeyError('No notes DB engine in {}'.format(
+            list(notes_db_config)
+        ))
+    db_type = db_types[0]
     db_config = notes_db_config[db_type]
 
-    return {
-        'memory': lambda cfg: InMemoryNotesDB(),
-        'fs': lambda cfg: FilesystemNotesDB(cfg),
-        'sql': lambda cfg: SQLiteNotesDB(cfg)
-    }[db_type](db_config)
+    retention_days = notes_db_config.get('tombstone-retention-days')
+    dedup = notes_db_config.get('body-dedup')
+    options: Dict[str, Any] = {
+        'tombstone_retention': (
+            DEFAULT_TOMBSTONE_RETENTION if retention_days is None
+            else float(retention_days) * 86400
+        ),
+        'body_codec': create_body_codec(
+            notes_db_config.get('body-compression')
+        ),
+        # A missing or null body-dedup section stores every body inline
+        'dedup_min_size': (
+            None if dedup is None
+            else dedup.get('min-size', DEFAULT_DEDUP_MIN_SIZE)
+        )
+    }
+
+    # A missing or null maintenance section runs no background maintenance
+    # (SQLite only); every shard gets a policy of its own
+    maintenance = notes_db_config.get('maintenance')
+
+    def maintenance_policy() -> Optional[MaintenancePolicy]:
+        if maintenance is None:
+            return None
+        return MaintenancePolicy.from_config(maintenance)
+
+    # Several shards hash the notes across as many SQLite files
+    shards = notes_db_config.get('shards') or 1
+    if shards > 1:
+        if db_type != 'sql':
+            raise ValueError('Only the sql engine takes shards')
+        notes_db: AbstractNotesDB = ShardedNotesDB([
+            SQLiteNotesDB(path, maintenance=maintenance_policy(), **options)
+            for path in shard_paths(db_config, shards)
+        ])
+    else:
+        notes_db = ENGINES[db_type](
+            db_config, maintenance=maintenance_policy(), **options
+        )
+
+    # A hot-tier section puts an in-memory tier in front of the engine
+    hot_tier = notes_db_config.get('hot-tier')
+    if hot_tier is not None and db_type != 'memory':
+        notes_db = TieredNotesDB(
+            notes_db,
+            max_bytes=hot_tier.get('max-bytes', DEFAULT_HOT_TIER_MAX_BYTES),
+            window_fraction=hot_tier.get('window', DEFAULT_WINDOW_FRACTION)
+        )
+    return notes_db
+
+
+async def reshard_store(
+    notes_db_config: Dict,
+    shards: int,
+    path: str = None,
+    batch_size: int = RESHARD_BATCH_SIZE
+) -> int:
+    '''
+    Copies the SQLite store of a notes-db config section into a new store
+    of `shards` shards at `path` (default: the same path, under the file
+    names of the new shard count), with the same engine options. Offline:
+    the service must be stopped.
+
+    Returns:
+        the number of notes copied
+
+    Raises:
+        FileExistsError: a file of the new store exists already
+    '''
+    if 'sql' not in notes_db_config:
+        raise ValueError('Only sql stores can be resharded')
+    # The hot tier would only slow the copy down
+    source_config = {
+        **notes_db_config, 'hot-tier': None, 'maintenance': None
+    }
+    target_config = {
+        **source_config,
+        'sql': path or notes_db_config['sql'],
+        'shards': shards
+    }
+    for target_path in shard_paths(target_config['sql'], shards):
+        if os.path.exists(target_path):
+            raise FileExistsError(
+                'Store file {} exists already'.format(target_path)
+            )
+
+    source = create_notes_db(source_config)
+    target = create_notes_db(target_config)
+    await source.start()
+    try:
+        await target.start()
+        try:
+            return await reshard(source, target, batch_size)
+        finally:
+            await target.stop()
+    finally:
+        await source.stop()
+
+
+async def backup_store(notes_db_config: Dict, path: str) -> Dict[str, Any]:
+    '''
+    Backs up the store of a notes-db config section to `path` (for
+    sharded stores, the shard files of `path`). A SQLite store may be
+    served meanwhile; a filesystem store must not be, the snapshot only
+    sees the writes of its own process.
+
+    Returns:
+        the backup summary of the engine
+
+    Raises:
+        FileExistsError: the backup exists already
+    '''
+    notes_db = create_notes_db(
+        {**notes_db_config, 'hot-tier': None, 'maintenance': None}
+    )
+    await notes_db.start()
+    try:
+        return await notes_db.backup(path)
+    finally:
+        await notes_db.stop()
@@ -0,0 +1,136 @@
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Iterable,
+    Mapping,
+    Tuple
+)
+
+from notesservice.database.changelog import NoteChanges
+from notesservice.database.notes_db import AbstractNotesDB
+from notesservice.datamodel import Note
+from notesservice.utils.metrics import MetricsRegistry
+
+
+# Creating InstrumentedNotesDB class
+class InstrumentedNotesDB(AbstractNotesDB):
+    '''
+    Wraps a notes DB engine and records the latency and outcome of every
+    AbstractNotesDB operation in the metrics registry.
+    '''
+    def __init__(
+        self,
+        notes_db: AbstractNotesDB,
+        metrics: MetricsRegistry
+    ) -> None:
+        self._db = notes_db
+        self._engine = type(notes_db).__name__
+        self._metrics = metrics
+        self._latency = metrics.histogram(
+            'notesservice_db_operation_duration_seconds',
+            'Latency of notes DB operations',
+            ('engine', 'operation', 'outcome')
+        )
+        metrics.add_collector(self._collect_stats)
+
+    @property
+    def engine(self) -> AbstractNotesDB:
+        return self._db
+
+    def __getattr__(self, name: str) -> Any:
+        # Engine specific attributes (store, connection, ...) pass through
+        if name == '_db':
+            raise AttributeError(name)
+        return getattr(self._db, name)
+
+    def _observe(self, operation: str, outcome: str, start: float) -> None:
+        self._latency.observe(
+            time.perf_counter() - start,
+            (self._engine, operation, outcome)
+        )
+
+    async def _timed(self, operation: str, coro: Awaitable) -> Any:
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return await coro
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self._observe(operation, outcome, start)
+
+    def _collect_stats(self) -> None:
+        for name, value in self._db.stats().items():
+            self._metrics.gauge(
+                'notesservice_db_' + name,
+                'Notes DB engine statistic {}'.format(name),
+                ('engine',)
+            ).set(value, (self._engine,))
+
+    def stats(self) -> Dict[str, float]:
+        return self._db.stats()
+
+    async def start(self):
+        await self._timed('start', self._db.start())
+
+    async def stop(self):
+        await self._timed('stop', self._db.stop())
+
+    async def _clear(self):
+        await self._timed('clear', self._db._clear())
+
+    async def create_note(
+        self,
+        note: Note,
+        id_: str = None
+    ) -> str:
+        return await self._timed(
+            'create_note', self._db.create_note(note, id_)
+        )
+
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        return await self._timed('create_notes', self._db.create_notes(notes))
+
+    async def read_note(self, id_: str) -> Note:
+        return await self._timed('read_note', self._db.read_note(id_))
+
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        return await self._timed('read_notes', self._db.read_notes(ids))
+
+    async def update_note(self, id_: str, note: Note) -> None:
+        await self._timed('update_note', self._db.update_note(id_, note))
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        await self._timed('patch_note', self._db.patch_note(id_, changes))
+
+    async def delete_note(self, id_: str) -> None:
+        await self._timed('delete_note', self._db.delete_note(id_))
+
+    async def read_all_notes(
+        self
+    ) -> AsyncIterator[Tuple[str, Note]]:
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            async for id_, note in self._db.read_all_notes():
+                yield id_, note
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self._observe('read_all_notes', outcome, start)
+
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        return await self._timed(
+            'read_changes', self._db.read_changes(since, limit)
+        )
+
+    async def collect_bodies(self) -> int:
+        return await self._timed('collect_bodies', self._db.collect_bodies())
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        return await self._timed('backup', self._db.backup(path))
@@ -0,0 +1,141 @@
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MAINTENANCE_INTERVAL = 5.0
+DEFAULT_IDLE_SECONDS = 2.0
+DEFAULT_WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+DEFAULT_OPTIMIZE_INTERVAL = 3600.0
+DEFAULT_MAX_PAUSE = 0.005
+
+# Pages freed by the first incremental vacuum slice; later slices are
+# sized from the time the previous ones took
+INITIAL_VACUUM_PAGES = 32
+MAX_VACUUM_PAGES = 4096
+
+# Rows ANALYZE samples per index when PRAGMA optimize runs it
+ANALYSIS_LIMIT = 400
+
+
+def sqlite_checkpoint(path: str, mode: str) -> Tuple[int, int, int]:
+    '''
+    Checkpoints the WAL of the SQLite store at `path` on a connection of
+    its own. Blocking: run in an executor thread. The connection does not
+    wait for locks: a TRUNCATE checkpoint that would have to wait for a
+    reader or the writer reports busy instead.
+
+    Returns:
+        busy (1 if the checkpoint could not complete), the frames in the
+        WAL and the frames checkpointed
+    '''
+    connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        row = connection.execute(
+            'PRAGMA wal_checkpoint({});'.format(mode)
+        ).fetchone()
+    finally:
+        connection.close()
+    return row[0], row[1], row[2]
+
+
+# Creating MaintenancePolicy class
+class MaintenancePolicy:
+    '''
+    When and how much the background maintenance of a SQLite store does.
+    Every `interval` seconds: a checkpoint once the WAL file has grown to
+    `wal_checkpoint_bytes`, TRUNCATE (giving the space back) if the store
+    has been idle for `idle_seconds`, PASSIVE (never waiting) otherwise.
+    Incremental vacuum and PRAGMA optimize (every `optimize_interval`
+    seconds) only run while the store is idle, in steps that hold the
+    connection for about `max_pause` seconds at most, the latency a
+    request arriving meanwhile can be delayed by.
+    '''
+    def __init__(
+        self,
+        interval: float = DEFAULT_MAINTENANCE_INTERVAL,
+        idle_seconds: float = DEFAULT_IDLE_SECONDS,
+        wal_checkpoint_bytes: int = DEFAULT_WAL_CHECKPOINT_BYTES,
+        optimize_interval: float = DEFAULT_OPTIMIZE_INTERVAL,
+        max_pause: float = DEFAULT_MAX_PAUSE
+    ) -> None:
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.wal_checkpoint_bytes = wal_checkpoint_bytes
+        self.optimize_interval = optimize_interval
+        self.max_pause = max_pause
+        self.vacuum_pages = INITIAL_VACUUM_PAGES
+        self.last_optimize = time.monotonic()
+        self.checkpoints = 0
+        self.truncations = 0
+        self.vacuumed_pages = 0
+        self.optimizations = 0
+        self.deferred = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'MaintenancePolicy':
+        return cls(
+            interval=float(
+                config.get('interval-seconds', DEFAULT_MAINTENANCE_INTERVAL)
+            ),
+            idle_seconds=float(
+                config.get('idle-seconds', DEFAULT_IDLE_SECONDS)
+            ),
+            wal_checkpoint_bytes=int(config.get(
+                'wal-checkpoint-bytes', DEFAULT_WAL_CHECKPOINT_BYTES
+            )),
+            optimize_interval=float(
+                config.get(
+                    'optimize-interval-seconds', DEFAULT_OPTIMIZE_INTERVAL
+                )
+            ),
+            max_pause=float(
+                config.get('max-pause-ms', DEFAULT_MAX_PAUSE * 1000)
+            ) / 1000
+        )
+
+    def checkpoint_mode(self, wal_bytes: int, idle: bool) -> Optional[str]:
+        # None while the WAL is below the threshold
+        if not wal_bytes or wal_bytes < self.wal_checkpoint_bytes:
+            return None
+        return 'TRUNCATE' if idle else 'PASSIVE'
+
+    def optimize_due(self, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return now - self.last_optimize >= self.optimize_interval
+
+    def record_checkpoint(self, mode: str, busy: int, seconds: float) -> None:
+        self.seconds += seconds
+        if busy:
+            self.deferred += 1
+        elif mode == 'TRUNCATE':
+            self.truncations += 1
+        else:
+            self.checkpoints += 1
+
+    def record_vacuum(self, pages: int, seconds: float) -> None:
+        # Sizes the next slice to take `max_pause`, at most doubling it
+        self.seconds += seconds
+        self.vacuumed_pages += pages
+        if seconds > 0:
+            target = int(pages * self.max_pause / seconds)
+            self.vacuum_pages = max(
+                1, min(target, 2 * self.vacuum_pages, MAX_VACUUM_PAGES)
+            )
+
+    def record_optimize(self, seconds: float, now: float = None) -> None:
+        self.seconds += seconds
+        self.optimizations += 1
+        self.last_optimize = time.monotonic() if now is None else now
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'maintenance_checkpoints': self.checkpoints,
+            'maintenance_truncations': self.truncations,
+            'maintenance_vacuumed_pages': self.vacuumed_pages,
+            'maintenance_optimizations': self.optimizations,
+            'maintenance_deferred': self.deferred,
+            'maintenance_errors': self.errors,
+            'maintenance_seconds': self.seconds
+        }
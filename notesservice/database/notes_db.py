@@ -1,13 +1,59 @@
 from abc import ABCMeta, abstractmethod
 import aiofiles  # type: ignore
 import aiosqlite
+import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import itertools
 import json
+import logging
 import os
+import re
+import shutil
 import subprocess
-from typing import AsyncIterator, Dict, Mapping, Tuple
+import sqlite3
+import sys
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union
+)
 import uuid
 
-from notesservice.datamodel import Note
+from notesservice import LOGGER_NAME
+from notesservice.database.backup import (
+    BackupBusyError,
+    FilesystemSnapshot,
+    sqlite_backup
+)
+from notesservice.database.bodycodec import BodyCodec
+from notesservice.database.bodyrefs import BodyRefs
+from notesservice.database.changelog import (
+    ChangeLog,
+    ChangesExpiredError,
+    COMPACTION_INTERVAL,
+    DEFAULT_TOMBSTONE_RETENTION,
+    NoteChanges
+)
+from notesservice.database.maintenance import (
+    ANALYSIS_LIMIT,
+    MaintenancePolicy,
+    sqlite_checkpoint
+)
+from notesservice.database.spill import SpillFile
+from notesservice.datamodel import Note, NoteType
+from notesservice.utils import logutils
+from notesservice.utils.tinylfu import TinyLFUPolicy
 
 
 class AbstractNotesDB(metaclass=ABCMeta):
@@ -47,19 +93,237 @@ class AbstractNotesDB(metaclass=ABCMeta):
     def read_all_notes(self) -> AsyncIterator[Tuple[str, Note]]:
         raise NotImplementedError()
 
+    @abstractmethod
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        '''
+        Notes created or updated and ids deleted after the change sequence
+        number `since` (0 for all notes), oldest first, at most `limit`.
+
+        Raises:
+            ChangesExpiredError: tombstones after `since` were compacted
+        '''
+        raise NotImplementedError()
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        '''
+        Copies the store, as of one point in time, to `path` (which must
+        not exist) while it keeps serving reads and writes.
+
+        Returns:
+            a summary of the backup: path, size, change sequence number, ...
+
+        Raises:
+            NotImplementedError: the engine has no store to back up
+            BackupBusyError: a backup of the store is running already
+        '''
+        raise NotImplementedError(
+            '{} does not support backups'.format(type(self).__name__)
+        )
+
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        # Notes of the given ids that exist, by id; engines override this
+        # with a faster path than one read_note() per id
+        notes = {}
+        for id_ in ids:
+            try:
+                notes[id_] = await self.read_note(id_)
+            except KeyError:
+                pass
+        return notes
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        # Sets only the given API fields (title, body, note_type,
+        # updated_on). Read-modify-write by default; engines override this
+        # to write only what changed
+        note = (await self.read_note(id_)).to_api_dm()
+        await self.update_note(id_, Note.from_api_dm({**note, **changes}))
+
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        # Bulk load notes keyed by their own ids; engines override this
+        # with a faster path than one create_note() per note
+        count = 0
+        for note in notes:
+            await self.create_note(note, note.id)
+            count += 1
+        return count
+
+    async def collect_bodies(self) -> int:
+        # Removes the shared bodies (body deduplication) that no note
+        # references any more, returns how many
+        return 0
+
+    def stats(self) -> Dict[str, float]:
+        # Engine specific statistics (cache hits, sizes, ...) exported as
+        # gauges on the metrics endpoint; engines override as applicable
+        return {}
+
+
+def note_size(note: Note) -> int:
+    # Bytes a note holds in memory: the object, its attribute dict, and
+    # the strings and int it owns (NoteType members are shared)
+    return (
+        sys.getsizeof(note) + sys.getsizeof(note.__dict__) +
+        sys.getsizeof(note.id) + sys.getsizeof(note.title) +
+        sys.getsizeof(note.body) + sys.getsizeof(note.updated_on)
+    )
+
 
 class InMemoryNotesDB(AbstractNotesDB):
-    def __init__(self):
-        self.db: Dict[str, Note] = {}
+    # Bytes of a resident note's entries in `db` and in the eviction
+    # policy, and of a spilled note's entry in `db` (its id and record
+    # reference), as measured with tracemalloc
+    RESIDENT_ENTRY_BYTES = 112
+    SPILLED_ENTRY_BYTES = 64
+
+    # Notes create_notes() evicts before it writes them to the spill file,
+    # and new spill references compaction takes over between other tasks
+    SPILL_BATCH = 256
+    COMPACTION_SLICE = 1024
+
+    def __init__(
+        self,
+        tombstone_retention: float = DEFAULT_TOMBSTONE_RETENTION,
+        max_bytes: int = None,
+        spill_dir: str = None
+    ):
+        # A note, or the reference of its record in the spill file
+        self.db: Dict[str, Union[Note, int]] = {}
+        self.changes = ChangeLog(tombstone_retention)
+        # With a budget, a W-TinyLFU policy keeps the notes in memory
+        # within `max_bytes` and the others are spilled to disk; None
+        # keeps every note in memory
+        self.max_bytes = max_bytes
+        self.policy: Optional[TinyLFUPolicy[str]] = (
+            None if max_bytes is None else TinyLFUPolicy(max_bytes)
+        )
+        self.spill = SpillFile(spill_dir)
+        # The running spill file compaction
+        self._compaction: Optional[asyncio.Future] = None
+        self.spills = 0
+        self.faults = 0
 
     async def start(self):
         pass
 
     async def stop(self):
-        pass
+        while self._compaction is not None:
+            await self._compaction
+        self.spill.close()
 
     async def _clear(self):
+        await self.stop()
         self.db = {}
+        self.changes.clear()
+        if self.policy is not None:
+            self.policy.clear()
+        self.spill.close()
+
+    def note_bytes(self, note: Note) -> int:
+        return note_size(note) + self.RESIDENT_ENTRY_BYTES
+
+    def _put(self, id_: str, note: Note) -> List[str]:
+        '''
+        Stores a note in memory.
+
+        Returns:
+            the ids of the notes evicted to make room, to _spill()
+        '''
+        previous = self.db.get(id_)
+        self.db[id_] = note
+        if self.policy is None:
+            return []
+        if isinstance(previous, int):
+            self._release(previous)
+        return self.policy.add(id_, self.note_bytes(note))
+
+    async def _spill(self, ids: List[str]) -> None:
+        # Evicted notes stay in memory until their records are written,
+        # all with one write; a note written or deleted meanwhile keeps
+        # its new entry and the record is garbage
+        policy = self.policy
+        if policy is None or not ids:
+            return
+        evicted = {}
+        for id_ in ids:
+            note = self.db.get(id_)
+            if isinstance(note, Note) and id_ not in policy:
+                evicted[id_] = note
+        if not evicted:
+            return
+        refs = await self.spill.write(list(evicted.values()))
+        for (id_, note), ref in zip(evicted.items(), refs):
+            if self.db.get(id_) is note and id_ not in policy:
+                self.db[id_] = ref
+                self.spills += 1
+            else:
+                self._release(ref)
+
+    def _release(self, ref: int) -> None:
+        # A spilled record is no longer needed; once garbage is half the
+        # spill file, the live records are copied into a new one
+        self.spill.release(ref)
+        if self._compaction is None and self.spill.due_for_compaction():
+            self._compaction = asyncio.ensure_future(self._compact())
+
+    async def _compact(self) -> None:
+        # Background task: the new references are taken over in slices,
+        # the records of notes written or deleted meanwhile are released
+        try:
+            ids, refs, new_refs = await self.spill.compact(
+                list(self.db), list(self.db.values())
+            )
+            for start in range(0, len(ids), self.COMPACTION_SLICE):
+                for i in range(
+                    start, min(start + self.COMPACTION_SLICE, len(ids))
+                ):
+                    if self.db.get(ids[i]) == refs[i]:
+                        self.db[ids[i]] = new_refs[i]
+                    else:
+                        self.spill.release(new_refs[i])
+                await asyncio.sleep(0)
+            self.spill.retire()
+        except Exception as e:
+            logutils.log(
+                logging.getLogger(LOGGER_NAME),
+                logging.ERROR,
+                message='SPILL_COMPACTION',
+                error=str(e)
+            )
+        finally:
+            if self._compaction is asyncio.current_task():
+                self._compaction = None
+
+    def _remove(self, id_: str) -> None:
+        entry = self.db.pop(id_)
+        if self.policy is None:
+            return
+        if isinstance(entry, int):
+            self._release(entry)
+        else:
+            self.policy.remove(id_)
+
+    async def _get(self, id_: str) -> Note:
+        # A read: counts towards the note's popularity, and faults it back
+        # into memory if it was spilled (and not written meanwhile)
+        entry = self.db[id_]
+        if self.policy is None:
+            return entry  # type: ignore
+        self.policy.access(id_)
+        if isinstance(entry, Note):
+            return entry
+        note = await self.spill.read(entry)
+        self.faults += 1
+        if self.db.get(id_) == entry:
+            await self._spill(self._put(id_, note))
+        return note
+
+    async def _peek(self, id_: str) -> Note:
+        # Listings and syncs read spilled notes without faulting them in,
+        # they would flush the popular notes
+        entry = self.db[id_]
+        if isinstance(entry, Note):
+            return entry
+        return await self.spill.read(entry)
 
     async def create_note(
         self,
@@ -72,33 +336,121 @@ class InMemoryNotesDB(AbstractNotesDB):
         if id_ in self.db:
             raise KeyError('{} already exists'.format(id_))
 
-        self.db[id_] = note
+        evicted = self._put(id_, note)
+        self.changes.record_change(id_)
+        await self._spill(evicted)
         return id_
 
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        # A batch with an id that exists already, or twice, stores none of
+        # it; evicted notes are spilled in batches
+        batch = list(notes)
+        ids: Set[str] = set()
+        for note in batch:
+            if note.id in self.db or note.id in ids:
+                raise KeyError('{} already exists'.format(note.id))
+            ids.add(note.id)
+        count = 0
+        evicted: List[str] = []
+        try:
+            for note in batch:
+                # Created meanwhile, while evicted notes were spilled
+                if note.id in self.db:
+                    raise KeyError('{} already exists'.format(note.id))
+                evicted.extend(self._put(note.id, note))
+                self.changes.record_change(note.id)
+                count += 1
+                if len(evicted) >= self.SPILL_BATCH:
+                    await self._spill(evicted)
+                    evicted = []
+        finally:
+            await self._spill(evicted)
+        return count
+
     async def read_note(self, id_: str) -> Note:
-        return self.db[id_]
+        return await self._get(id_)
+
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        notes = {}
+        for id_ in ids:
+            if id_ in self.db:
+                notes[id_] = await self._get(id_)
+        return notes
 
     async def update_note(self, id_: str, note: Note) -> None:
         if id_ is None or id_ not in self.db:
             raise KeyError('{} does not exist'.format(id_))
 
-        self.db[id_] = note
+        evicted = self._put(id_, note)
+        self.changes.record_change(id_)
+        await self._spill(evicted)
 
     async def delete_note(self, id_: str) -> None:
         if id_ is None or id_ not in self.db:
             raise KeyError('{} does not exist'.format(id_))
 
-        del self.db[id_]
+        self._remove(id_)
+        self.changes.record_delete(id_)
+        if self.changes.due_for_compaction():
+            self.changes.compact()
 
     async def read_all_notes(
         self
     ) -> AsyncIterator[Tuple[str, Note]]:
-        for id_, note in self.db.items():
-            yield id_, note
+        for id_ in list(self.db):
+            if id_ in self.db:
+                yield id_, await self._peek(id_)
+
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        changes, token, more = self.changes.changes_since(since, limit)
+        notes = []
+        for _, id_, deleted in changes:
+            if not deleted and id_ in self.db:
+                # Not deleted meanwhile (else the next call returns its
+                # tombstone)
+                notes.append((id_, await self._peek(id_)))
+        return NoteChanges(
+            notes=notes,
+            deleted=[id_ for _, id_, deleted in changes if deleted],
+            token=token,
+            more=more
+        )
+
+    def stats(self) -> Dict[str, float]:
+        stats: Dict[str, float] = {'tombstones': self.changes.tombstones}
+        if self.policy is not None:
+            spilled = len(self.db) - len(self.policy)
+            stats.update({
+                'resident_notes': len(self.policy),
+                'resident_bytes': self.policy.size,
+                'spilled_notes': spilled,
+                # Memory the spilled notes still take
+                'spilled_index_bytes': spilled * self.SPILLED_ENTRY_BYTES,
+                'spill_file_bytes': self.spill.size,
+                'spill_garbage_bytes': self.spill.garbage,
+                'spills': self.spills,
+                'faults': self.faults
+            })
+        return stats
 
 
 class FilesystemNotesDB(AbstractNotesDB):
-    def __init__(self, store_dir_path: str):
+    # Change log compaction kicks in when it has this many more lines than
+    # live entries
+    CHANGE_LOG_SLACK = 1024
+
+    # Files a backup links (or copies) before it lets other tasks run, and
+    # the most bytes it copies in one go
+    BACKUP_SLICE_FILES = 256
+    BACKUP_SLICE_BYTES = 1 << 20
+
+    def __init__(
+        self,
+        store_dir_path: str,
+        tombstone_retention: float = DEFAULT_TOMBSTONE_RETENTION,
+        body_codec: BodyCodec = None,
+        dedup_min_size: int = None
+    ):
         store_dir = os.path.abspath(store_dir_path)
         if not os.path.exists(store_dir):
             os.makedirs(store_dir)
@@ -109,9 +461,41 @@ class FilesystemNotesDB(AbstractNotesDB):
                 )
             )
         self._store = store_dir
+        self._tombstone_retention = tombstone_retention
+        self._changes: Optional[ChangeLog] = None
+        self._change_log_lines = 0
+        # Serializes the log writes, created on first use
+        self._meta_lock: Optional[asyncio.Lock] = None
+        self._tmp_names = itertools.count()
+        self.body_codec = body_codec or BodyCodec()
+        # Bodies of at least this size are stored once, by content hash,
+        # in _meta/bodies; None stores every body in its note file
+        self.dedup_min_size = dedup_min_size
+        self._refs: Optional[BodyRefs] = None
+        self._body_log_lines = 0
+        self._has_body_log = False
+        self._has_bodies_dir = False
+        # Removals of unreferenced bodies in flight, by hash
+        self._removals: Dict[str, asyncio.Future] = {}
+        # The running backup, which copies files before they change
+        self._snapshot: Optional[FilesystemSnapshot] = None
+        # Writes under way; while a backup takes its point in time, set
+        # until it has, new writes wait and the last one under way sets
+        # _writes_drained
+        self._writes = 0
+        self._backup_pause: Optional[asyncio.Event] = None
+        # Per note being written: [lock, writes holding or awaiting it]
+        self._note_locks: Dict[str, List] = {}
+        self._writes_drained: Optional[asyncio.Event] = None
 
     async def start(self):
-        pass
+        await self._change_log()
+        refs = await self._body_refs()
+        if refs.pending:
+            # Writes were cut short: count the references again
+            await self._recount_body_refs()
+        if self.dedup_min_size is not None or self._has_body_log:
+            await self.collect_bodies()
 
     async def stop(self):
         pass
@@ -119,6 +503,10 @@ class FilesystemNotesDB(AbstractNotesDB):
     async def _clear(self):
         cmd = "rm -rf {0}/*".format(self.store)
         subprocess.check_output(cmd, shell=True)
+        self._changes = None
+        self._refs = None
+        self._has_body_log = False
+        self._has_bodies_dir = False
 
     @property
     def store(self) -> str:
@@ -130,31 +518,449 @@ class FilesystemNotesDB(AbstractNotesDB):
             id_ + '.json'
         )
 
+    def _change_log_file(self) -> str:
+        # Auxiliary files live in a subdirectory, next to the note files
+        return os.path.join(self.store, '_meta', 'changes.log')
+
+    def _read_change_log(self) -> Tuple[ChangeLog, int, List[str]]:
+        # Blocking, run in an executor thread: the change log, its length
+        # in lines and the ids of the note files in the store
+        changes = ChangeLog(self._tombstone_retention)
+        lines = 0
+        try:
+            with open(self._change_log_file(), encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    lines += 1
+                    if isinstance(entry, dict):
+                        changes.horizon = entry['horizon']
+                        changes.seq = max(changes.seq, entry['horizon'])
+                    elif entry[2] is None:
+                        changes.record_change(entry[1], entry[0])
+                    else:
+                        changes.record_delete(entry[1], entry[2], entry[0])
+        except FileNotFoundError:
+            meta_dir = os.path.dirname(self._change_log_file())
+            os.makedirs(meta_dir, exist_ok=True)
+
+        ids = [
+            name[:-len('.json')] for name in os.listdir(self.store)
+            if name.endswith('.json')
+        ]
+        return changes, lines, ids
+
+    async def _change_log(self) -> ChangeLog:
+        # Loaded on first use: JSON lines of [seq, id, deleted_on or null]
+        # and {"horizon": seq} headers written by compaction
+        if self._changes is not None:
+            return self._changes
+
+        loop = asyncio.get_event_loop()
+        changes, lines, ids = await loop.run_in_executor(
+            None, self._read_change_log
+        )
+        if self._changes is not None:
+            # Loaded by another task meanwhile
+            return self._changes
+        self._changes = changes
+        self._change_log_lines = lines
+
+        # Notes written before the store had a change log
+        await self._log_changes([id_ for id_ in ids if id_ not in changes])
+        return changes
+
+    async def _write_meta(self, write: Callable[..., None], *args) -> None:
+        # Log writes run in an executor thread, one at a time and in the
+        # order they were issued, so that later lines of an id land after
+        # its earlier ones
+        if self._meta_lock is None:
+            self._meta_lock = asyncio.Lock()
+        async with self._meta_lock:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, write, *args)
+
+    @staticmethod
+    def _append_lines(file_name: str, entries: List) -> None:
+        with open(file_name, mode='a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+
+    @staticmethod
+    def _replace_file(file_name: str, text: Callable[[], str]) -> None:
+        with open(file_name + '.tmp', mode='w', encoding='utf-8') as f:
+            f.write(text())
+        os.replace(file_name + '.tmp', file_name)
+
+    async def _append_change_log(self, entries: List) -> None:
+        self._change_log_lines += len(entries)
+        await self._write_meta(
+            self._append_lines, self._change_log_file(), entries
+        )
+
+    async def _log_changes(self, ids: List[str]) -> None:
+        changes = await self._change_log()
+        if ids:
+            await self._append_change_log([
+                [changes.record_change(id_), id_, None] for id_ in ids
+            ])
+
+    async def _log_delete(self, id_: str) -> None:
+        changes = await self._change_log()
+        deleted_on = time.time()
+        seq = changes.record_delete(id_, deleted_on)
+        await self._append_change_log([[seq, id_, deleted_on]])
+
+        removed = changes.compact() if changes.due_for_compaction() else 0
+        slack = self._change_log_lines - len(changes)
+        if removed or slack > max(len(changes), self.CHANGE_LOG_SLACK):
+            # The log as of now: changes made meanwhile are queued behind
+            # the rewrite and appended after it
+            await self._rewrite_change_log(changes.copy())
+
+    @staticmethod
+    def _change_log_text(changes: ChangeLog) -> str:
+        # Only the latest entry per id and the unexpired tombstones
+        return json.dumps({'horizon': changes.horizon}) + '\n' + ''.join(
+            json.dumps(list(entry)) + '\n' for entry in changes.entries()
+        )
+
+    async def _rewrite_change_log(self, changes: ChangeLog) -> None:
+        self._change_log_lines = len(changes) + 1
+        await self._write_meta(
+            self._replace_file,
+            self._change_log_file(),
+            lambda: self._change_log_text(changes)
+        )
+
+    def _body_file(self, hash_: str) -> str:
+        return os.path.join(self.store, '_meta', 'bodies', hash_ + '.json')
+
+    def _body_log_file(self) -> str:
+        return os.path.join(self.store, '_meta', 'bodies.log')
+
+    def _read_body_log(self) -> Tuple[BodyRefs, int, bool]:
+        # Blocking, run in an executor thread: the references, the length
+        # of the log in lines and whether there is a log
+        refs = BodyRefs()
+        lines = 0
+        try:
+            with open(self._body_log_file(), encoding='utf-8') as f:
+                for line in f:
+                    refs.load(*json.loads(line))
+                    lines += 1
+        except FileNotFoundError:
+            return refs, 0, False
+        return refs, lines, True
+
+    async def _body_refs(self) -> BodyRefs:
+        # Loaded on first use: JSON lines of [id, hash or null, [pinned
+        # hashes]], the latest line of an id replaces the earlier ones
+        if self._refs is not None:
+            return self._refs
+
+        loop = asyncio.get_event_loop()
+        refs, lines, exists = await loop.run_in_executor(
+            None, self._read_body_log
+        )
+        if self._refs is not None:
+            # Loaded by another task meanwhile
+            return self._refs
+        self._refs = refs
+        self._body_log_lines = lines
+        self._has_body_log = exists
+        return refs
+
+    async def _append_body_log(self, ids: Iterable[str]) -> None:
+        refs = await self._body_refs()
+        entries = [refs.entry(id_) for id_ in ids]
+        self._body_log_lines += len(entries)
+        self._has_body_log = True
+        await self._write_meta(
+            self._append_lines, self._body_log_file(), entries
+        )
+
+        if self._body_log_lines - len(refs) > max(
+            len(refs), self.CHANGE_LOG_SLACK
+        ):
+            await self._rewrite_body_log(refs.copy())
+
+    @staticmethod
+    def _body_log_text(refs: BodyRefs) -> str:
+        return ''.join(json.dumps(entry) + '\n' for entry in refs.entries())
+
+    async def _rewrite_body_log(self, refs: BodyRefs) -> None:
+        # With the references as of now, like the change log
+        self._body_log_lines = len(refs)
+        self._has_body_log = True
+        await self._write_meta(
+            self._replace_file,
+            self._body_log_file(),
+            lambda: self._body_log_text(refs)
+        )
+
+    def _body_hash(self, body: str) -> Optional[str]:
+        # Content hash of a body stored once, None for one stored inline
+        if self.dedup_min_size is None or len(body) < self.dedup_min_size:
+            return None
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+    async def _pin_bodies(self, pins: List[Tuple[str, str]]) -> None:
+        refs = await self._body_refs()
+        for id_, hash_ in pins:
+            refs.pin(id_, hash_)
+        if not self._has_bodies_dir:
+            bodies_dir = os.path.dirname(self._body_file(''))
+            await self._write_meta(
+                lambda: os.makedirs(bodies_dir, exist_ok=True)
+            )
+            self._has_bodies_dir = True
+        await self._append_body_log(id_ for id_, _ in pins)
+        # Bodies being removed are gone before a write checks for them
+        removals = [
+            self._removals[hash_] for _, hash_ in pins
+            if hash_ in self._removals
+        ]
+        if removals:
+            await asyncio.wait(removals)
+
+    async def _commit_bodies(
+        self,
+        commits: List[Tuple[str, Optional[str]]],
+        unpins: List[Tuple[str, str]] = None
+    ) -> None:
+        # The note files are written (or the writes failed): bodies no
+        # note references any more are removed right away
+        refs = await self._body_refs()
+        unreferenced: List[str] = []
+        for id_, hash_ in commits:
+            unreferenced.extend(refs.commit(id_, hash_))
+        unpins = unpins or []
+        for id_, hash_ in unpins:
+            unreferenced.extend(refs.unpin(id_, hash_))
+        await self._append_body_log(
+            [id_ for id_, _ in commits] + [id_ for id_, _ in unpins]
+        )
+        await self._remove_bodies(unreferenced)
+
+    @staticmethod
+    def _remove_files(file_names: List[str]) -> None:
+        for file_name in file_names:
+            try:
+                os.remove(file_name)
+            except FileNotFoundError:
+                pass
+
+    async def _remove_bodies(self, hashes: List[str]) -> None:
+        # Removed in an executor thread; a write pinning one of the bodies
+        # meanwhile waits for the removal, then stores the body again
+        if not hashes:
+            return
+        for hash_ in hashes:
+            self._preserve(self._body_file, hash_)
+        loop = asyncio.get_event_loop()
+        removal = loop.run_in_executor(
+            None, self._remove_files, [self._body_file(h) for h in hashes]
+        )
+        for hash_ in hashes:
+            self._removals[hash_] = removal
+        try:
+            await removal
+        finally:
+            for hash_ in hashes:
+                if self._removals.get(hash_) is removal:
+                    del self._removals[hash_]
+
+    def _stored_note(self, note: Mapping, hash_: Optional[str]) -> Mapping:
+        # A shared body is replaced by its hash in the note file
+        if hash_ is None:
+            return note
+        return {**note, 'body': '', 'body_hash': hash_}
+
+    @asynccontextmanager
+    async def _writing(self, id_: str = None) -> AsyncIterator[None]:
+        # A write, from its first file change to its change log entry: a
+        # backup takes its point in time between writes. The writes of a
+        # note `id_` run one at a time, its checks and reads included
+        if id_ is None:
+            async with self._counted_write():
+                yield
+            return
+        note_lock = self._note_locks.setdefault(id_, [asyncio.Lock(), 0])
+        note_lock[1] += 1
+        try:
+            async with note_lock[0], self._counted_write():
+                yield
+        finally:
+            note_lock[1] -= 1
+            if not note_lock[1]:
+                del self._note_locks[id_]
+
+    @asynccontextmanager
+    async def _counted_write(self) -> AsyncIterator[None]:
+        while self._backup_pause is not None:
+            await self._backup_pause.wait()
+        self._writes += 1
+        try:
+            yield
+        finally:
+            self._writes -= 1
+            if not self._writes and self._writes_drained is not None:
+                self._writes_drained.set()
+
+    def _preserve(self, file_name: Callable[[str], str], key: str) -> None:
+        # Called before a note or body file is replaced or removed
+        if self._snapshot is not None:
+            self._snapshot.preserve(file_name, key)
+
     def _file_exists(self, id_: str) -> bool:
         return os.path.exists(self._file_name(id_))
 
+    def _encode_note(self, note: Mapping) -> bytes:
+        # Note JSON, compressed as a whole when the body is large
+        data = json.dumps(note).encode('utf-8')
+        return self.body_codec.encode_record(data, note.get('body', ''))
+
+    async def _read_json(self, file_name: str) -> Dict:
+        async with aiofiles.open(file_name, mode='rb') as f:
+            contents = await f.read()
+            return json.loads(self.body_codec.decode(contents))
+
     async def _file_read(self, id_: str) -> Dict:
+        # A shared body can go away between reading the note and the body
+        # when the note is written meanwhile: the note is read again
+        for attempt in range(2):
+            try:
+                note = await self._read_json(self._file_name(id_))
+            except FileNotFoundError:
+                raise KeyError(id_)
+            if 'body_hash' not in note:
+                return note
+            try:
+                body = await self._read_json(
+                    self._body_file(note.pop('body_hash'))
+                )
+            except FileNotFoundError:
+                continue
+            note['body'] = body['body']
+            return note
+        raise KeyError(id_)
+
+    async def _atomic_write(self, file_name: str, data: bytes) -> None:
+        # Written aside and renamed over the file, so that a concurrent
+        # read sees the old or the new file but never a partial one
+        tmp_name = '{}.{}.tmp'.format(file_name, next(self._tmp_names))
         try:
-            async with aiofiles.open(
-                self._file_name(id_),
-                encoding='utf-8',
-                mode='r'
-            ) as f:
-                contents = await f.read()
-                return json.loads(contents)
-        except FileNotFoundError:
-            raise KeyError(id_)
+            async with aiofiles.open(tmp_name, mode='wb') as f:
+                await f.write(data)
+            os.replace(tmp_name, file_name)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
 
     async def _file_write(self, id_: str, note: Mapping) -> None:
-        async with aiofiles.open(
-            self._file_name(id_),
-            mode='w',
-            encoding='utf-8'
-        ) as f:
-            await f.write(json.dumps(note))
+        hash_ = self._body_hash(note['body'])
+        refs = await self._body_refs()
+        self._preserve(self._file_name, id_)
+        if hash_ is None and id_ not in refs:
+            await self._atomic_write(
+                self._file_name(id_), self._encode_note(note)
+            )
+            return
+
+        # The new body is pinned before anything is written, the previous
+        # one released once the note file points to the new one
+        if hash_ is not None:
+            await self._pin_bodies([(id_, hash_)])
+        try:
+            if hash_ is not None and not os.path.exists(
+                self._body_file(hash_)
+            ):
+                await self._atomic_write(
+                    self._body_file(hash_),
+                    self._encode_note({'body': note['body']})
+                )
+            await self._atomic_write(
+                self._file_name(id_),
+                self._encode_note(self._stored_note(note, hash_))
+            )
+        except BaseException:
+            if hash_ is not None:
+                await self._commit_bodies([], [(id_, hash_)])
+            raise
+        await self._commit_bodies([(id_, hash_)])
+
+    def _files_write(
+        self,
+        notes: List[Note],
+        hashes: Dict[str, Optional[str]],
+        written: List[str]
+    ) -> None:
+        # Blocking bulk write, run in an executor thread; the shared
+        # bodies are pinned and committed by the caller. A batch with an id
+        # that exists already, or twice, writes none of it
+        ids: Set[str] = set()
+        for note in notes:
+            if note.id in ids or os.path.exists(self._file_name(note.id)):
+                raise KeyError('{} already exists'.format(note.id))
+            ids.add(note.id)
+        for note in notes:
+            file_name = self._file_name(note.id)
+            api_note = note.to_api_dm()
+            hash_ = hashes[note.id]
+            if hash_ is not None and not os.path.exists(
+                self._body_file(hash_)
+            ):
+                body_file = self._body_file(hash_)
+                tmp_name = '{}.{}.tmp'.format(
+                    body_file, next(self._tmp_names)
+                )
+                with open(tmp_name, mode='wb') as f:
+                    f.write(self._encode_note({'body': note.body}))
+                os.replace(tmp_name, body_file)
+            with open(file_name, mode='wb') as f:
+                f.write(self._encode_note(self._stored_note(api_note, hash_)))
+            written.append(note.id)
 
     async def _file_delete(self, id_: str) -> None:
+        self._preserve(self._file_name, id_)
         os.remove(self._file_name(id_))
+        if id_ in await self._body_refs():
+            await self._commit_bodies([(id_, None)])
+
+    async def _recount_body_refs(self) -> None:
+        # References as stored in the note files
+        refs = await self._body_refs()
+        refs.clear()
+        loop = asyncio.get_event_loop()
+        names = await loop.run_in_executor(None, os.listdir, self.store)
+        for name in names:
+            if name.endswith('.json'):
+                try:
+                    note = await self._read_json(
+                        os.path.join(self.store, name)
+                    )
+                except FileNotFoundError:
+                    continue
+                if 'body_hash' in note:
+                    refs.load(name[:-len('.json')], note['body_hash'])
+        await self._rewrite_body_log(refs.copy())
+
+    async def collect_bodies(self) -> int:
+        # Bodies left behind by writes that were cut short
+        refs = await self._body_refs()
+        loop = asyncio.get_event_loop()
+        try:
+            names = await loop.run_in_executor(
+                None, os.listdir, os.path.dirname(self._body_file(''))
+            )
+        except FileNotFoundError:
+            return 0
+        unreferenced = [
+            name[:-len('.json')] for name in names
+            if name.endswith('.json') and not refs.refs(name[:-len('.json')])
+        ]
+        await self._remove_bodies(unreferenced)
+        return len(unreferenced)
 
     async def _file_read_all(self) -> AsyncIterator[Tuple[str, Dict]]:
         all_files = os.listdir(self.store)
@@ -174,27 +980,74 @@ class FilesystemNotesDB(AbstractNotesDB):
         if id_ is None:
             id_ = uuid.uuid4().hex
 
-        if self._file_exists(id_):
-            raise KeyError('{} already exists'.format(id_))
+        async with self._writing(id_):
+            if self._file_exists(id_):
+                raise KeyError('{} already exists'.format(id_))
 
-        await self._file_write(id_, note.to_api_dm())
+            await self._file_write(id_, note.to_api_dm())
+            await self._log_changes([id_])
         return id_
 
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        async with self._writing():
+            return await self._create_notes(list(notes))
+
+    async def _create_notes(self, batch: List[Note]) -> int:
+        hashes = {note.id: self._body_hash(note.body) for note in batch}
+        pins: List[Tuple[str, str]] = [
+            (id_, h) for id_, h in hashes.items() if h is not None
+        ]
+        if pins:
+            await self._pin_bodies(pins)
+        written: List[str] = []
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(
+                None, self._files_write, batch, hashes, written
+            )
+        finally:
+            await self._log_changes(written)
+            if pins:
+                done = set(written)
+                commits: List[Tuple[str, Optional[str]]] = [
+                    (id_, h) for id_, h in pins if id_ in done
+                ]
+                await self._commit_bodies(
+                    commits, [(id_, h) for id_, h in pins if id_ not in done]
+                )
+        return len(batch)
+
     async def read_note(self, id_: str) -> Note:
         note = await self._file_read(id_)
         return Note.from_api_dm(note)
 
     async def update_note(self, id_: str, note: Note) -> None:
-        if self._file_exists(id_):
-            await self._file_write(id_, note.to_api_dm())
-        else:
-            raise KeyError(id_)
+        async with self._writing(id_):
+            if self._file_exists(id_):
+                await self._file_write(id_, note.to_api_dm())
+                await self._log_changes([id_])
+            else:
+                raise KeyError(id_)
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        # Read-modify-write on the stored JSON: no Note round trip, and the
+        # file is serialized once. The read is part of the write, so a
+        # delete or another write of the note cannot come in between
+        async with self._writing(id_):
+            if not self._file_exists(id_):
+                raise KeyError(id_)
+            note = await self._file_read(id_)
+            note.update(changes)
+            await self._file_write(id_, note)
+            await self._log_changes([id_])
 
     async def delete_note(self, id_: str) -> None:
-        if self._file_exists(id_):
-            await self._file_delete(id_)
-        else:
-            raise KeyError(id_)
+        async with self._writing(id_):
+            if self._file_exists(id_):
+                await self._file_delete(id_)
+                await self._log_delete(id_)
+            else:
+                raise KeyError(id_)
 
     async def read_all_notes(
         self
@@ -202,14 +1055,205 @@ class FilesystemNotesDB(AbstractNotesDB):
         async for id_, note in self._file_read_all():
             yield id_, Note.from_api_dm(note)
 
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        changes, token, more = (await self._change_log()).changes_since(
+            since, limit
+        )
+        notes = []
+        deleted = []
+        for _, id_, is_deleted in changes:
+            if is_deleted:
+                deleted.append(id_)
+                continue
+            try:
+                notes.append((id_, Note.from_api_dm(
+                    await self._file_read(id_)
+                )))
+            except KeyError:
+                # Deleted meanwhile: the next call returns its tombstone
+                pass
+        return NoteChanges(notes, deleted, token, more)
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        '''
+        Copies the store as of the start of the backup into the directory
+        `path`: the note and body files listed by the change log and body
+        references at that moment, in slices that let requests run in
+        between, and logs and a manifest (_meta/manifest.json) as of that
+        moment. The point in time is taken once the writes under way are
+        complete, new writes waiting meanwhile; later writes copy the files
+        they replace or remove first. The directory is built aside and
+        renamed when complete.
+        '''
+        if self._snapshot is not None or self._backup_pause is not None:
+            raise BackupBusyError('A backup of {} is running'.format(
+                self.store
+            ))
+        target = os.path.abspath(path)
+        if os.path.exists(target):
+            raise FileExistsError('Backup {} exists already'.format(target))
+        tmp_target = target + '.tmp'
+        if os.path.exists(tmp_target):
+            shutil.rmtree(tmp_target)
+
+        # The point in time, between writes: a write under way may have
+        # changed files but not yet the logs
+        start = time.perf_counter()
+        self._backup_pause = pause = asyncio.Event()
+        try:
+            while self._writes:
+                self._writes_drained = asyncio.Event()
+                await self._writes_drained.wait()
+            changes = (await self._change_log()).copy()
+            refs = (await self._body_refs()).copy()
+        finally:
+            self._writes_drained = None
+            self._backup_pause = None
+            pause.set()
+        snapshot = FilesystemSnapshot(self.store, tmp_target)
+        snapshot.add(self._file_name, changes.live())
+        snapshot.add(self._body_file, refs.counts())
+        self._snapshot = snapshot
+        try:
+            await snapshot.run(
+                self.BACKUP_SLICE_FILES, self.BACKUP_SLICE_BYTES
+            )
+            self._snapshot = None
+
+            def write_meta() -> Dict[str, Any]:
+                meta_dir = os.path.relpath(
+                    os.path.dirname(self._change_log_file()), self.store
+                )
+                snapshot.write(
+                    os.path.join(meta_dir, 'changes.log'),
+                    self._change_log_text(changes)
+                )
+                snapshot.write(
+                    os.path.join(meta_dir, 'bodies.log'),
+                    self._body_log_text(refs)
+                )
+                return snapshot.write_manifest(
+                    os.path.join(meta_dir, 'manifest.json'),
+                    seq=changes.seq,
+                    notes=len(changes) - changes.tombstones,
+                    bodies=refs.bodies,
+                    created_on=time.time()
+                )
+
+            loop = asyncio.get_event_loop()
+            summary = await loop.run_in_executor(None, write_meta)
+            os.replace(tmp_target, target)
+        except BaseException:
+            self._snapshot = None
+            shutil.rmtree(tmp_target, ignore_errors=True)
+            raise
+
+        return {
+            'path': target,
+            **summary,
+            'seconds': time.perf_counter() - start
+        }
+
+    def stats(self) -> Dict[str, float]:
+        stats = self.body_codec.stats()
+        if self._changes is not None:
+            stats['tombstones'] = self._changes.tombstones
+        if self._refs is not None:
+            stats['shared_bodies'] = self._refs.bodies
+        return stats
+
+
+# Note ids that are stored as 16 byte BLOBs by the SQLite engine; any
+# other id is stored as TEXT in the same column
+HEX_ID_RE = re.compile('[0-9a-f]{32}')
+
+# Integer note_type column values; a dict lookup is much cheaper than
+# NoteType(value) when converting every row of a listing
+NOTE_TYPES_BY_VALUE = {t.value: t for t in NoteType}
+
+
+def id_to_key(id_: str) -> Union[bytes, str]:
+    if HEX_ID_RE.fullmatch(id_):
+        return bytes.fromhex(id_)
+    return id_
+
+
+def key_to_id(key: Union[bytes, str]) -> str:
+    if isinstance(key, bytes):
+        return key.hex()
+    return key
+
+
+def id_sort_key(id_: str) -> Tuple[bool, Union[bytes, str]]:
+    # The order of the id column: SQLite sorts TEXT before BLOB, and
+    # code point order of str is the byte order of UTF-8
+    key = id_to_key(id_)
+    return isinstance(key, bytes), key
+
 
 class SQLiteNotesDB(AbstractNotesDB):
-    def __init__(self, db_file_path: str):
+    # Schema version stored in PRAGMA user_version; start() applies the
+    # migrations from the version of the store file up to this one
+    SCHEMA_VERSION = 4
+
+    # Columns patch_note() may set, in statement order
+    PATCH_COLUMNS = ['title', 'body', 'note_type', 'updated_on']
+
+    # Ids per read_notes() query; SQLite builds before 3.32 allow at most
+    # 999 bound parameters
+    READ_NOTES_CHUNK = 500
+
+    # Rows read_all_notes() fetches at a time: the listing streams rather
+    # than holding the whole table
+    READ_ALL_BATCH = 1000
+
+    # Pages a backup copies per step (4 KB each by default), and the pause
+    # after each step that leaves the disk and the GIL to requests
+    BACKUP_STEP_PAGES = 256
+    BACKUP_STEP_PAUSE = 0.002
+
+    def __init__(
+        self,
+        db_file_path: str,
+        tombstone_retention: float = DEFAULT_TOMBSTONE_RETENTION,
+        body_codec: BodyCodec = None,
+        dedup_min_size: int = None,
+        maintenance: MaintenancePolicy = None
+    ):
         self._store = db_file_path
-        self._connection = None
+        self._connection: Optional[aiosqlite.core.Connection] = None
+        # Last use of the connection by a request, for the background
+        # maintenance (which uses _connection) to tell idle times
+        self._last_used = 0.0
+        self.tombstone_retention = tombstone_retention
+        # Change sequence numbers are handed out by this (only) writer
+        self._seq = 0
+        self._horizon = 0
+        self._tombstones = 0
+        self._last_compaction = 0.0
+        # Writes share the connection, and with it the transaction: each
+        # write's reads, statements and commit run under this lock, so no
+        # other write interleaves (and sequence numbers commit in order)
+        self._write_lock: Optional[asyncio.Lock] = None
+        # Compressed bodies are BLOBs in the body column, plain ones TEXT
+        self.body_codec = body_codec or BodyCodec()
+        # Bodies of at least this size are stored once, by content hash,
+        # in the bodies table; None stores every body in its note row
+        self.dedup_min_size = dedup_min_size
+        self._shared_bodies = 0
+        # Background checkpoints, incremental vacuum and optimize; None
+        # leaves checkpoints to commits and never vacuums
+        self.maintenance = maintenance
+        self._maintenance_task: Optional[asyncio.Future] = None
+        self._incremental_vacuum = False
+        self._checkpointed_seq = -1
+        self._wal_bytes = 0
+        self._freelist = 0
 
     @property
     def connection(self) -> aiosqlite.core.Connection:
+        self._last_used = time.monotonic()
+        assert self._connection is not None, 'store not started'
         return self._connection
 
     @connection.setter
@@ -224,9 +1268,198 @@ class SQLiteNotesDB(AbstractNotesDB):
     def store(self, store_path: str) -> None:
         self._store = store_path
 
+    @property
+    def seq(self) -> int:
+        # Sequence number of the latest change, the newest sync token
+        return self._seq
+
+    @property
+    def write_lock(self) -> asyncio.Lock:
+        # Made on first use, in the event loop running the store
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
     async def start(self):
         self.connection = await aiosqlite.connect(self.store)
+        # Only takes effect in a new store, before its first table; an
+        # existing store keeps its mode until a VACUUM
+        await self.connection.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+        # Readers, backups included, neither block nor wait for the writer
+        await self.connection.execute('PRAGMA journal_mode=WAL;')
+        await self.migrate()
+        await self._load_sync_state()
+        await self.compact_tombstones()
+        if self.maintenance is not None:
+            await self._start_maintenance()
+
+    async def _start_maintenance(self) -> None:
+        policy = self.maintenance
+        assert policy is not None
+        rows = list(await self.connection.execute_fetchall('''
+            SELECT * FROM pragma_auto_vacuum, pragma_page_size;
+        '''))
+        auto_vacuum, page_size = rows[0]
+        self._incremental_vacuum = auto_vacuum == 2
+        # Commits only checkpoint if the background ones fall far behind
+        await self.connection.execute('PRAGMA wal_autocheckpoint={};'.format(
+            max(1000, 4 * policy.wal_checkpoint_bytes // page_size)
+        ))
+        await self.connection.execute(
+            'PRAGMA analysis_limit={};'.format(ANALYSIS_LIMIT)
+        )
+        self._maintenance_task = asyncio.ensure_future(self._maintain())
+
+    async def _maintain(self) -> None:
+        # Background task: a maintenance round every interval until stop();
+        # a failed round is logged and counted, the next one runs anyway
+        policy = self.maintenance
+        assert policy is not None
+        while True:
+            await asyncio.sleep(policy.interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                policy.errors += 1
+                logutils.log(
+                    logging.getLogger(LOGGER_NAME),
+                    logging.ERROR,
+                    message='SQLITE_MAINTENANCE',
+                    error=str(e)
+                )
 
+    def idle(self) -> bool:
+        # No request has used the connection for the policy's idle time,
+        # and no write holds the write lock
+        return (
+            self.maintenance is not None
+            and time.monotonic() - self._last_used
+            >= self.maintenance.idle_seconds
+            and not self.write_lock.locked()
+        )
+
+    async def maintain(self) -> None:
+        '''
+        One round of maintenance by the `maintenance` policy. While no
+        request uses the connection: incremental vacuum slices until the
+        free pages are gone, then PRAGMA optimize when due, each step
+        within the policy's pause and the connection free for requests in
+        between. Then a checkpoint of the WAL, on a connection of its own
+        in an executor thread, if it has grown past the threshold. Vacuum
+        and optimize steps hold the write lock: they are skipped while a
+        write holds it, and writes wait for the step.
+        '''
+        policy = self.maintenance
+        connection = self._connection
+        if policy is None or connection is None:
+            return
+
+        # Reads the file header only, cheap whatever the traffic
+        rows = list(
+            await connection.execute_fetchall('PRAGMA freelist_count;')
+        )
+        self._freelist = rows[0][0]
+        while (
+            self._freelist and self._incremental_vacuum and self.idle()
+            and not connection.in_transaction
+        ):
+            pages = min(self._freelist, policy.vacuum_pages)
+            async with self.write_lock:
+                start = time.perf_counter()
+                # Frees one page per step: fetching every row runs it
+                # through
+                await connection.execute_fetchall(
+                    'PRAGMA incremental_vacuum({});'.format(pages)
+                )
+                policy.record_vacuum(pages, time.perf_counter() - start)
+            await asyncio.sleep(policy.max_pause)
+            rows = list(await connection.execute_fetchall(
+                'PRAGMA freelist_count;'
+            ))
+            self._freelist = rows[0][0]
+
+        if (
+            policy.optimize_due() and self.idle()
+            and not connection.in_transaction
+        ):
+            async with self.write_lock:
+                start = time.perf_counter()
+                await connection.execute_fetchall('PRAGMA optimize;')
+                policy.record_optimize(time.perf_counter() - start)
+
+        try:
+            self._wal_bytes = os.path.getsize(self.store + '-wal')
+        except FileNotFoundError:
+            self._wal_bytes = 0
+        mode = policy.checkpoint_mode(self._wal_bytes, self.idle())
+        # A passive checkpoint has nothing to do without new commits
+        if mode == 'PASSIVE' and self._seq == self._checkpointed_seq:
+            mode = None
+        if mode is not None:
+            seq = self._seq
+            start = time.perf_counter()
+            busy, frames, checkpointed = \
+                await asyncio.get_event_loop().run_in_executor(
+                    None, sqlite_checkpoint, self.store, mode
+                )
+            policy.record_checkpoint(mode, busy, time.perf_counter() - start)
+            if not busy and frames == checkpointed:
+                self._checkpointed_seq = seq
+            if mode == 'TRUNCATE' and not busy:
+                self._wal_bytes = 0
+
+    async def schema_version(self) -> int:
+        cursor = await self.connection.execute('PRAGMA user_version;')
+        row = await cursor.fetchone()
+        await cursor.close()
+        assert row is not None
+        return row[0]
+
+    async def migrate(self) -> int:
+        '''
+        Brings the store up to SCHEMA_VERSION, one migration (and one
+        transaction) per version.
+
+        Returns:
+            the number of migrations applied
+
+        Raises:
+            RuntimeError: the store was written by a newer version
+        '''
+        migrations = [
+            self._migrate_v1,
+            self._migrate_v2,
+            self._migrate_v3,
+            self._migrate_v4
+        ]
+        version = await self.schema_version()
+        if version > self.SCHEMA_VERSION:
+            raise RuntimeError(
+                'Store {} has schema version {}, newer than {}'.format(
+                    self.store, version, self.SCHEMA_VERSION
+                )
+            )
+
+        applied = 0
+        for migration in migrations[version:]:
+            version += 1
+            await self.connection.execute('BEGIN;')
+            try:
+                await migration()
+                await self.connection.execute(
+                    'PRAGMA user_version = {};'.format(version)
+                )
+                await self.connection.commit()
+            except Exception:
+                await self.connection.rollback()
+                raise
+            applied += 1
+
+        return applied
+
+    async def _migrate_v1(self) -> None:
+        # Original layout; stores created before versioning already have
+        # the table and user_version 0
         query = '''
         CREATE TABLE IF NOT EXISTS notes (
             id varchar(32) PRIMARY KEY,
@@ -239,96 +1472,384 @@ class SQLiteNotesDB(AbstractNotesDB):
         );
         '''
         await self.connection.execute(query)
-        await self.connection.commit()
+
+    async def _migrate_v2(self) -> None:
+        # Clustered on the id: hex ids as 16 byte BLOBs, note_type as its
+        # NoteType value. A point read is one B-tree descent, and the
+        # full listing scans a single B-tree that holds every column
+        query = '''
+        CREATE TABLE notes_v2 (
+            id BLOB PRIMARY KEY,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL DEFAULT '',
+            note_type INTEGER
+                CHECK( note_type IN ({}) )
+                NOT NULL,
+            updated_on INTEGER DEFAULT 0
+        ) WITHOUT ROWID;
+        '''.format(', '.join(str(t.value) for t in NoteType))
+        await self.connection.execute(query)
+
+        cursor = await self.connection.execute('''
+            SELECT id, title, body, note_type, updated_on FROM notes;
+        ''')
+        while True:
+            rows = await cursor.fetchmany(10000)
+            if not rows:
+                break
+            await self.connection.executemany(
+                'INSERT INTO notes_v2 VALUES($1,$2,$3,$4,$5);',
+                [
+                    (id_to_key(r[0]), r[1], r[2], NoteType[r[3]].value, r[4])
+                    for r in rows
+                ]
+            )
+        await cursor.close()
+
+        await self.connection.execute('DROP TABLE notes;')
+        await self.connection.execute(
+            'ALTER TABLE notes_v2 RENAME TO notes;'
+        )
+
+    async def _migrate_v3(self) -> None:
+        # Change sequence numbers for delta sync: every note carries the
+        # number of its latest change, deleted notes leave a tombstone.
+        # Existing notes are numbered in updated_on order
+        await self.connection.execute('''
+            ALTER TABLE notes ADD COLUMN seq INTEGER NOT NULL DEFAULT 0;
+        ''')
+        await self.connection.execute('''
+            CREATE TEMP TABLE seq_numbers (
+                id BLOB PRIMARY KEY,
+                seq INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        await self.connection.execute('''
+            INSERT INTO seq_numbers
+            SELECT id, row_number() OVER (ORDER BY updated_on, id)
+            FROM notes;
+        ''')
+        await self.connection.execute('''
+            UPDATE notes SET seq = (
+                SELECT seq FROM seq_numbers WHERE seq_numbers.id = notes.id
+            );
+        ''')
+        await self.connection.execute('DROP TABLE seq_numbers;')
+        await self.connection.execute('''
+            CREATE INDEX notes_seq ON notes (seq);
+        ''')
+
+        await self.connection.execute('''
+            CREATE TABLE tombstones (
+                id BLOB PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                deleted_on INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        await self.connection.execute('''
+            CREATE INDEX tombstones_seq ON tombstones (seq);
+        ''')
+
+        # Tombstones up to the horizon have been compacted away
+        await self.connection.execute('''
+            CREATE TABLE sync_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        await self.connection.execute('''
+            INSERT INTO sync_state VALUES ('horizon', 0);
+        ''')
+
+    async def _migrate_v4(self) -> None:
+        # Body deduplication: a note row either holds its body or the
+        # content hash of a body stored once in `bodies`, with the number
+        # of notes referencing it. A rowid table, since WITHOUT ROWID
+        # suits large rows poorly
+        await self.connection.execute('''
+            ALTER TABLE notes ADD COLUMN body_hash BLOB;
+        ''')
+        await self.connection.execute('''
+            CREATE INDEX notes_body_hash ON notes (body_hash)
+            WHERE body_hash IS NOT NULL;
+        ''')
+        await self.connection.execute('''
+            CREATE TABLE bodies (
+                hash BLOB PRIMARY KEY,
+                body TEXT NOT NULL,
+                refs INTEGER NOT NULL
+            );
+        ''')
+
+    async def _load_sync_state(self) -> None:
+        rows = list(await self.connection.execute_fetchall('''
+            SELECT
+                (SELECT MAX(seq) FROM notes),
+                (SELECT MAX(seq) FROM tombstones),
+                (SELECT COUNT(*) FROM tombstones),
+                (SELECT value FROM sync_state WHERE name = 'horizon'),
+                (SELECT COUNT(*) FROM bodies);
+        '''))
+        max_note, max_tombstone, self._tombstones, self._horizon, \
+            self._shared_bodies = rows[0]
+        self._seq = max(max_note or 0, max_tombstone or 0, self._horizon)
+
+    async def advance_horizon(self, seq: int) -> None:
+        '''
+        Moves the horizon, and the change sequence, to at least `seq`: sync
+        tokens up to it expire, e.g. once a store is rebuilt from another.
+        '''
+        async with self.write_lock:
+            await self.connection.execute('''
+                UPDATE sync_state SET value = MAX(value, $1)
+                WHERE name = 'horizon';
+            ''', [seq])
+            await self.connection.commit()
+            self._horizon = max(self._horizon, seq)
+            self._seq = max(self._seq, seq)
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    async def compact_tombstones(self, now: float = None) -> int:
+        '''
+        Removes the tombstones older than the retention and moves the
+        horizon past them.
+
+        Returns:
+            the number of tombstones removed
+        '''
+        now = time.time() if now is None else now
+        self._last_compaction = now
+        cutoff = int(now - self.tombstone_retention)
+
+        async with self.write_lock:
+            rows = await self.connection.execute_fetchall('''
+                SELECT MAX(seq), COUNT(*) FROM tombstones
+                WHERE deleted_on < $1;
+            ''', [cutoff])
+            horizon, removed = list(rows)[0]
+            if not removed:
+                return 0
+
+            await self.connection.execute('''
+                DELETE FROM tombstones WHERE seq <= $1;
+            ''', [horizon])
+            await self.connection.execute('''
+                UPDATE sync_state SET value = MAX(value, $1)
+                WHERE name = 'horizon';
+            ''', [horizon])
+            await self.connection.commit()
+
+            self._horizon = max(self._horizon, horizon)
+            self._tombstones -= removed
+        return removed
 
     async def stop(self):
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
         await self.connection.close()
 
     async def _clear(self):
-        query = "DELETE FROM notes;"
-        await self.connection.execute(query)
-        await self.connection.commit()
+        async with self.write_lock:
+            await self.connection.execute("DELETE FROM notes;")
+            await self.connection.execute("DELETE FROM tombstones;")
+            await self.connection.execute("DELETE FROM bodies;")
+            await self.connection.commit()
+            self._tombstones = 0
+            self._shared_bodies = 0
+
+    def body_hash(self, body: str) -> Optional[bytes]:
+        # Content hash of a body stored once, None for one stored inline
+        if self.dedup_min_size is None or len(body) < self.dedup_min_size:
+            return None
+        return hashlib.sha256(body.encode('utf-8')).digest()
+
+    def row_from_note(self, note: Note, id_: str = None) -> Tuple:
+        hash_ = self.body_hash(note.body)
+        return (
+            id_to_key(id_ or note.id),
+            note.title,
+            '' if hash_ else self.body_codec.encode_body(note.body),
+            note.note_type.value,
+            note.updated_on,
+            self._next_seq(),
+            hash_
+        )
+
+    def select_notes(self) -> str:
+        # Shared bodies are joined in; a store without any is read from
+        # the notes table alone
+        if not self._shared_bodies:
+            return '''
+                SELECT id, title, body, note_type, updated_on, seq
+                FROM notes
+            '''
+        return '''
+            SELECT id, title, COALESCE(bodies.body, notes.body), note_type,
+                updated_on, seq
+            FROM notes LEFT JOIN bodies ON bodies.hash = notes.body_hash
+        '''
+
+    async def _ref_bodies(self, refs: List[Tuple[bytes, str]]) -> None:
+        # One more reference to a shared body per (hash, body) pair; new
+        # bodies are inserted
+        counts: Dict[bytes, int] = {}
+        bodies: Dict[bytes, str] = {}
+        for hash_, body in refs:
+            counts[hash_] = counts.get(hash_, 0) + 1
+            bodies[hash_] = body
+        hashes = list(counts)
+        existing: Set[bytes] = set()
+        for i in range(0, len(hashes), self.READ_NOTES_CHUNK):
+            chunk = hashes[i:i + self.READ_NOTES_CHUNK]
+            rows = await self.connection.execute_fetchall('''
+                SELECT hash FROM bodies WHERE hash IN ({});
+            '''.format(','.join('?' * len(chunk))), chunk)
+            existing.update(row[0] for row in rows)
+
+        if existing:
+            await self.connection.executemany('''
+                UPDATE bodies SET refs = refs + $1 WHERE hash = $2;
+            ''', [(counts[hash_], hash_) for hash_ in existing])
+        new = [
+            (hash_, self.body_codec.encode_body(bodies[hash_]), count)
+            for hash_, count in counts.items() if hash_ not in existing
+        ]
+        if new:
+            await self.connection.executemany('''
+                INSERT INTO bodies (hash, body, refs) VALUES ($1, $2, $3);
+            ''', new)
+            self._shared_bodies += len(new)
+
+    async def _stored_body_hash(self, key: Union[bytes, str]) -> Any:
+        # Hash of the shared body of a note, None if it has none
+        if not self._shared_bodies:
+            return None
+        rows = list(await self.connection.execute_fetchall(
+            'SELECT body_hash FROM notes WHERE id=$1;', [key]
+        ))
+        return rows[0][0] if rows else None
+
+    async def _unref_body(self, hash_: Optional[bytes]) -> None:
+        # The last reference removes the body
+        if hash_ is None:
+            return
+        await self.connection.execute(
+            'UPDATE bodies SET refs = refs - 1 WHERE hash = $1;', [hash_]
+        )
+        cursor = await self.connection.execute(
+            'DELETE FROM bodies WHERE hash = $1 AND refs <= 0;', [hash_]
+        )
+        self._shared_bodies -= max(0, cursor.rowcount)
+        await cursor.close()
+
+    async def collect_bodies(self) -> int:
+        # References are counted in the same transaction as the writes;
+        # this recounts them from the notes and removes the unreferenced
+        async with self.write_lock:
+            await self.connection.execute('''
+                UPDATE bodies SET refs = (
+                    SELECT COUNT(*) FROM notes WHERE body_hash = bodies.hash
+                );
+            ''')
+            cursor = await self.connection.execute(
+                'DELETE FROM bodies WHERE refs <= 0;'
+            )
+            removed = max(0, cursor.rowcount)
+            await cursor.close()
+            await self.connection.commit()
+            self._shared_bodies -= removed
+        return removed
+
+    def note_from_row(self, row: Sequence[Any]) -> Note:
+        return Note(
+            id=key_to_id(row[0]),
+            title=row[1],
+            body=self.body_codec.decode_body(row[2]),
+            note_type=NOTE_TYPES_BY_VALUE[row[3]],
+            updated_on=row[4]
+        )
 
     async def create_note(
         self,
         note: Note,
         id_: str = None
     ) -> str:
-        if id_:
-            exists = await self._check_if_exists(note.id)
-
-            if exists:
-                raise KeyError("A note exists already with the given ID")
-
-        new_note = [v for k, v in note.to_api_dm().items()]
-
-        if not id_:
-            new_note[0] = uuid.uuid4().hex
+        new_id = note.id if id_ else uuid.uuid4().hex
 
         query = '''
-            INSERT INTO notes VALUES($1,$2,$3,$4,$5)
+            INSERT INTO notes
+            (id, title, body, note_type, updated_on, seq, body_hash)
+            VALUES($1,$2,$3,$4,$5,$6,$7)
             ;
         '''
 
-        await self.connection.execute(query, new_note)
-        await self.connection.commit()
-
-        return new_note[0]
-
-    def dict_from_tuple(self, record):
-        return {
-            "id": record[0],
-            "title": record[1],
-            "body": record[2],
-            "note_type": record[3],
-            "updated_on": record[4]
-        }
+        async with self.write_lock:
+            try:
+                row = self.row_from_note(note, new_id)
+                await self.connection.execute(query, row)
+                if row[6]:
+                    await self._ref_bodies([(row[6], note.body)])
+                await self._remove_tombstones([row[:1]])
+                await self.connection.commit()
+            except sqlite3.IntegrityError:
+                await self.connection.rollback()
+                raise KeyError("A note exists already with the given ID")
 
-    async def read_note(self, id_: str) -> Note:
-        exists = await self._check_if_exists(id_)
+        return new_id
 
-        if not exists:
-            raise KeyError("No note found with given ID")
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        # One transaction and one executemany() for the whole batch
+        batch = list(notes)
 
         query = '''
-            SELECT * FROM notes
-            WHERE id=$1
+            INSERT INTO notes
+            (id, title, body, note_type, updated_on, seq, body_hash)
+            VALUES($1,$2,$3,$4,$5,$6,$7)
             ;
         '''
 
-        result = {}
+        async with self.write_lock:
+            rows = [self.row_from_note(note) for note in batch]
+            try:
+                await self.connection.executemany(query, rows)
+                shared = [
+                    (row[6], note.body) for row, note in zip(rows, batch)
+                    if row[6]
+                ]
+                if shared:
+                    await self._ref_bodies(shared)
+                await self._remove_tombstones([row[:1] for row in rows])
+                await self.connection.commit()
+            except sqlite3.IntegrityError as e:
+                await self.connection.rollback()
+                raise KeyError(str(e))
+
+        return len(rows)
 
-        cursor = await self.connection.execute(query, [id_])
-        row = await cursor.fetchone()
-        await cursor.close()
-        result = self.dict_from_tuple(row)
-
-        return Note.from_api_dm(result)
-
-    async def _check_if_exists(self, id_: str) -> bool:
-        query = '''
-            SELECT * FROM notes
+    async def read_note(self, id_: str) -> Note:
+        query = self.select_notes() + '''
             WHERE id=$1
             ;
         '''
 
-        cursor = await self.connection.execute(query, [id_])
+        cursor = await self.connection.execute(query, [id_to_key(id_)])
         row = await cursor.fetchone()
         await cursor.close()
 
-        if row:
-            return True
-        else:
-            return False
-
-    async def update_note(self, id_: str, note: Note) -> None:
-        exists = await self._check_if_exists(id_)
-
-        if not exists:
+        if row is None:
             raise KeyError("No note found with given ID")
 
-        new_note = [v for k, v in note.to_api_dm().items()]
+        return self.note_from_row(row)
 
+    async def update_note(self, id_: str, note: Note) -> None:
         query = '''
             UPDATE notes
             SET
@@ -336,38 +1857,210 @@ class SQLiteNotesDB(AbstractNotesDB):
             title=$2,
             body=$3,
             note_type=$4,
-            updated_on=$5
+            updated_on=$5,
+            seq=$6,
+            body_hash=$7
             WHERE id=$1
             ;
         '''
 
-        await self.connection.execute(query, new_note)
-        await self.connection.commit()
+        # The new body is referenced before the previous one is released,
+        # so an unchanged shared body is not removed and inserted again
+        async with self.write_lock:
+            row = self.row_from_note(note, id_)
+            previous = await self._stored_body_hash(row[0])
+            cursor = await self.connection.execute(query, row)
+            updated = cursor.rowcount
+            await cursor.close()
+            if updated:
+                if row[6]:
+                    await self._ref_bodies([(row[6], note.body)])
+                await self._unref_body(previous)
+            await self.connection.commit()
+
+        if not updated:
+            raise KeyError("No note found with given ID")
 
-    async def delete_note(self, id_: str) -> None:
-        exists = await self._check_if_exists(id_)
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        # One query per chunk of ids, below SQLite's bound parameter limit
+        keys = [id_to_key(id_) for id_ in ids]
+        notes = {}
+        for i in range(0, len(keys), self.READ_NOTES_CHUNK):
+            chunk = keys[i:i + self.READ_NOTES_CHUNK]
+            query = self.select_notes() + '''
+                WHERE id IN ({})
+                ;
+            '''.format(','.join('?' * len(chunk)))
+            rows = await self.connection.execute_fetchall(query, chunk)
+            for row in rows:
+                note = self.note_from_row(row)
+                notes[note.id] = note
+        return notes
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        # Only the changed columns are written, e.g. a title edit leaves
+        # the body alone
+        columns = [name for name in self.PATCH_COLUMNS if name in changes]
+        values = [
+            NoteType[changes[name]].value if name == 'note_type'
+            else changes[name]
+            for name in columns
+        ]
+        key = id_to_key(id_)
+        hash_ = None
+        if 'body' in changes:
+            hash_ = self.body_hash(changes['body'])
+            values[columns.index('body')] = (
+                '' if hash_ else self.body_codec.encode_body(changes['body'])
+            )
+            columns.append('body_hash')
+            values.append(hash_)
+        columns.append('seq')
 
-        if not exists:
+        query = '''
+            UPDATE notes
+            SET {}
+            WHERE id=${}
+            ;
+        '''.format(
+            ', '.join(
+                '{}=${}'.format(name, i + 1) for i, name in enumerate(columns)
+            ),
+            len(columns) + 1
+        )
+
+        async with self.write_lock:
+            previous = None
+            if 'body' in changes:
+                previous = await self._stored_body_hash(key)
+            cursor = await self.connection.execute(
+                query, values + [self._next_seq(), key]
+            )
+            updated = cursor.rowcount
+            await cursor.close()
+            if updated:
+                if hash_:
+                    await self._ref_bodies([(hash_, changes['body'])])
+                await self._unref_body(previous)
+            await self.connection.commit()
+
+        if not updated:
             raise KeyError("No note found with given ID")
 
+    async def _remove_tombstones(self, keys: List[Tuple]) -> None:
+        # A created note replaces the tombstone of an earlier one
+        if self._tombstones:
+            cursor = await self.connection.executemany(
+                'DELETE FROM tombstones WHERE id=$1;', keys
+            )
+            self._tombstones -= max(0, cursor.rowcount)
+            await cursor.close()
+
+    async def delete_note(self, id_: str) -> None:
+        # The tombstone is written first: it takes its sequence number in
+        # the same step as the other writes, and only if the note exists
+        key = id_to_key(id_)
         query = '''
-            DELETE FROM notes
-            WHERE id=$1
+            INSERT OR REPLACE INTO tombstones
+            SELECT $1, $2, $3
+            WHERE EXISTS (SELECT 1 FROM notes WHERE id=$1)
+            ;
         '''
 
-        await self.connection.execute(query, [id_])
-        await self.connection.commit()
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                query, [key, self._next_seq(), int(time.time())]
+            )
+            deleted = cursor.rowcount
+            await cursor.close()
+
+            if deleted:
+                previous = await self._stored_body_hash(key)
+                await self.connection.execute('''
+                    DELETE FROM notes
+                    WHERE id=$1
+                ''', [key])
+                await self._unref_body(previous)
+            await self.connection.commit()
+
+        if not deleted:
+            raise KeyError("No note found with given ID")
+
+        self._tombstones += 1
+        if time.time() - self._last_compaction >= COMPACTION_INTERVAL:
+            await self.compact_tombstones()
 
     async def read_all_notes(self) -> AsyncIterator[Tuple[str, Note]]:
-        query = '''
-            SELECT * FROM notes;
-        '''
+        # In id order, which is the table's own order: the sharded engine
+        # merges shards on it
+        query = self.select_notes() + 'ORDER BY notes.id;'
 
         cursor = await self.connection.execute(query)
-        rows = await cursor.fetchall()
-        await cursor.close()
+        try:
+            while True:
+                rows = await cursor.fetchmany(self.READ_ALL_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    note = self.note_from_row(row)
+                    yield note.id, note
+        finally:
+            await cursor.close()
+
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        if since < 0 or since > self._seq or 0 < since < self._horizon:
+            raise ChangesExpiredError(
+                'Sync token {} expired, sync the full list again'.format(
+                    since
+                )
+            )
 
-        notes = list(map(self.dict_from_tuple, rows))
+        # One statement, fetched in one call: a consistent view of both
+        # tables even while other writes are queued on the connection
+        rows = list(await self.connection.execute_fetchall(
+            self.select_notes() + '''
+            WHERE seq > $1
+            UNION ALL
+            SELECT id, NULL, NULL, NULL, NULL, seq
+            FROM tombstones WHERE seq > $1
+            ORDER BY 6
+            LIMIT $2
+            ;
+            ''', [since, limit + 1]
+        ))
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        notes = []
+        deleted = []
+        for row in rows:
+            if row[3] is None:
+                deleted.append(key_to_id(row[0]))
+            else:
+                note = self.note_from_row(row)
+                notes.append((note.id, note))
+
+        token = rows[-1][5] if rows else since
+        return NoteChanges(notes, deleted, token, more)
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        # Online backup API in an executor thread, on a connection of its
+        # own, so requests keep using this one meanwhile
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, sqlite_backup, self.store, path, self.BACKUP_STEP_PAGES,
+            self.BACKUP_STEP_PAUSE
+        )
 
-        for note in notes:
-            yield note["id"], Note.from_api_dm(note)
+    def stats(self) -> Dict[str, float]:
+        stats: Dict[str, float] = {
+            'tombstones': self._tombstones,
+            'shared_bodies': self._shared_bodies,
+            **self.body_codec.stats()
+        }
+        if self.maintenance is not None:
+            # As of the latest maintenance round
+            stats['wal_bytes'] = self._wal_bytes
+            stats['freelist_pages'] = self._freelist
+            stats.update(self.maintenance.stats())
+        return stats
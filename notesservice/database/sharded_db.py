@@ -0,0 +1,268 @@
+import asyncio
+import os
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+    Tuple
+)
+import uuid
+import zlib
+
+from notesservice.database.changelog import ChangesExpiredError, NoteChanges
+from notesservice.database.notes_db import (
+    AbstractNotesDB,
+    SQLiteNotesDB,
+    id_sort_key
+)
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import merge_sorted
+
+# Bits of a shard's change sequence number in a sync token
+SEQ_BITS = 48
+SEQ_MASK = (1 << SEQ_BITS) - 1
+
+# Notes per create_notes() batch when resharding
+RESHARD_BATCH_SIZE = 10000
+
+
+def shard_paths(path: str, shards: int) -> List[str]:
+    '''
+    The files of a store of `shards` shards: `path` itself for one, e.g.
+    store-0-of-4.db ... store-3-of-4.db for four. The shard count is in
+    the names, so a store is never opened with another count.
+    '''
+    if shards == 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [
+        '{}-{}-of-{}{}'.format(root, i, shards, ext) for i in range(shards)
+    ]
+
+
+def shard_of(id_: str, shards: int) -> int:
+    # Stable across processes and Python versions, unlike hash()
+    return zlib.crc32(id_.encode('utf-8')) % shards
+
+
+# Creating ShardedNotesDB class
+class ShardedNotesDB(AbstractNotesDB):
+    '''
+    Notes hashed by id across independent SQLite stores, each with its own
+    connection (and writer lock), so writes to different shards run in
+    parallel. Point reads and writes go to the note's shard; multi-gets,
+    bulk loads and delta syncs are scattered to the shards concurrently
+    and gathered, and the full listing is a streaming merge of the shards
+    in id order, the order of a single store.
+
+    A sync token packs the change sequence numbers of all shards,
+    SEQ_BITS each. A bulk load is one transaction per shard, not one in
+    all.
+    '''
+    def __init__(self, shards: Sequence[SQLiteNotesDB]) -> None:
+        if not shards:
+            raise ValueError('A sharded store needs at least one shard')
+        self.shards = list(shards)
+
+    @property
+    def store(self) -> List[str]:
+        return [shard.store for shard in self.shards]
+
+    def shard(self, id_: str) -> SQLiteNotesDB:
+        return self.shards[shard_of(id_, len(self.shards))]
+
+    def _group(self, ids: Iterable[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = {}
+        for id_ in ids:
+            groups.setdefault(shard_of(id_, len(self.shards)), []).append(
+                id_
+            )
+        return groups
+
+    async def start(self):
+        await asyncio.gather(*(shard.start() for shard in self.shards))
+
+    async def stop(self):
+        await asyncio.gather(*(shard.stop() for shard in self.shards))
+
+    async def _clear(self):
+        await asyncio.gather(*(shard._clear() for shard in self.shards))
+
+    async def create_note(
+        self,
+        note: Note,
+        id_: str = None
+    ) -> str:
+        # The id picks the shard, so it is generated here
+        if not id_:
+            new_id = uuid.uuid4().hex
+            note = Note.from_api_dm({**note.to_api_dm(), 'id': new_id})
+        return await self.shard(note.id).create_note(note, note.id)
+
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        # All or nothing per shard: a batch with an id that exists already
+        # on one shard is still stored on the others
+        batches: Dict[int, List[Note]] = {}
+        for note in notes:
+            batches.setdefault(
+                shard_of(note.id, len(self.shards)), []
+            ).append(note)
+        counts = await asyncio.gather(*(
+            self.shards[i].create_notes(batch)
+            for i, batch in batches.items()
+        ))
+        return sum(counts)
+
+    async def read_note(self, id_: str) -> Note:
+        return await self.shard(id_).read_note(id_)
+
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        found = await asyncio.gather(*(
+            self.shards[i].read_notes(group)
+            for i, group in self._group(ids).items()
+        ))
+        notes: Dict[str, Note] = {}
+        for shard_notes in found:
+            notes.update(shard_notes)
+        return notes
+
+    async def update_note(self, id_: str, note: Note) -> None:
+        await self.shard(id_).update_note(id_, note)
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        await self.shard(id_).patch_note(id_, changes)
+
+    async def delete_note(self, id_: str) -> None:
+        await self.shard(id_).delete_note(id_)
+
+    async def read_all_notes(self) -> AsyncIterator[Tuple[str, Note]]:
+        async for id_, note in merge_sorted(
+            [shard.read_all_notes() for shard in self.shards],
+            key=lambda item: id_sort_key(item[0])
+        ):
+            yield id_, note
+
+    def pack_token(self, seqs: Sequence[int]) -> int:
+        token = 0
+        for i, seq in enumerate(seqs):
+            token |= seq << (SEQ_BITS * i)
+        return token
+
+    def unpack_token(self, token: int) -> List[int]:
+        if token < 0 or token >> (SEQ_BITS * len(self.shards)):
+            raise ChangesExpiredError(
+                'Sync token {} expired, sync the full list again'.format(
+                    token
+                )
+            )
+        return [
+            (token >> (SEQ_BITS * i)) & SEQ_MASK
+            for i in range(len(self.shards))
+        ]
+
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        sinces = self.unpack_token(since)
+        for shard, shard_since in zip(self.shards, sinces):
+            if shard_since > shard.seq:
+                raise ChangesExpiredError(
+                    'Sync token {} expired, sync the full list '
+                    'again'.format(since)
+                )
+
+        # The limit is shared by the shards with changes, so every call
+        # makes progress; below one change per shard, the shards served
+        # first rotate with the token
+        pending = [
+            i for i, shard in enumerate(self.shards)
+            if shard.seq > sinces[i]
+        ]
+        if not pending:
+            return NoteChanges([], [], since, False)
+        first = since % len(pending)
+        pending = pending[first:] + pending[:first]
+        limits = [
+            limit // len(pending) + (1 if j < limit % len(pending) else 0)
+            for j in range(len(pending))
+        ]
+        queried = [(i, n) for i, n in zip(pending, limits) if n]
+        results = await asyncio.gather(*(
+            self.shards[i].read_changes(sinces[i], n) for i, n in queried
+        ))
+
+        notes: List[Tuple[str, Note]] = []
+        deleted: List[str] = []
+        more = len(queried) < len(pending)
+        for (i, _), changes in zip(queried, results):
+            notes.extend(changes.notes)
+            deleted.extend(changes.deleted)
+            sinces[i] = changes.token
+            more = more or changes.more
+        return NoteChanges(notes, deleted, self.pack_token(sinces), more)
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        # One shard after the other, into the shard files of `path`: every
+        # shard is a snapshot of its own, taken when its turn comes
+        backups = []
+        for shard, shard_path in zip(
+            self.shards, shard_paths(path, len(self.shards))
+        ):
+            backups.append(await shard.backup(shard_path))
+        return {
+            'path': [b['path'] for b in backups],
+            'bytes': sum(b['bytes'] for b in backups),
+            'seq': self.pack_token([b['seq'] for b in backups]),
+            'seconds': sum(b['seconds'] for b in backups),
+            'shards': backups
+        }
+
+    async def collect_bodies(self) -> int:
+        removed = await asyncio.gather(
+            *(shard.collect_bodies() for shard in self.shards)
+        )
+        return sum(removed)
+
+    def stats(self) -> Dict[str, float]:
+        # Totals over the shards
+        stats: Dict[str, float] = {'shards': len(self.shards)}
+        for shard in self.shards:
+            for name, value in shard.stats().items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+
+async def reshard(
+    source: AbstractNotesDB,
+    target: AbstractNotesDB,
+    batch_size: int = RESHARD_BATCH_SIZE
+) -> int:
+    '''
+    Copies every note of the started `source` store into the started,
+    empty `target` store, in batches; either may be sharded or not.
+    Offline: the source must not be written meanwhile. Tombstones are not
+    copied; instead the horizon of every target shard moves past all
+    source sync tokens, so clients sync the full list again.
+
+    Returns:
+        the number of notes copied
+    '''
+    sources = getattr(source, 'shards', [source])
+    targets = getattr(target, 'shards', [target])
+    horizon = max(shard.seq for shard in sources) + 1
+    await asyncio.gather(
+        *(shard.advance_horizon(horizon) for shard in targets)
+    )
+
+    count = 0
+    batch: List[Note] = []
+    async for _, note in source.read_all_notes():
+        batch.append(note)
+        if len(batch) >= batch_size:
+            count += await target.create_notes(batch)
+            batch = []
+    if batch:
+        count += await target.create_notes(batch)
+    return count
@@ -0,0 +1,275 @@
+import asyncio
+from bisect import bisect_right
+import json
+import os
+import tempfile
+from typing import Any, Callable, IO, List, Sequence, Tuple
+
+from notesservice.datamodel import Note
+
+# Record lengths take the low bits of a record reference, the offset the
+# rest: one int per spilled note
+LENGTH_BITS = 32
+LENGTH_MASK = (1 << LENGTH_BITS) - 1
+
+# Bytes compaction copies with one write
+COPY_CHUNK_BYTES = 1 << 20
+
+
+def encode_note(note: Note) -> bytes:
+    return json.dumps(note.to_api_dm(), separators=(',', ':')).encode(
+        'utf-8'
+    )
+
+
+def decode_note(data: bytes) -> Note:
+    return Note.from_api_dm(json.loads(data))
+
+
+def copy_records(
+    keys: Sequence[str],
+    entries: Sequence[Any],
+    sources: Sequence[Tuple[int, IO[bytes]]],
+    target: IO[bytes],
+    target_base: int
+) -> Tuple[List[str], List[int], List[int], int]:
+    '''
+    Blocking, run in an executor thread: copies the records referenced by
+    the ints of `entries` from the `sources` files (by base offset,
+    ascending) to the `target` file, whose records start at `target_base`.
+    Parallel lists rather than tuples: a large compaction allocates no
+    objects for the garbage collector to trace.
+
+    Returns:
+        the keys, old and new references of the records copied, and the
+        bytes copied
+    '''
+    bases = [base for base, _ in sources]
+    moved_keys = []
+    refs = []
+    new_refs = []
+    chunks: List[bytes] = []
+    chunk_offset = offset = 0
+    for key, ref in zip(keys, entries):
+        if not isinstance(ref, int):
+            continue
+        address = ref >> LENGTH_BITS
+        length = ref & LENGTH_MASK
+        base, source = sources[bisect_right(bases, address) - 1]
+        chunks.append(os.pread(source.fileno(), length, address - base))
+        moved_keys.append(key)
+        refs.append(ref)
+        new_refs.append((target_base + offset) << LENGTH_BITS | length)
+        offset += length
+        if offset - chunk_offset >= COPY_CHUNK_BYTES:
+            os.pwrite(target.fileno(), b''.join(chunks), chunk_offset)
+            chunks = []
+            chunk_offset = offset
+    if chunks:
+        os.pwrite(target.fileno(), b''.join(chunks), chunk_offset)
+    return moved_keys, refs, new_refs, offset
+
+
+# Creating SpillSegment class
+class SpillSegment:
+    '''
+    One file of a spill file, holding the offsets from `base` on. A sealed
+    segment takes no more records. It is closed once retired by compaction
+    and no read or write of it is in flight any more.
+    '''
+    def __init__(self, file: IO[bytes], base: int) -> None:
+        self.file = file
+        self.base = base
+        self.end = base
+        self.busy = 0
+        self.sealed = False
+        self.compacting = False
+        self.retired = False
+
+    @property
+    def size(self) -> int:
+        return self.end - self.base
+
+    def close(self) -> None:
+        self.retired = True
+        if not self.busy:
+            self.file.close()
+
+
+# Creating SpillFile class
+class SpillFile:
+    '''
+    Append-only overflow file of notes evicted from memory, unnamed
+    temporary files in `directory` (default: the system's temporary
+    directory) created by the first write and gone once closed. A record
+    is addressed by an int packing its offset and length, which the caller
+    keeps in place of the note. Replaced and removed records are garbage
+    until compact() copies the live records into a new file.
+
+    Reads, writes and compaction run in executor threads. Offsets are
+    never reused: a compaction seals the current files, copies into a new
+    one and the writes made meanwhile go to yet another, while reads of
+    the old records still find the old files until retire().
+    '''
+    # Garbage (replaced and removed records) that makes compaction
+    # worthwhile once it is also half the file
+    COMPACTION_MIN_BYTES = 1 << 20
+
+    def __init__(self, directory: str = None) -> None:
+        self.directory = directory
+        # Oldest first, the last one takes the writes unless sealed
+        self._segments: List[SpillSegment] = []
+        self._end = 0
+        self.garbage = 0
+        self.compacting = False
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def _new_segment(self) -> SpillSegment:
+        segment = SpillSegment(
+            tempfile.TemporaryFile(
+                dir=self.directory, prefix='notesservice-spill-'
+            ),
+            self._end
+        )
+        self._segments.append(segment)
+        return segment
+
+    def _segment(self, ref: int) -> SpillSegment:
+        offset = ref >> LENGTH_BITS
+        for segment in reversed(self._segments):
+            if segment.base <= offset:
+                return segment
+        raise KeyError(ref)
+
+    async def _run(
+        self,
+        segments: Sequence[SpillSegment],
+        io: Callable[..., Any],
+        *args
+    ) -> Any:
+        # Runs blocking I/O on the files of `segments` in an executor
+        # thread; they are not closed meanwhile
+        for segment in segments:
+            segment.busy += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, io, *args)
+        finally:
+            for segment in segments:
+                segment.busy -= 1
+                if segment.retired and not segment.busy:
+                    segment.file.close()
+
+    async def write(self, notes: Sequence[Note]) -> List[int]:
+        '''
+        Appends the records of `notes`, with one write.
+
+        Returns:
+            their references, in order
+        '''
+        chunks = [encode_note(note) for note in notes]
+        data = b''.join(chunks)
+        while True:
+            if not self._segments or self._segments[-1].sealed:
+                self._new_segment()
+            segment = self._segments[-1]
+            offset = self._end
+            self._end += len(data)
+            segment.end = self._end
+            await self._run(
+                [segment], os.pwrite, segment.file.fileno(), data,
+                offset - segment.base
+            )
+            # A compaction started meanwhile does not copy these records:
+            # they are written again, after it
+            if not segment.compacting:
+                break
+        refs = []
+        for chunk in chunks:
+            refs.append(offset << LENGTH_BITS | len(chunk))
+            offset += len(chunk)
+        return refs
+
+    async def read(self, ref: int) -> Note:
+        segment = self._segment(ref)
+        data = await self._run(
+            [segment], os.pread, segment.file.fileno(), ref & LENGTH_MASK,
+            (ref >> LENGTH_BITS) - segment.base
+        )
+        return decode_note(data)
+
+    def release(self, ref: int) -> None:
+        # Garbage of the files being compacted goes away with them
+        if not self._segment(ref).compacting:
+            self.garbage += ref & LENGTH_MASK
+
+    def due_for_compaction(self) -> bool:
+        return (
+            not self.compacting and
+            self.garbage >= self.COMPACTION_MIN_BYTES and
+            self.garbage * 2 >= self.size
+        )
+
+    async def compact(
+        self,
+        keys: Sequence[str],
+        entries: Sequence[Any]
+    ) -> Tuple[List[str], List[int], List[int]]:
+        '''
+        Copies the records referenced by the ints of `entries` (by key, in
+        `keys`), in their order, into a new file. Until retire(), the
+        current files stay readable and the records released meanwhile are
+        copied all the same: the caller keeps the new references of the
+        records it still holds and releases the others.
+
+        Returns:
+            the keys, old and new references of the records copied
+        '''
+        retiring = list(self._segments)
+        if self.compacting or not retiring:
+            return [], [], []
+        self.compacting = True
+        for segment in retiring:
+            segment.sealed = segment.compacting = True
+        garbage, self.garbage = self.garbage, 0
+
+        # The new file takes offsets up to the size of the current ones,
+        # the writes meanwhile the offsets after it
+        target = self._new_segment()
+        target.sealed = True
+        self._end += sum(segment.size for segment in retiring)
+        try:
+            moved_keys, refs, new_refs, size = await self._run(
+                retiring + [target], copy_records, keys, entries,
+                [(segment.base, segment.file) for segment in retiring],
+                target.file, target.base
+            )
+        except BaseException:
+            self._segments.remove(target)
+            target.close()
+            for segment in retiring:
+                segment.compacting = False
+            self.compacting = False
+            self.garbage += garbage
+            raise
+        target.end = target.base + size
+        return moved_keys, refs, new_refs
+
+    def retire(self) -> None:
+        # The caller holds no reference into the compacted files any more
+        for segment in list(self._segments):
+            if segment.compacting:
+                self._segments.remove(segment)
+                segment.close()
+        self.compacting = False
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+        self._end = 0
+        self.garbage = 0
+        self.compacting = False
@@ -0,0 +1,237 @@
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple
+)
+
+from notesservice.database.changelog import NoteChanges
+from notesservice.database.notes_db import (
+    AbstractNotesDB,
+    InMemoryNotesDB,
+    note_size
+)
+from notesservice.datamodel import Note
+from notesservice.utils.tinylfu import (
+    DEFAULT_WINDOW_FRACTION,
+    TinyLFUPolicy
+)
+
+DEFAULT_HOT_TIER_MAX_BYTES = 64 * 1024 * 1024
+
+
+# Creating TieredNotesDB class
+class TieredNotesDB(AbstractNotesDB):
+    '''
+    A durable engine with a hot tier in front of it. Every write goes to
+    the durable tier; created and updated notes, and notes read from the
+    durable tier, are promoted into the hot tier, and a W-TinyLFU policy
+    keeps it within `max_bytes` by recency and frequency, demoting
+    (dropping) the rest. Full listings and changes are read from the
+    durable tier, which always has every note.
+    '''
+    def __init__(
+        self,
+        durable: AbstractNotesDB,
+        hot: AbstractNotesDB = None,
+        max_bytes: int = DEFAULT_HOT_TIER_MAX_BYTES,
+        window_fraction: float = DEFAULT_WINDOW_FRACTION
+    ) -> None:
+        self.durable = durable
+        # Demoted notes leave no tombstones in the default hot tier
+        self.hot = hot or InMemoryNotesDB(tombstone_retention=0)
+        self.policy: TinyLFUPolicy[str] = TinyLFUPolicy(
+            max_bytes, window_fraction
+        )
+        # Durable reads in flight per id: [count, written meanwhile]; a
+        # note written meanwhile is not promoted, it may be stale
+        self._loading: Dict[str, List] = {}
+        self.hits = 0
+        self.misses = 0
+        self.promotions = 0
+        self.demotions = 0
+
+    @property
+    def store(self) -> Any:
+        return getattr(self.durable, 'store', None)
+
+    async def start(self):
+        await self.durable.start()
+        await self.hot.start()
+
+    async def stop(self):
+        await self.hot.stop()
+        await self.durable.stop()
+
+    async def _clear(self):
+        await self.durable._clear()
+        await self.hot._clear()
+        self.policy.clear()
+
+    async def _promote(self, id_: str, note: Note) -> None:
+        # Into the hot tier, or updated there, within the budget
+        resident = id_ in self.policy
+        evicted = self.policy.add(id_, note_size(note))
+        if id_ not in evicted:
+            if resident:
+                await self.hot.update_note(id_, note)
+            else:
+                await self.hot.create_note(note, id_)
+                self.promotions += 1
+        for key in evicted:
+            if key != id_ or resident:
+                await self._demote(key)
+
+    async def _demote(self, id_: str) -> None:
+        self.policy.remove(id_)
+        try:
+            await self.hot.delete_note(id_)
+        except KeyError:
+            pass
+        self.demotions += 1
+
+    def _written(self, id_: str) -> None:
+        loading = self._loading.get(id_)
+        if loading is not None:
+            loading[1] = True
+
+    async def _load(self, id_: str) -> Note:
+        loading = self._loading.setdefault(id_, [0, False])
+        loading[0] += 1
+        try:
+            note = await self.durable.read_note(id_)
+        finally:
+            loading[0] -= 1
+            if not loading[0]:
+                del self._loading[id_]
+        if not loading[1] and id_ not in self.policy:
+            await self._promote(id_, note)
+        return note
+
+    async def create_note(
+        self,
+        note: Note,
+        id_: str = None
+    ) -> str:
+        new_id = await self.durable.create_note(note, id_)
+        self._written(new_id)
+        if note.id != new_id:
+            note = Note.from_api_dm({**note.to_api_dm(), 'id': new_id})
+        self.policy.access(new_id)
+        await self._promote(new_id, note)
+        return new_id
+
+    async def create_notes(self, notes: Iterable[Note]) -> int:
+        # Bulk loads are not promoted, they would flush the hot tier
+        return await self.durable.create_notes(notes)
+
+    async def read_note(self, id_: str) -> Note:
+        if self.policy.access(id_):
+            try:
+                note = await self.hot.read_note(id_)
+                self.hits += 1
+                return note
+            except KeyError:
+                # Being promoted or demoted right now
+                pass
+        self.misses += 1
+        return await self._load(id_)
+
+    async def read_notes(self, ids: Iterable[str]) -> Dict[str, Note]:
+        ids = list(ids)
+        # None until read from the hot tier
+        notes: Dict[str, Optional[Note]] = {}
+        missing = []
+        for id_ in ids:
+            if self.policy.access(id_):
+                notes[id_] = None
+            else:
+                missing.append(id_)
+        found = await self.hot.read_notes([i for i in notes])
+        missing.extend(id_ for id_ in notes if id_ not in found)
+        notes.update(found)
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            for id_ in missing:
+                self._loading.setdefault(id_, [0, False])[0] += 1
+            try:
+                loaded = await self.durable.read_notes(missing)
+            finally:
+                stale = set()
+                for id_ in missing:
+                    loading = self._loading[id_]
+                    loading[0] -= 1
+                    if loading[1]:
+                        stale.add(id_)
+                    if not loading[0]:
+                        del self._loading[id_]
+            for id_, note in loaded.items():
+                notes[id_] = note
+                if id_ not in stale and id_ not in self.policy:
+                    await self._promote(id_, note)
+        return {id_: note for id_, note in notes.items() if note is not None}
+
+    async def update_note(self, id_: str, note: Note) -> None:
+        await self.durable.update_note(id_, note)
+        self._written(id_)
+        self.policy.access(id_)
+        await self._promote(id_, note)
+
+    async def patch_note(self, id_: str, changes: Mapping[str, Any]) -> None:
+        # A hot note is patched in place; a cold one stays cold, promoting
+        # it would take a durable read
+        await self.durable.patch_note(id_, changes)
+        self._written(id_)
+        if id_ not in self.policy:
+            return
+        try:
+            hot = await self.hot.read_note(id_)
+        except KeyError:
+            return
+        self.policy.access(id_)
+        await self._promote(
+            id_, Note.from_api_dm({**hot.to_api_dm(), **changes})
+        )
+
+    async def delete_note(self, id_: str) -> None:
+        await self.durable.delete_note(id_)
+        self._written(id_)
+        if id_ in self.policy:
+            self.policy.remove(id_)
+            try:
+                await self.hot.delete_note(id_)
+            except KeyError:
+                pass
+
+    async def read_all_notes(self) -> AsyncIterator[Tuple[str, Note]]:
+        async for id_, note in self.durable.read_all_notes():
+            yield id_, note
+
+    async def read_changes(self, since: int, limit: int) -> NoteChanges:
+        return await self.durable.read_changes(since, limit)
+
+    async def collect_bodies(self) -> int:
+        return await self.durable.collect_bodies()
+
+    async def backup(self, path: str) -> Dict[str, Any]:
+        return await self.durable.backup(path)
+
+    def stats(self) -> Dict[str, float]:
+        reads = self.hits + self.misses
+        return {
+            **self.durable.stats(),
+            'hot_hits': self.hits,
+            'hot_misses': self.misses,
+            'hot_hit_ratio': self.hits / reads if reads else 0.0,
+            'hot_promotions': self.promotions,
+            'hot_demotions': self.demotions,
+            'hot_rejections': self.policy.rejections,
+            'hot_notes': len(self.policy),
+            'hot_bytes': self.policy.size
+        }
@@ -1,13 +1,42 @@
 # Importing modules
+import asyncio
+import os
 import time
 import jsonschema
-from typing import Dict, Mapping
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
 import logging
-import uuid
+from notesservice.database.backup import BackupBusyError
 from notesservice.database.db_engines import create_notes_db
+from notesservice.database.instrumented_db import InstrumentedNotesDB
 from notesservice import NOTES_SCHEMA
 from notesservice.datamodel import Note
 from notesservice.utils.asyncutils import run_coroutine
+from notesservice.utils.eventhub import (
+    DEFAULT_BUFFER_EVENTS,
+    DEFAULT_HEARTBEAT_SECONDS,
+    EventHub
+)
+from notesservice.utils.idutils import id_generator
+from notesservice.utils.metrics import MetricsRegistry
+from notesservice.utils.singleflight import SingleFlight
+import notesservice.utils.logutils as logutils
+import notesservice.utils.timeutils as timeutils
+
+# Where the admin backup endpoint writes backups by default
+DEFAULT_BACKUP_DIR = './backups'
+
+# Key of the full list read, the one read coalesced by _list_reads
+LIST_READ_KEY = '*'
+
+# Fields a PATCH may change, each validated on its own against its
+# property schema
+PATCH_VALIDATORS = {
+    name: jsonschema.Draft7Validator({
+        'definitions': NOTES_SCHEMA['definitions'],
+        **NOTES_SCHEMA['definitions']['noteEntry']['properties'][name]
+    })
+    for name in ['title', 'body', 'note_type']
+}
 
 
 # Creating NotesService class
@@ -15,11 +44,40 @@ class NotesService:
     def __init__(
         self,
         config: Dict,
-        logger: logging.Logger
+        logger: logging.Logger,
+        metrics: MetricsRegistry = None
     ) -> None:
-        self.notes_db = create_notes_db(config['notes-db'])
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.notes_db = InstrumentedNotesDB(
+            create_notes_db(config['notes-db']),
+            self.metrics
+        )
         self.logger = logger
         self.notes = {}
+        service_config = config.get('service') or {}
+        self._new_id = id_generator(service_config.get('id-scheme', 'random'))
+        # Concurrent reads of the same note, and of the full list, share
+        # one DB read; every mutation detaches the reads it may outdate
+        coalesce = service_config.get('coalesce-reads', True)
+        self._note_reads = SingleFlight(self.metrics, 'note', coalesce)
+        self._list_reads = SingleFlight(self.metrics, 'list', coalesce)
+        # Change events for the SSE stream, published after every
+        # successful mutation
+        stream_config = config.get('stream') or {}
+        self.events = EventHub(
+            self.metrics,
+            buffer_events=stream_config.get(
+                'buffer-events', DEFAULT_BUFFER_EVENTS
+            ),
+            heartbeat=stream_config.get(
+                'heartbeat-seconds', DEFAULT_HEARTBEAT_SECONDS
+            )
+        )
+        # One online backup at a time; the status of the latest is kept
+        admin_config = config.get('admin') or {}
+        self._backup_dir = admin_config.get('backup-dir', DEFAULT_BACKUP_DIR)
+        self._backup: Optional[asyncio.Future] = None
+        self._backup_status: Dict[str, Any] = {'state': 'idle'}
 
     def start(self):
         coro = self.notes_db.start()
@@ -29,9 +87,58 @@ class NotesService:
         coro = self.notes_db.stop()
         run_coroutine(coro)
 
+    def start_backup(self) -> Dict[str, Any]:
+        '''
+        Starts an online backup of the store into a new, timestamped entry
+        of the backup directory.
+
+        Returns:
+            the backup status
+
+        Raises:
+            BackupBusyError: a backup is running already
+        '''
+        if self._backup is not None and not self._backup.done():
+            raise BackupBusyError('A backup is running already')
+
+        os.makedirs(self._backup_dir, exist_ok=True)
+        path = os.path.join(
+            self._backup_dir,
+            time.strftime('notes-%Y%m%dT%H%M%SZ', time.gmtime())
+        )
+        self._backup_status = {
+            'state': 'running',
+            'path': path,
+            'started_on': int(time.time())
+        }
+        self._backup = asyncio.ensure_future(self._run_backup(path))
+        return self.backup_status()
+
+    async def _run_backup(self, path: str) -> None:
+        status = self._backup_status
+        try:
+            status['result'] = await self.notes_db.backup(path)
+            status['state'] = 'done'
+        except Exception as e:
+            status['state'] = 'failed'
+            status['error'] = str(e)
+        details = {'error': status['error']} if 'error' in status else {}
+        logutils.log(
+            self.logger,
+            logging.INFO if status['state'] == 'done' else logging.ERROR,
+            message='BACKUP',
+            state=status['state'],
+            path=path,
+            **details
+        )
+
+    def backup_status(self) -> Dict[str, Any]:
+        # The running backup, or the latest one
+        return dict(self._backup_status)
+
     def _generate_id(self) -> str:
-        # Generate UUID string
-        _id = uuid.uuid4().hex
+        # Generate a 32 hex chars id with the configured scheme
+        _id = self._new_id()
         return _id
 
     def _generate_note(self, id_: str, ts: int, value: Dict) -> Dict:
@@ -51,13 +158,59 @@ class NotesService:
         except jsonschema.exceptions.ValidationError:
             raise ValueError('JSON Schema validation failed')
 
-    async def get_notes(self) -> list:
-        async for id_, note in self.notes_db.read_all_notes():
+    def _invalidate_reads(self, note_id: str) -> None:
+        # Called once a mutation is stored: reads in flight may have seen
+        # the old state, so callers from now on must not share them
+        self._note_reads.forget(note_id)
+        self._list_reads.forget(LIST_READ_KEY)
+
+    async def _read_all_notes(self) -> List:
+        return [
+            (id_, note)
+            async for id_, note in self.notes_db.read_all_notes()
+        ]
+
+    async def get_notes(self) -> AsyncIterator[Tuple[str, Dict]]:
+        # The list is read whole so that concurrent callers can share it
+        with timeutils.phase('db'):
+            notes = await self._list_reads.do(
+                LIST_READ_KEY, self._read_all_notes
+            )
+        for id_, note in notes:
             yield id_, note.to_api_dm()
 
+    async def get_notes_by_ids(self, ids: List[str]) -> Dict:
+        # Multi-get: the notes found and the ids that were not
+        with timeutils.phase('db'):
+            notes = await self.notes_db.read_notes(ids)
+
+        return {
+            'notes': {id_: notes[id_].to_api_dm() for id_ in notes},
+            'missing': [id_ for id_ in ids if id_ not in notes]
+        }
+
+    async def get_changes(self, token: str, limit: int) -> Dict:
+        # Delta sync: notes changed and ids deleted since the sync token
+        # of an earlier call ('0' or empty for a full sync)
+        try:
+            since = int(token or 0)
+        except ValueError:
+            raise ValueError('Invalid sync token {}'.format(token))
+
+        with timeutils.phase('db'):
+            changes = await self.notes_db.read_changes(since, limit)
+
+        return {
+            'notes': {id_: note.to_api_dm() for id_, note in changes.notes},
+            'deleted': changes.deleted,
+            'token': str(changes.token),
+            'more': changes.more
+        }
+
     async def create_note(self, value: Dict) -> Dict:
         # Validate payload
-        self.validate_note(value)
+        with timeutils.phase('validate'):
+            self.validate_note(value)
 
         # Generate unique id
         id_ = self._generate_id()
@@ -71,18 +224,25 @@ class NotesService:
         note = Note.from_api_dm(note_)
 
         # Store note
-        key = await self.notes_db.create_note(note, id_)
+        with timeutils.phase('db'):
+            key = await self.notes_db.create_note(note, id_)
+        self._invalidate_reads(key)
 
+        self.events.publish('created', {'id': key, 'note': note_})
         return key
 
     async def get_note(self, note_id: str) -> Dict:
         # Return note with a note id
-        note = await self.notes_db.read_note(note_id)
+        with timeutils.phase('db'):
+            note = await self._note_reads.do(
+                note_id, lambda: self.notes_db.read_note(note_id)
+            )
         return note.to_api_dm()
 
     async def update_note(self, note_id: str, value: Dict) -> None:
         # Validate payload
-        self.validate_note(value)
+        with timeutils.phase('validate'):
+            self.validate_note(value)
         # Fetch timestanp`
         now_ts = int(time.time())
 
@@ -92,8 +252,53 @@ class NotesService:
         note = Note.from_api_dm(note_)
 
         # Update note with the generated note
-        await self.notes_db.update_note(note_id, note)
+        with timeutils.phase('db'):
+            try:
+                await self.notes_db.update_note(note_id, note)
+            finally:
+                self._invalidate_reads(note_id)
+
+        self.events.publish('updated', {'id': note_id, 'note': note_})
+
+    def validate_patch(self, patch: Mapping) -> Dict:
+        # JSON merge patch: only the fields present are validated; null
+        # would remove a field, and all patchable fields are required
+        if not isinstance(patch, Mapping):
+            raise ValueError('JSON merge patch must be an object')
+
+        changes = {}
+        for name, validator in PATCH_VALIDATORS.items():
+            if name not in patch:
+                continue
+            if patch[name] is None:
+                raise ValueError('{} cannot be removed'.format(name))
+            try:
+                validator.validate(patch[name])
+            except jsonschema.exceptions.ValidationError:
+                raise ValueError('Invalid {}'.format(name))
+            changes[name] = patch[name]
+        return changes
+
+    async def patch_note(self, note_id: str, patch: Dict) -> None:
+        # Validate only the fields in the patch
+        with timeutils.phase('validate'):
+            changes = self.validate_patch(patch)
+        changes['updated_on'] = int(time.time())
+
+        with timeutils.phase('db'):
+            try:
+                await self.notes_db.patch_note(note_id, changes)
+            finally:
+                self._invalidate_reads(note_id)
+
+        self.events.publish('patched', {'id': note_id, 'changes': changes})
 
     async def delete_note(self, note_id: str) -> None:
         # Remove note with note id
-        await self.notes_db.delete_note(note_id)
+        with timeutils.phase('db'):
+            try:
+                await self.notes_db.delete_note(note_id)
+            finally:
+                self._invalidate_reads(note_id)
+
+        self.events.publish('deleted', {'id': note_id})
@@ -1,42 +1,146 @@
 # Importing modules
 
+import functools
+import tornado.http1connection
+import tornado.iostream
 import tornado.web
 import logging
 from types import TracebackType
+from asyncio import Future
 from typing import (
     Any,
     Awaitable,
+    Callable,
+    List,
     Tuple,
     Dict,
     Optional,
     Type
 )
+import hmac
 import traceback
 import json
+import time
 import uuid
+from notesservice.database.backup import BackupBusyError
+from notesservice.database.changelog import ChangesExpiredError
 from notesservice.service import NotesService
 from notesservice import LOGGER_NAME
 import notesservice.utils.logutils as logutils
+import notesservice.utils.profiling as profiling
+import notesservice.utils.timeutils as timeutils
+from notesservice.utils.admission import (
+    AdmissionController,
+    AdmissionRejectedError,
+    ConcurrencyLimiter
+)
+from notesservice.utils.compression import CompressionPolicy
+from notesservice.utils.ratelimit import RateLimiter
+from notesservice.utils.metrics import (
+    Gauge,
+    MetricsRegistry,
+    PROMETHEUS_CONTENT_TYPE
+)
 
 NOTES_LIST_REGEX = r'/notes/?'
+NOTES_CHANGES_REGEX = r'/notes/changes/?'
+NOTES_STREAM_REGEX = r'/notes/stream/?'
+NOTES_MULTI_GET_REGEX = r'/notes/multi-get/?'
 NOTES_REGEX = r'/notes/(?P<id>[a-zA-Z0-9-]+)/?'
 APP_VERSION = r'/v1'
 NOTES_ENTRY_URI_FORMAT_SR = r'/notes/{id}'
+METRICS_URI = r'/metrics'
+ADMIN_PROFILE_URI = r'/admin/profile'
+ADMIN_TRACEMALLOC_URI = r'/admin/tracemalloc'
+ADMIN_BACKUP_URI = r'/admin/backup'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+# Changes returned by one delta sync call
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 10000
+# Ids in one multi-get request
+MAX_MULTI_GET_IDS = 1000
+# Request body limit unless configured otherwise (Tornado's default)
+DEFAULT_MAX_BODY_BYTES = 100 * 1024 * 1024
+
+
+def record_request_metrics(
+    metrics: MetricsRegistry,
+    handler: tornado.web.RequestHandler,
+    route: str
+) -> None:
+    labels = (handler.request.method or '', route, str(handler.get_status()))
+    metrics.counter(
+        'notesservice_http_requests_total',
+        'Total HTTP requests by method, route and status',
+        ('method', 'route', 'status')
+    ).inc(labels)
+    metrics.histogram(
+        'notesservice_http_request_duration_seconds',
+        'HTTP request latency by method, route and status',
+        ('method', 'route', 'status')
+    ).observe(handler.request.request_time(), labels)
+
+
+def in_flight_gauge(metrics: MetricsRegistry) -> Gauge:
+    return metrics.gauge(
+        'notesservice_http_requests_in_flight',
+        'HTTP requests currently being served',
+        ('route',)
+    )
+
+
+# Creating RetryAfterError class
+class RetryAfterError(tornado.web.HTTPError):
+    '''
+    HTTPError answered with a Retry-After header (503 when shedding load,
+    429 when rate limiting).
+    '''
+    def __init__(
+        self,
+        status_code: int,
+        retry_after: int,
+        reason: str = None
+    ) -> None:
+        super().__init__(status_code, reason=reason)
+        self.retry_after = retry_after
 
 
 # Creating BaseRequestHandler class
 class BaseRequestHandler(tornado.web.RequestHandler):
+    # Label used for this handler's metrics
+    route_name = 'unknown'
+    # Whether the route's concurrency is limited by admission control
+    admission_controlled = True
+    # Whether requests to the route take tokens from the client's bucket
+    rate_limited = True
+
     def initialize(
         self,
         service: NotesService,
         config: Dict,
-        logger: logging.Logger
+        logger: logging.Logger,
+        admission: AdmissionController = None,
+        rate_limiter: RateLimiter = None,
+        compression: CompressionPolicy = None
     ) -> None:
         self.service = service
         self.config = config
         self.logger = logger
+        self.metrics: Optional[MetricsRegistry] = service.metrics
+        self._in_flight = False
+        self.admission = admission
+        self._limiter = (
+            admission.limiter(self.route_name)
+            if admission is not None and self.admission_controlled
+            else None
+        )
+        self._admitted_at: Optional[float] = None
+        self.rate_limiter = rate_limiter if self.rate_limited else None
+        self.compression = compression
 
     def prepare(self) -> Optional[Awaitable[None]]:
+        timeutils.begin_phase_timing()
+
         req_id = uuid.uuid4().hex
         logutils.set_log_context(
             req_id=req_id,
@@ -52,9 +156,156 @@ class BaseRequestHandler(tornado.web.RequestHandler):
             message='REQUEST'
         )
 
+        self._begin_in_flight()
+
+        # Too large by the announced length: 413 without reading the body
+        content_length = self.request.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            if int(content_length) > self.max_body_bytes():
+                raise tornado.web.HTTPError(
+                    413, reason='Request body too large'
+                )
+
+        # Rejected before taking an admission slot or doing any work
+        # (A request read by the server always has its method and remote
+        # address)
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.check(
+                self.route_name,
+                self.request.method or '',
+                self.rate_limiter.client_key(
+                    self.request.remote_ip or '',
+                    self.request.headers.get(self.rate_limiter.key_header)
+                )
+            )
+            if retry_after:
+                raise RetryAfterError(
+                    429, retry_after, reason='Too Many Requests'
+                )
+
+        if self._limiter is not None:
+            if not self._limiter.try_acquire():
+                return self._wait_for_admission(self._limiter)
+            self._admitted_at = time.monotonic()
+
         return super().prepare()
 
+    def max_body_bytes(self) -> int:
+        body_config = (self.config or {}).get('request-body') or {}
+        route_config = (body_config.get('routes') or {}).get(
+            self.route_name
+        ) or {}
+        return route_config.get(
+            'max-bytes', body_config.get('max-bytes', DEFAULT_MAX_BODY_BYTES)
+        )
+
+    def json_body(self) -> Any:
+        # Parsed straight from the bytes (json detects the encoding), which
+        # saves the decoded copy of the body
+        try:
+            return json.loads(self.request.body)
+        except UnicodeDecodeError as e:
+            raise json.decoder.JSONDecodeError(str(e), '', 0)
+
+    async def _wait_for_admission(self, limiter: ConcurrencyLimiter) -> None:
+        # Queued behind the route's concurrency limit, or shed with 503
+        try:
+            await limiter.acquire()
+        except AdmissionRejectedError as e:
+            if self.admission is not None:
+                self.admission.record_shed(self.route_name, e.reason)
+            logutils.set_log_context(shed=e.reason)
+            raise RetryAfterError(
+                503, e.retry_after, reason='Service Unavailable'
+            )
+        self._admitted_at = time.monotonic()
+
+    def _end_admission(self) -> None:
+        if self._admitted_at is not None and self._limiter is not None:
+            self._limiter.release(self._admitted_at)
+            self._admitted_at = None
+
+    def _begin_in_flight(self) -> None:
+        if self.metrics is not None:
+            in_flight_gauge(self.metrics).inc((self.route_name,))
+            self._in_flight = True
+
+    def _end_in_flight(self) -> None:
+        if self._in_flight and self.metrics is not None:
+            in_flight_gauge(self.metrics).dec((self.route_name,))
+            self._in_flight = False
+
+    def on_connection_close(self) -> None:
+        self._end_in_flight()
+        super().on_connection_close()
+
+    def _server_timing_enabled(self) -> bool:
+        instrumentation = (self.config or {}).get('instrumentation') or {}
+        return bool(instrumentation.get('server-timing', False))
+
+    def finish(self, chunk: Any = None) -> 'Future[None]':
+        if chunk is not None:
+            with timeutils.phase('serialize'):
+                self.write(chunk)
+            chunk = None
+
+        if not self._headers_written:
+            self._compress_response()
+
+        if self._server_timing_enabled() and not self._headers_written:
+            timings = timeutils.get_phase_timings()
+            timings['total'] = 1000.0 * self.request.request_time()
+            self.set_header(
+                'Server-Timing', timeutils.format_server_timing(timings)
+            )
+
+        return super().finish(chunk)
+
+    def _compress_response(self) -> None:
+        # Gzips the buffered body by the compression policy of the route;
+        # a body with an ETag is compressed once while it stays unchanged
+        if self.compression is None:
+            return
+        settings = self.compression.route_settings(self.route_name)
+        if settings is None:
+            return
+        min_size, level = settings
+
+        self.set_header('Vary', 'Accept-Encoding')
+        if (
+            'gzip' not in self.request.headers.get('Accept-Encoding', '') or
+            'Content-Encoding' in self._headers or
+            not self.compression.compressible(
+                self._headers.get('Content-Type', '')
+            ) or
+            sum(len(part) for part in self._write_buffer) < min_size
+        ):
+            return
+
+        etag = None
+        if self._status_code == 200 and self.request.method == 'GET':
+            # What finish() would do, but on the uncompressed body
+            self.set_etag_header()
+            if self.check_etag_header():
+                self._write_buffer = []
+                self.set_status(304)
+                return
+            etag = self._headers['Etag']
+
+        with timeutils.phase('compress'):
+            body = self.compression.compress(
+                b''.join(self._write_buffer), level, etag
+            )
+        self._write_buffer = [body]
+        self.set_header('Content-Encoding', 'gzip')
+
     def on_finish(self) -> None:
+        # The admission slot is held until the handler is done, even if
+        # the client went away before
+        self._end_admission()
+        self._end_in_flight()
+        if self.metrics is not None:
+            record_request_metrics(self.metrics, self, self.route_name)
         super().on_finish()
 
     def write_error(self, status_code: int, **kwargs: Any) -> None:
@@ -70,6 +321,9 @@ class BaseRequestHandler(tornado.web.RequestHandler):
 
         if 'exc_info' in kwargs:
             exc_info = kwargs['exc_info']
+            retry_after = getattr(exc_info[1], 'retry_after', None)
+            if retry_after is not None:
+                self.set_header('Retry-After', str(retry_after))
             logutils.set_log_context(exc_info=exc_info)
             if self.settings.get('serve_traceback'):
                 # in debug mode, send a traceback
@@ -112,9 +366,17 @@ class DefaultRequestHandler(BaseRequestHandler):
         self,
         status_code: int,
         message: str,
-        logger: logging.Logger
+        logger: logging.Logger,
+        metrics: MetricsRegistry = None
     ):
         self.logger = logger
+        self.config: Dict = {}
+        self.metrics = metrics
+        self._in_flight = False
+        self._limiter = None
+        self._admitted_at = None
+        self.rate_limiter = None
+        self.compression = None
         self.set_status(status_code, reason=message)
 
     def prepare(self) -> Optional[Awaitable[None]]:
@@ -126,17 +388,288 @@ class DefaultRequestHandler(BaseRequestHandler):
         )
 
 
+# Creating MetricsRequestHandler
+class MetricsRequestHandler(BaseRequestHandler):
+    route_name = 'metrics'
+    # Scrapes must get through when the service is overloaded
+    admission_controlled = False
+    rate_limited = False
+
+    async def get(self):
+        '''
+        GET request handler for service metrics
+
+        Returns:
+            Status 200 along with the metrics in Prometheus text format
+        '''
+        self.set_status(200)
+        self.set_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.finish(self.metrics.render())
+
+
+# Creating AdminRequestHandler class
+class AdminRequestHandler(BaseRequestHandler):
+    admission_controlled = False
+    rate_limited = False
+
+    def prepare(self) -> Optional[Awaitable[None]]:
+        result = super().prepare()
+
+        token = (self.config.get('admin') or {}).get('token')
+        given = self.request.headers.get(ADMIN_TOKEN_HEADER, '')
+        if not token or not hmac.compare_digest(str(token), given):
+            raise tornado.web.HTTPError(403, reason='Forbidden')
+
+        return result
+
+    def get_float_argument(
+        self,
+        name: str,
+        default: float,
+        maximum: float
+    ) -> float:
+        try:
+            value = float(self.get_argument(name, str(default)))
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, reason='Invalid {}'.format(name)
+            )
+        if not 0 < value <= maximum:
+            raise tornado.web.HTTPError(
+                400, reason='{} must be in (0, {}]'.format(name, maximum)
+            )
+        return value
+
+
+# Creating ProfileRequestHandler class
+class ProfileRequestHandler(AdminRequestHandler):
+    route_name = 'admin_profile'
+
+    async def get(self):
+        '''
+        GET request handler to profile the live process
+
+        Query args:
+            seconds: [float] capture duration, default 10
+            mode: [str] cprofile (pstats report) or sample (collapsed stacks)
+            sort: [str] pstats sort key for cprofile mode
+
+        Returns:
+            Status 200 along with the profile as text
+        Raises:
+            tornado.web.HTTPError [400] upon invalid arguments
+            tornado.web.HTTPError [409] if a capture is already running
+        '''
+        admin_config = self.config.get('admin') or {}
+        seconds = self.get_float_argument(
+            'seconds', 10.0, admin_config.get('max-profile-seconds', 60)
+        )
+        mode = self.get_argument('mode', 'cprofile')
+        sort_key = self.get_argument('sort', 'cumulative')
+        if mode not in ['cprofile', 'sample']:
+            raise tornado.web.HTTPError(400, reason='Invalid mode')
+        if sort_key not in profiling.PSTATS_SORT_KEYS:
+            raise tornado.web.HTTPError(400, reason='Invalid sort')
+
+        try:
+            if mode == 'cprofile':
+                report = await profiling.cprofile_capture(seconds, sort_key)
+            else:
+                report = await profiling.sample_capture(seconds)
+        except profiling.ProfilerBusyError as e:
+            raise tornado.web.HTTPError(409, reason=str(e))
+
+        self.set_status(200)
+        self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.finish(report)
+
+
+# Creating TracemallocRequestHandler class
+class TracemallocRequestHandler(AdminRequestHandler):
+    route_name = 'admin_tracemalloc'
+
+    async def get(self):
+        '''
+        GET request handler for the top memory allocation sites
+
+        Query args:
+            top: [int] number of allocation sites, default 20
+            compare: [bool] report growth since the previous snapshot
+
+        Returns:
+            Status 200 along with the allocation sites
+        Raises:
+            tornado.web.HTTPError [409] if tracemalloc is not tracing
+        '''
+        limit = int(self.get_float_argument('top', 20, 1000))
+        compare = self.get_argument('compare', 'false') in ['1', 'true']
+        try:
+            report = await profiling.tracemalloc_top(limit, compare=compare)
+        except RuntimeError as e:
+            raise tornado.web.HTTPError(409, reason=str(e))
+
+        self.set_status(200)
+        self.finish(report)
+
+    async def post(self):
+        '''
+        POST request handler to start tracing memory allocations
+
+        Query args:
+            frames: [int] frames stored per allocation traceback, default 1
+
+        Returns:
+            Status 204
+        '''
+        nframes = int(self.get_float_argument('frames', 1, 100))
+        profiling.start_tracemalloc(nframes)
+        self.set_status(204)
+        self.finish()
+
+    async def delete(self):
+        '''
+        DELETE request handler to stop tracing memory allocations
+
+        Returns:
+            Status 204
+        '''
+        profiling.stop_tracemalloc()
+        self.set_status(204)
+        self.finish()
+
+
+# Creating BackupRequestHandler class
+class BackupRequestHandler(AdminRequestHandler):
+    route_name = 'admin_backup'
+
+    async def get(self):
+        '''
+        GET request handler for the status of the running or latest backup
+
+        Returns:
+            Status 200 along with the state (idle, running, done, failed),
+            the backup path and, once done, its summary
+        '''
+        self.set_status(200)
+        self.finish(self.service.backup_status())
+
+    async def post(self):
+        '''
+        POST request handler to start an online backup of the store into
+        the configured backup directory
+
+        Returns:
+            Status 202 along with the backup status; poll it with GET
+        Raises:
+            tornado.web.HTTPError [409] if a backup is already running
+        '''
+        try:
+            status = self.service.start_backup()
+        except BackupBusyError as e:
+            raise tornado.web.HTTPError(409, reason=str(e))
+
+        self.set_status(202)
+        self.finish(status)
+
+
+def unique_ids(ids: List[Any]) -> List[str]:
+    # Multi-get ids without duplicates, in request order
+    if not all(isinstance(id_, str) for id_ in ids):
+        raise tornado.web.HTTPError(400, reason='ids must be strings')
+    ids = list(dict.fromkeys(id_.strip() for id_ in ids if id_.strip()))
+    if not ids or len(ids) > MAX_MULTI_GET_IDS:
+        raise tornado.web.HTTPError(
+            400, reason='ids must list 1 to {} ids'.format(MAX_MULTI_GET_IDS)
+        )
+    return ids
+
+
+def unless_refused(method: Callable[..., Awaitable[None]]) -> Callable[
+    ..., Awaitable[None]
+]:
+    '''
+    Decorates the HTTP methods of a StreamingBodyRequestHandler: once
+    data_received() refused the body (413), a method still called when
+    the rest of the body arrives does nothing.
+    '''
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs) -> None:
+        if self._finished:
+            return
+        await method(self, *args, **kwargs)
+    return wrapper
+
+
+# Creating StreamingBodyRequestHandler class
+@tornado.web.stream_request_body
+class StreamingBodyRequestHandler(BaseRequestHandler):
+    '''
+    Reads the request body as it arrives into one buffer, instead of
+    Tornado's list of chunks joined into a second copy once complete.
+    Bodies over the route's max size are refused with 413: before any of
+    the body is read when Content-Length announces it, else as soon as
+    the streamed body grows past it. The HTTP methods of subclasses are
+    decorated with unless_refused.
+    '''
+    def prepare(self) -> Optional[Awaitable[None]]:
+        self._body = bytearray()
+        self._body_limit = self.max_body_bytes()
+        # Also enforced by Tornado's HTTP/1 connections, which stop reading
+        # and close (after the 413 below) instead of buffering the rest;
+        # on others, data_received() alone enforces it
+        connection = self.request.connection
+        if isinstance(connection, tornado.http1connection.HTTP1Connection):
+            connection.set_max_body_size(self._body_limit + 65536)
+        return super().prepare()
+
+    def data_received(self, chunk: bytes) -> None:
+        if self._finished:
+            return
+        if len(self._body) + len(chunk) > self._body_limit:
+            # Answered right away; Tornado closes the connection once the
+            # response is sent, without reading the rest of the body
+            self._body = bytearray()
+            self.send_error(413, reason='Request body too large')
+            return
+        self._body += chunk
+
+    def json_body(self) -> Any:
+        if self._finished:
+            # Refused with 413 while the body was arriving
+            raise tornado.web.Finish()
+        # The buffer is released once parsed, ahead of the DB work
+        body, self._body = self._body, bytearray()
+        try:
+            return json.loads(body)
+        except UnicodeDecodeError as e:
+            raise json.decoder.JSONDecodeError(str(e), '', 0)
+
+
 # Creating NotesRequestHandler
-class NotesRequestHandler(BaseRequestHandler):
+class NotesRequestHandler(StreamingBodyRequestHandler):
+    route_name = 'notes'
+
+    @unless_refused
     async def get(self):
         '''
-        GET request handler for notes request
+        GET request handler for notes request; ?ids=a,b,c fetches only
+        the given notes (multi-get)
 
         Returns:
             Status 200 along with the note object as response
         Raises:
+            tornado.web.HTTPError [400] upon invalid ids
             tornado.web.HTTPError [404] upon Exception
         '''
+        ids = self.get_argument('ids', None)
+        if ids is not None:
+            response = await self.service.get_notes_by_ids(
+                unique_ids(ids.split(','))
+            )
+            self.set_status(200)
+            self.finish(response)
+            return
+
         try:
             all_notes = {}
             async for id_, note in self.service.get_notes():
@@ -147,6 +680,7 @@ class NotesRequestHandler(BaseRequestHandler):
         except Exception as e:
             raise tornado.web.HTTPError(404, reason=str(e))
 
+    @unless_refused
     async def post(self):
         '''
         POST request handler for notes request
@@ -158,12 +692,15 @@ class NotesRequestHandler(BaseRequestHandler):
             tornado.web.HTTPError [404] upon KeyError, Exception
         '''
         try:
-            body = json.loads(self.request.body.decode('utf-8'))
+            with timeutils.phase('parse'):
+                body = self.json_body()
             id = await self.service.create_note(body)
             note_uri = APP_VERSION + NOTES_ENTRY_URI_FORMAT_SR.format(id=id)
             self.set_status(201)
             self.set_header('Location', note_uri)
             self.finish()
+        except tornado.web.Finish:
+            raise
         except (json.decoder.JSONDecodeError, TypeError):
             raise tornado.web.HTTPError(
                 400, reason='Invalid JSON body'
@@ -172,8 +709,132 @@ class NotesRequestHandler(BaseRequestHandler):
             raise tornado.web.HTTPError(404, reason=str(e))
 
 
+# Creating NotesMultiGetRequestHandler class
+class NotesMultiGetRequestHandler(BaseRequestHandler):
+    route_name = 'multi-get'
+
+    async def post(self):
+        '''
+        POST request handler for multi-get of long id lists, with body
+        {"ids": [...]}
+
+        Returns:
+            Status 200 with the notes found by id and the missing ids
+        Raises:
+            tornado.web.HTTPError [400] upon invalid JSON body or ids
+        '''
+        try:
+            with timeutils.phase('parse'):
+                body = self.json_body()
+            ids = body['ids']
+            if not isinstance(ids, list):
+                raise TypeError('ids must be a list')
+        except (json.decoder.JSONDecodeError, TypeError, KeyError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid JSON body'
+            )
+
+        response = await self.service.get_notes_by_ids(unique_ids(ids))
+        self.set_status(200)
+        self.finish(response)
+
+
+# Creating NotesChangesRequestHandler class
+class NotesChangesRequestHandler(BaseRequestHandler):
+    route_name = 'changes'
+
+    async def get(self):
+        '''
+        GET request handler for delta sync: ?since=<token>&limit=<n>
+
+        Returns:
+            Status 200 with the changed notes, deleted ids, the token for
+            the next call and whether more changes are left
+        Raises:
+            tornado.web.HTTPError [400] upon invalid token or limit
+            tornado.web.HTTPError [410] upon expired token (full resync)
+        '''
+        try:
+            limit = int(self.get_argument('limit', DEFAULT_CHANGES_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_CHANGES_LIMIT:
+            raise tornado.web.HTTPError(
+                400, reason='limit must be between 1 and {}'.format(
+                    MAX_CHANGES_LIMIT
+                )
+            )
+
+        try:
+            response = await self.service.get_changes(
+                self.get_argument('since', '0'), limit
+            )
+            self.set_status(200)
+            self.finish(response)
+        except ChangesExpiredError as e:
+            raise tornado.web.HTTPError(410, reason=str(e))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+
+
+# Creating NotesStreamRequestHandler class
+class NotesStreamRequestHandler(BaseRequestHandler):
+    route_name = 'stream'
+    # Streams are long lived and would hold their slot for good
+    admission_controlled = False
+
+    # Sent when the client fell behind: fetch /notes/changes, reconnect
+    RESYNC_FRAME = b'event: resync\ndata: {}\n\n'
+    HEARTBEAT_FRAME = b':\n\n'
+
+    def prepare(self) -> Optional[Awaitable[None]]:
+        self._closed = False
+        return super().prepare()
+
+    def on_connection_close(self) -> None:
+        self._closed = True
+        super().on_connection_close()
+
+    async def get(self):
+        '''
+        GET request handler for the Server-Sent Events change stream
+
+        Returns:
+            Status 200 with a text/event-stream of created, updated,
+            patched and deleted events (ids usable as Last-Event-ID),
+            heartbeat comments, and a resync event when events were
+            dropped. created and updated carry the full note, patched only
+            the changed fields and updated_on, deleted the id
+        '''
+        events = self.service.events
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+
+        cursor = events.subscribe(self.request.headers.get('Last-Event-ID'))
+        try:
+            self.write(self.HEARTBEAT_FRAME)
+            await self.flush()
+            while not self._closed:
+                frames, cursor, resync = await events.wait(cursor)
+                if resync:
+                    self.write(self.RESYNC_FRAME)
+                elif frames:
+                    self.write(b''.join(frames))
+                else:
+                    self.write(self.HEARTBEAT_FRAME)
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            events.unsubscribe()
+
+
 # Creating NotesEntryRequestHandler
-class NotesEntryRequestHandler(BaseRequestHandler):
+class NotesEntryRequestHandler(StreamingBodyRequestHandler):
+    route_name = 'note'
+
+    @unless_refused
     async def get(self, id):
         '''
         GET request handler for note entry
@@ -195,6 +856,7 @@ class NotesEntryRequestHandler(BaseRequestHandler):
         except Exception as e:
             raise tornado.web.HTTPError(404, reason=str(e))
 
+    @unless_refused
     async def put(self, id):
         '''
         PUT request handler for note entry
@@ -209,10 +871,13 @@ class NotesEntryRequestHandler(BaseRequestHandler):
             tornado.web.HTTPError [400] upon JSONDecodeError, TypeError
         '''
         try:
-            body = json.loads(self.request.body.decode('utf-8'))
+            with timeutils.phase('parse'):
+                body = self.json_body()
             await self.service.update_note(id, body)
             self.set_status(204)
             self.finish()
+        except tornado.web.Finish:
+            raise
         except (json.decoder.JSONDecodeError, TypeError):
             raise tornado.web.HTTPError(
                 400, reason='Invalid JSON body'
@@ -222,6 +887,38 @@ class NotesEntryRequestHandler(BaseRequestHandler):
         except Exception as e:
             raise tornado.web.HTTPError(404, reason=str(e))
 
+    @unless_refused
+    async def patch(self, id):
+        '''
+        PATCH request handler for note entry: JSON merge patch of the
+        fields to change
+
+        Args:
+            id: [str] Note ID
+
+        Returns:
+            Status 204
+        Raises:
+            tornado.web.HTTPError [404] upon KeyError
+            tornado.web.HTTPError [400] upon JSONDecodeError, TypeError,
+                invalid patch
+        '''
+        try:
+            with timeutils.phase('parse'):
+                body = self.json_body()
+            await self.service.patch_note(id, body)
+            self.set_status(204)
+            self.finish()
+        except (json.decoder.JSONDecodeError, TypeError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid JSON body'
+            )
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+        except KeyError as e:
+            raise tornado.web.HTTPError(404, reason=str(e))
+
+    @unless_refused
     async def delete(self, id):
         '''
         DELETE request handler for note entry
@@ -256,13 +953,19 @@ def log_function(handler: tornado.web.RequestHandler) -> None:
     else:
         level = logging.ERROR
 
+    phase_timings = {
+        name + '_ms': ms
+        for name, ms in timeutils.get_phase_timings().items()
+    }
+
     logutils.log(
         logger,
         level,
         include_context=True,
         message='RESPONSE',
         status=handler.get_status(),
-        time_ms=(1000.0 * handler.request.request_time())
+        time_ms=(1000.0 * handler.request.request_time()),
+        **phase_timings
     )
 
     logutils.clear_log_context()
@@ -274,27 +977,81 @@ def make_notesservice_app(
     logger: logging.Logger
 ) -> Tuple[NotesService, tornado.web.Application]:
     service = NotesService(config, logger)
+
+    admission_config = config.get('admission') or {}
+    admission = None
+    if admission_config.get('enabled', False):
+        admission = AdmissionController(admission_config, service.metrics)
+
+    rate_limit_config = config.get('rate-limit') or {}
+    rate_limiter = None
+    if rate_limit_config.get('enabled', False):
+        rate_limiter = RateLimiter(rate_limit_config, service.metrics)
+
+    # Replaces compress_response, which gzips every textual response
+    compression_config = config.get('compression') or {}
+    compression = None
+    if compression_config.get('enabled', True):
+        compression = CompressionPolicy(compression_config, service.metrics)
+
+    handler_args = dict(
+        service=service,
+        config=config,
+        logger=logger,
+        admission=admission,
+        rate_limiter=rate_limiter,
+        compression=compression
+    )
+
+    admin_handlers: List[Tuple[Any, ...]] = []
+    if (config.get('admin') or {}).get('enabled', False):
+        admin_handlers = [
+            (ADMIN_PROFILE_URI, ProfileRequestHandler, handler_args),
+            (ADMIN_TRACEMALLOC_URI, TracemallocRequestHandler, handler_args),
+            (ADMIN_BACKUP_URI, BackupRequestHandler, handler_args)
+        ]
+
     app = tornado.web.Application(
         [
             (
                 APP_VERSION + NOTES_LIST_REGEX,
                 NotesRequestHandler,
-                dict(service=service, config=config, logger=logger)
+                handler_args
+            ),
+            (
+                APP_VERSION + NOTES_CHANGES_REGEX,
+                NotesChangesRequestHandler,
+                handler_args
+            ),
+            (
+                APP_VERSION + NOTES_MULTI_GET_REGEX,
+                NotesMultiGetRequestHandler,
+                handler_args
+            ),
+            (
+                APP_VERSION + NOTES_STREAM_REGEX,
+                NotesStreamRequestHandler,
+                handler_args
             ),
             (
                 APP_VERSION + NOTES_REGEX,
                 NotesEntryRequestHandler,
-                dict(service=service, config=config, logger=logger)
+                handler_args
+            ),
+            (
+                METRICS_URI,
+                MetricsRequestHandler,
+                handler_args
             )
-        ],
-        compress_response=True,  # compress textual responses
+        ] + admin_handlers,
         log_function=log_function,  # log_request() uses it to log results
         serve_traceback=debug,  # it is passed on as setting to write_error()
         default_handler_class=DefaultRequestHandler,
         default_handler_args={
             'status_code': 404,
             'message': 'Unknown Endpoint',
-            'logger': logger
+            'logger': logger,
+            'metrics': service.metrics
         }
     )
 
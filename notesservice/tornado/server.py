@@ -14,6 +14,7 @@ from notesservice.service import NotesService
 from notesservice.tornado.app import make_notesservice_app
 from notesservice import LOGGER_NAME
 import notesservice.utils.logutils as logutils
+from notesservice.utils.loopmonitor import LoopMonitor
 
 
 def parse_args(args=None):
@@ -64,6 +65,19 @@ def run_server(
     # Start Notes service
     service.start()
 
+    # Monitor event loop lag and callbacks blocking the loop
+    instrumentation = config.get('instrumentation') or {}
+    slow_callback_ms = instrumentation.get('slow-callback-ms', 100)
+    loop_monitor = LoopMonitor(
+        service.metrics,
+        logger,
+        lag_interval=instrumentation.get('loop-lag-interval-ms', 500) / 1000.0,
+        slow_callback_threshold=(
+            slow_callback_ms / 1000.0 if slow_callback_ms else None
+        )
+    )
+    loop_monitor.start(loop)
+
     # Bind http server to port
     http_server_args = {
         'decompress_request': True
@@ -84,6 +98,7 @@ def run_server(
         # signal.SIGINT
         pass
     finally:
+        loop_monitor.stop()
         service.stop()
         loop.stop()
         logutils.log(
@@ -104,11 +119,16 @@ def run_server(
         )
 
 
-def main(args=parse_args()):
+def main(args=None):
     '''
     Starts the Tornado server serving Notes on the given port
     '''
 
+    # Parse here rather than as default value: importing this module must
+    # not parse the command line
+    if args is None:
+        args = parse_args()
+
     config = yaml.load(args.config.read(), Loader=yaml.SafeLoader)
 
     # First thing: set logging config
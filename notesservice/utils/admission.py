@@ -0,0 +1,201 @@
+import asyncio
+from collections import deque
+import time
+from typing import Deque, Dict, Optional
+
+from notesservice.utils.metrics import MetricsRegistry
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_QUEUE_TIMEOUT_MS = 100
+DEFAULT_RETRY_AFTER_SECONDS = 1
+
+# Adaptive limits: latency above target shrinks the limit by `backoff`,
+# latency at or below it grows the limit by about one per limit requests
+DEFAULT_TARGET_LATENCY_MS = 50
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_BACKOFF = 0.9
+
+
+class AdmissionRejectedError(Exception):
+    '''
+    The request was shed: the route is at its concurrency limit and the
+    wait queue is full or the wait timed out.
+    '''
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Creating ConcurrencyLimiter class
+class ConcurrencyLimiter:
+    '''
+    Admits at most `limit` requests at a time; up to `queue_size` more
+    wait in FIFO order for at most `queue_timeout` seconds, the rest are
+    rejected right away. A released slot is handed to the oldest waiter.
+
+    With a `target_latency`, the limit adapts (AIMD): each request that
+    finishes within the target raises it by 1/limit, a slower one lowers
+    it by `backoff`, at most once per round of requests admitted before
+    the previous decrease, so one burst of slow requests is one decrease.
+    '''
+    def __init__(
+        self,
+        limit: int = DEFAULT_MAX_CONCURRENCY,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT_MS / 1000.0,
+        retry_after: int = DEFAULT_RETRY_AFTER_SECONDS,
+        target_latency: float = None,
+        min_limit: int = DEFAULT_MIN_CONCURRENCY,
+        backoff: float = DEFAULT_BACKOFF
+    ) -> None:
+        self.max_limit = limit
+        self.limit = float(limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.target_latency = target_latency
+        self.min_limit = min(min_limit, limit)
+        self.backoff = backoff
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise AdmissionRejectedError('queue_full', self.retry_after)
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # The slot is handed over by release() resolving the waiter
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            raise AdmissionRejectedError('queue_timeout', self.retry_after)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just before the caller went away
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, admitted_at: float = None) -> None:
+        if admitted_at is not None and self.target_latency is not None:
+            self._adapt(admitted_at, time.monotonic())
+
+        while self._waiters and self.in_flight <= int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes on, in_flight stays the same
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _adapt(self, admitted_at: float, now: float) -> None:
+        assert self.target_latency is not None
+        if now - admitted_at <= self.target_latency:
+            self.limit = min(
+                float(self.max_limit), self.limit + 1.0 / self.limit
+            )
+        elif admitted_at > self._last_decrease:
+            self.limit = max(
+                float(self.min_limit), self.limit * self.backoff
+            )
+            self._last_decrease = now
+
+
+# Creating AdmissionController class
+class AdmissionController:
+    '''
+    Concurrency limiters per route, configured by the `admission` section:
+    `default` applies to every route without its own entry in `routes`,
+    and a route set to null in `routes` is not limited.
+    '''
+    def __init__(self, config: Dict, metrics: MetricsRegistry) -> None:
+        self.config = config
+        self._limiters: Dict[str, Optional[ConcurrencyLimiter]] = {}
+        self._shed = metrics.counter(
+            'notesservice_admission_shed_total',
+            'Requests rejected by admission control',
+            ('route', 'reason')
+        )
+        self._limit = metrics.gauge(
+            'notesservice_admission_limit',
+            'Current concurrency limit per route',
+            ('route',)
+        )
+        self._queued = metrics.gauge(
+            'notesservice_admission_queued',
+            'Requests waiting for admission per route',
+            ('route',)
+        )
+        metrics.add_collector(self._collect)
+
+    def limiter(self, route: str) -> Optional[ConcurrencyLimiter]:
+        if route not in self._limiters:
+            self._limiters[route] = self._create_limiter(route)
+        return self._limiters[route]
+
+    def _create_limiter(self, route: str) -> Optional[ConcurrencyLimiter]:
+        routes = self.config.get('routes') or {}
+        if route in routes and routes[route] is None:
+            return None
+        route_config = {
+            **(self.config.get('default') or {}),
+            **(routes.get(route) or {})
+        }
+
+        adaptive = self.config.get('adaptive') or {}
+        target_latency = None
+        if adaptive.get('enabled', False):
+            target_latency = adaptive.get(
+                'target-latency-ms', DEFAULT_TARGET_LATENCY_MS
+            ) / 1000.0
+
+        return ConcurrencyLimiter(
+            limit=route_config.get(
+                'max-concurrency', DEFAULT_MAX_CONCURRENCY
+            ),
+            queue_size=route_config.get('queue-size', DEFAULT_QUEUE_SIZE),
+            queue_timeout=route_config.get(
+                'queue-timeout-ms', DEFAULT_QUEUE_TIMEOUT_MS
+            ) / 1000.0,
+            retry_after=self.config.get(
+                'retry-after-seconds', DEFAULT_RETRY_AFTER_SECONDS
+            ),
+            target_latency=target_latency,
+            min_limit=adaptive.get(
+                'min-concurrency', DEFAULT_MIN_CONCURRENCY
+            ),
+            backoff=adaptive.get('backoff', DEFAULT_BACKOFF)
+        )
+
+    def record_shed(self, route: str, reason: str) -> None:
+        self._shed.inc((route, reason))
+
+    def _collect(self) -> None:
+        for route, limiter in self._limiters.items():
+            if limiter is not None:
+                self._limit.set(int(limiter.limit), (route,))
+                self._queued.set(limiter.queued, (route,))
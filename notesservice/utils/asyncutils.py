@@ -1,7 +1,38 @@
 import asyncio
+import heapq
+from typing import Any, AsyncIterator, Callable, List, Sequence
 
 
 # Run a coroitine inside a sync function
 def run_coroutine(coro):
     loop = asyncio.get_event_loop()
     return loop.run_until_complete(coro)
+
+
+async def merge_sorted(
+    iterators: Sequence[AsyncIterator],
+    key: Callable[[Any], Any]
+) -> AsyncIterator:
+    '''
+    Streaming k-way merge of async iterators that are each sorted by
+    `key`: one item per iterator is held at a time. Items of equal keys
+    come in iterator order.
+    '''
+    heap: List = []
+    for i, iterator in enumerate(iterators):
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            continue
+        heap.append((key(item), i, item))
+    heapq.heapify(heap)
+
+    while heap:
+        _, i, item = heap[0]
+        yield item
+        try:
+            item = await iterators[i].__anext__()
+        except StopAsyncIteration:
+            heapq.heappop(heap)
+            continue
+        heapq.heapreplace(heap, (key(item), i, item))
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import zlib
+
+from notesservice.utils.metrics import MetricsRegistry
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+DEFAULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Compressed in addition to every text/* type
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml'
+}
+
+# zlib window bits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gzip_compress(body: bytes, level: int = DEFAULT_LEVEL) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+# Creating CompressedBodyCache class
+class CompressedBodyCache:
+    '''
+    Gzipped bodies by (ETag, level), evicted least recently used first to
+    stay within `max_bytes` of compressed data.
+    '''
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._bodies: 'OrderedDict[Tuple[str, int], bytes]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._bodies)
+
+    def get(self, key: Tuple[str, int]) -> Optional[bytes]:
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def put(self, key: Tuple[str, int], body: bytes) -> None:
+        if len(body) > self.max_bytes or key in self._bodies:
+            return
+        self._bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+
+# Creating CompressionPolicy class
+class CompressionPolicy:
+    '''
+    Response compression configured by the `compression` section: bodies
+    of at least `min-size` bytes are gzipped at `level`, and `routes` can
+    override both per route or turn compression off with null. Bodies
+    with an ETag are compressed once and served from the cache while the
+    ETag stays the same.
+    '''
+    def __init__(self, config: Dict, metrics: MetricsRegistry) -> None:
+        self.min_size = config.get('min-size', DEFAULT_MIN_SIZE)
+        self.level = config.get('level', DEFAULT_LEVEL)
+        self.routes = config.get('routes') or {}
+        self.cache = CompressedBodyCache(
+            config.get('cache-max-bytes', DEFAULT_CACHE_MAX_BYTES)
+        )
+        self._settings: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._cache_lookups = metrics.counter(
+            'notesservice_compression_cache_total',
+            'Precompressed body cache lookups by result',
+            ('result',)
+        )
+        self._bytes = metrics.counter(
+            'notesservice_compression_bytes_total',
+            'Response bytes before (in) and after (out) compression',
+            ('direction',)
+        )
+        self._cache_bytes = metrics.gauge(
+            'notesservice_compression_cache_bytes',
+            'Compressed bytes held by the precompressed body cache'
+        )
+        metrics.add_collector(
+            lambda: self._cache_bytes.set(self.cache.size)
+        )
+
+    def route_settings(self, route: str) -> Optional[Tuple[int, int]]:
+        # (min size, level) of the route, None if it is not compressed
+        if route not in self._settings:
+            if route in self.routes and self.routes[route] is None:
+                self._settings[route] = None
+            else:
+                route_config = self.routes.get(route) or {}
+                self._settings[route] = (
+                    route_config.get('min-size', self.min_size),
+                    route_config.get('level', self.level)
+                )
+        return self._settings[route]
+
+    @staticmethod
+    def compressible(content_type: str) -> bool:
+        media_type = content_type.split(';')[0].strip()
+        return (
+            media_type.startswith('text/') or
+            media_type in COMPRESSIBLE_TYPES
+        )
+
+    def compress(self, body: bytes, level: int, etag: str = None) -> bytes:
+        if etag is None:
+            compressed = gzip_compress(body, level)
+        else:
+            key = (etag, level)
+            cached = self.cache.get(key)
+            if cached is None:
+                self._cache_lookups.inc(('miss',))
+                compressed = gzip_compress(body, level)
+                self.cache.put(key, compressed)
+            else:
+                self._cache_lookups.inc(('hit',))
+                compressed = cached
+
+        self._bytes.inc(('in',), len(body))
+        self._bytes.inc(('out',), len(compressed))
+        return compressed
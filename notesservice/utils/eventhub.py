@@ -0,0 +1,117 @@
+import asyncio
+from collections import deque
+import itertools
+import json
+from typing import Any, Deque, List, Optional, Tuple
+
+from notesservice.utils.metrics import MetricsRegistry
+
+DEFAULT_BUFFER_EVENTS = 1024
+DEFAULT_HEARTBEAT_SECONDS = 15.0
+
+
+# Creating EventHub class
+class EventHub:
+    '''
+    In-process pub/sub for Server-Sent Events. Every event is serialized
+    once into an SSE frame and kept in a ring of the last `buffer_events`
+    frames that all subscribers share; a subscriber is just its cursor
+    into the ring. A subscriber that falls more than the ring behind is
+    told to resync instead of buffering without bound.
+
+    Idle subscribers all wait on one shared future, which is resolved by
+    the next publish or by the hub's heartbeat timer, so they cost no
+    queue or timer each.
+    '''
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        buffer_events: int = DEFAULT_BUFFER_EVENTS,
+        heartbeat: float = DEFAULT_HEARTBEAT_SECONDS
+    ) -> None:
+        self.heartbeat = heartbeat
+        self._frames: Deque[bytes] = deque(maxlen=buffer_events)
+        # Event id of the next published event
+        self._next_id = 1
+        self._wakeup: Optional[asyncio.Future] = None
+        self._heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self._subscribers = metrics.gauge(
+            'notesservice_stream_subscribers',
+            'Connected change stream subscribers'
+        )
+        self._published = metrics.counter(
+            'notesservice_stream_events_total',
+            'Change events published',
+            ('event',)
+        )
+        self._resyncs = metrics.counter(
+            'notesservice_stream_resyncs_total',
+            'Subscribers that fell behind the event buffer and must resync'
+        )
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def subscribe(self, last_event_id: str = None) -> int:
+        '''
+        Registers a subscriber and returns its cursor: right after
+        `last_event_id` when reconnecting (the Last-Event-ID header), else
+        the next published event.
+        '''
+        self._subscribers.inc()
+        if last_event_id:
+            try:
+                return int(last_event_id) + 1
+            except ValueError:
+                pass
+        return self._next_id
+
+    def unsubscribe(self) -> None:
+        self._subscribers.dec()
+
+    def publish(self, event: str, data: Any) -> None:
+        frame = 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+            self._next_id, event, json.dumps(data)
+        )
+        self._frames.append(frame.encode('utf-8'))
+        self._next_id += 1
+        self._published.inc((event,))
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        if self._wakeup is not None:
+            if not self._wakeup.done():
+                self._wakeup.set_result(None)
+            self._wakeup = None
+
+    async def wait(self, cursor: int) -> Tuple[List[bytes], int, bool]:
+        '''
+        Waits for events at or after `cursor`, or for the next heartbeat.
+
+        Returns:
+            the frames (none on a heartbeat), the cursor to wait on next,
+            and whether the subscriber fell behind and has to resync
+        '''
+        if cursor == self._next_id:
+            if self._wakeup is None:
+                loop = asyncio.get_event_loop()
+                self._wakeup = loop.create_future()
+                self._heartbeat_handle = loop.call_later(
+                    self.heartbeat, self._wake
+                )
+            # Shielded: a cancelled subscriber must not cancel the others
+            await asyncio.shield(self._wakeup)
+
+        first_id = self._next_id - len(self._frames)
+        if cursor < first_id or cursor > self._next_id:
+            self._resyncs.inc()
+            return [], self._next_id, True
+
+        frames = list(itertools.islice(
+            self._frames, cursor - first_id, None
+        ))
+        return frames, self._next_id, False
@@ -0,0 +1,71 @@
+import os
+import time
+from typing import Callable, Optional
+import uuid
+
+ID_SCHEMES = ['random', 'time-ordered']
+
+# State of the time-ordered generator: ids generated within the same
+# millisecond use an incrementing 12 bit counter so they stay ordered
+_last_ms = 0
+_counter = 0
+
+_COUNTER_MAX = 0xfff
+
+
+def random_id() -> str:
+    return uuid.uuid4().hex
+
+
+def time_ordered_id(ts_ms: int = None) -> str:
+    '''
+    UUIDv7 layout as 32 hex chars: 48 bit Unix time in milliseconds,
+    version 7, 12 bit sequence within the millisecond, variant, and 62
+    random bits. Ids sort by creation time, so inserts append to the
+    right edge of B-trees instead of landing on random pages.
+    '''
+    global _last_ms, _counter
+
+    ms = int(time.time() * 1000) if ts_ms is None else ts_ms
+    if ms <= _last_ms:
+        # Same (or earlier, clock stepped back) millisecond: keep ordering
+        ms = _last_ms
+        _counter += 1
+        if _counter > _COUNTER_MAX:
+            ms += 1
+            _counter = 0
+    else:
+        # Random start leaves room to count up within the millisecond
+        _counter = int.from_bytes(os.urandom(2), 'big') & 0x3ff
+    _last_ms = ms
+
+    rand_b = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    value = (
+        (ms & ((1 << 48) - 1)) << 80 |
+        0x7 << 76 |
+        _counter << 64 |
+        0b10 << 62 |
+        rand_b
+    )
+    return '{:032x}'.format(value)
+
+
+def id_timestamp_ms(id_: str) -> Optional[int]:
+    # Creation time embedded in a time-ordered id, None for other ids
+    if len(id_) != 32 or id_[12] != '7':
+        return None
+    try:
+        return int(id_[:12], 16)
+    except ValueError:
+        return None
+
+
+def id_generator(scheme: str = 'random') -> Callable[[], str]:
+    if scheme == 'random':
+        return random_id
+    if scheme == 'time-ordered':
+        return time_ordered_id
+
+    raise ValueError('Unknown id scheme {}, expected one of {}'.format(
+        scheme, ID_SCHEMES
+    ))
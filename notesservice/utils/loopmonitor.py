@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from notesservice.utils.metrics import MetricsRegistry
+import notesservice.utils.logutils as logutils
+
+LOOP_LAG_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+
+# Creating EventLoopLagProbe class
+class EventLoopLagProbe:
+    '''
+    Measures event loop scheduling lag: a timer is scheduled every
+    `interval` seconds and the lag is how late it actually runs.
+    '''
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        interval: float = 0.5
+    ) -> None:
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._lag = metrics.gauge(
+            'notesservice_event_loop_lag_seconds',
+            'Most recent event loop scheduling lag'
+        )
+        self._lag_histogram = metrics.histogram(
+            'notesservice_event_loop_lag_distribution_seconds',
+            'Distribution of event loop scheduling lag',
+            buckets=LOOP_LAG_BUCKETS
+        )
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        self._loop = loop or asyncio.get_event_loop()
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self) -> None:
+        assert self._loop is not None
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        assert self._loop is not None
+        lag = max(0.0, self._loop.time() - self._expected)
+        self._lag.set(lag)
+        self._lag_histogram.observe(lag)
+        self._schedule()
+
+
+# Creating SlowCallbackWatchdog class
+class SlowCallbackWatchdog:
+    '''
+    Detects callbacks that block the event loop for longer than
+    `threshold` seconds. The loop updates a heartbeat; a watchdog thread
+    that sees a stale heartbeat captures the loop thread's stack while it
+    is still blocked, and hands the report back to the loop.
+    '''
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        logger: logging.Logger,
+        threshold: float = 0.1
+    ) -> None:
+        self.threshold = threshold
+        self.logger = logger
+        self._beat_interval = threshold / 2
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._last_beat = time.monotonic()
+        self._reported_beat = 0.0
+        self._slow_callbacks = metrics.counter(
+            'notesservice_event_loop_slow_callbacks_total',
+            'Callbacks that blocked the event loop beyond the threshold'
+        )
+        self._max_block = metrics.gauge(
+            'notesservice_event_loop_max_block_seconds',
+            'Longest observed event loop block'
+        )
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        # Must be called from the thread running the loop
+        self._loop = loop or asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._beat()
+        self._thread = threading.Thread(
+            target=self._watch,
+            name='notesservice-loop-watchdog',
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _beat(self) -> None:
+        assert self._loop is not None
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self._beat_interval, self._beat)
+
+    def _watch(self) -> None:
+        assert self._loop is not None and self._loop_thread_id is not None
+        while not self._stopped.wait(self._beat_interval):
+            beat = self._last_beat
+            if time.monotonic() - beat < self.threshold:
+                continue
+            if beat == self._reported_beat:
+                continue  # same stall, already reported
+
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            try:
+                self._loop.call_soon_threadsafe(self._report, beat, stack)
+            except RuntimeError:
+                return  # loop closed
+
+    def _report(self, beat: float, stack: str) -> None:
+        # Runs on the loop once it is unblocked, so the whole stall is known
+        blocked = time.monotonic() - beat
+        self._slow_callbacks.inc()
+        if blocked > self._max_block.value():
+            self._max_block.set(blocked)
+
+        logutils.log(
+            self.logger,
+            logging.WARNING,
+            message='SLOW CALLBACK',
+            blocked_ms=1000.0 * blocked,
+            threshold_ms=1000.0 * self.threshold,
+            stack=re.sub(r'[\r\n]+', '\t', stack)
+        )
+
+
+# Creating LoopMonitor class
+class LoopMonitor:
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        logger: logging.Logger,
+        lag_interval: float = 0.5,
+        slow_callback_threshold: float = None
+    ) -> None:
+        self.lag_probe = EventLoopLagProbe(metrics, lag_interval)
+        self.watchdog = None
+        if slow_callback_threshold:
+            self.watchdog = SlowCallbackWatchdog(
+                metrics, logger, slow_callback_threshold
+            )
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        self.lag_probe.start(loop)
+        if self.watchdog is not None:
+            self.watchdog.start(loop)
+
+    def stop(self) -> None:
+        self.lag_probe.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
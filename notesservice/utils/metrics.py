@@ -0,0 +1,257 @@
+import bisect
+import math
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple
+)
+
+# Metrics are updated from the asyncio event loop thread only, so plain
+# dict and list updates are enough: no locks are taken on the hot path.
+# Everything that is expensive (formatting, collectors) happens at scrape
+# time in MetricsRegistry.render().
+
+LabelValues = Tuple[str, ...]
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape_label_value(value: str) -> str:
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+# Creating Metric base class
+class Metric:
+    type_name = 'untyped'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def _labels(
+        self,
+        label_values: LabelValues,
+        extra: Sequence[Tuple[str, str]] = ()
+    ) -> str:
+        pairs = list(zip(self.label_names, label_values)) + list(extra)
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(
+            '{}="{}"'.format(k, _escape_label_value(v)) for k, v in pairs
+        ) + '}'
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type_name)
+        ]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+
+        return lines
+
+
+# Creating Counter class
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, label_values: LabelValues = ()) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for label_values, value in sorted(self._values.items()):
+            yield self.name, self._labels(label_values), value
+
+
+# Creating Gauge class
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, label_values: LabelValues = ()) -> None:
+        self._values[label_values] = value
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def value(self, label_values: LabelValues = ()) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for label_values, value in sorted(self._values.items()):
+            yield self.name, self._labels(label_values), value
+
+
+# Creating Histogram class
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.upper_bounds = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts, the last one is +Inf
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, label_values: LabelValues = ()) -> None:
+        counts = self._counts.get(label_values)
+        if counts is None:
+            counts = [0] * (len(self.upper_bounds) + 1)
+            self._counts[label_values] = counts
+            self._sums[label_values] = 0.0
+
+        counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self._sums[label_values] += value
+
+    def count(self, label_values: LabelValues = ()) -> int:
+        return sum(self._counts.get(label_values, ()))
+
+    def sum(self, label_values: LabelValues = ()) -> float:
+        return self._sums.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for label_values, counts in sorted(self._counts.items()):
+            cumulative = 0
+            bounds = self.upper_bounds + (math.inf,)
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (
+                    self.name + '_bucket',
+                    self._labels(label_values, [('le', _format_value(bound))]),
+                    cumulative
+                )
+            yield self.name + '_sum', self._labels(label_values), \
+                self._sums[label_values]
+            yield self.name + '_count', self._labels(label_values), \
+                cumulative
+
+
+# Creating MetricsRegistry class
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs) -> Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, *args, **kwargs)
+            self._metrics[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(
+                '{} is already registered as {}'.format(
+                    name, metric.type_name
+                )
+            )
+
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> Counter:
+        return self._get_or_create(  # type: ignore
+            Counter, name, documentation, label_names
+        )
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> Gauge:
+        return self._get_or_create(  # type: ignore
+            Gauge, name, documentation, label_names
+        )
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(  # type: ignore
+            Histogram, name, documentation, label_names, buckets
+        )
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        # Collectors run at scrape time to refresh gauges that are cheaper
+        # to read on demand (e.g. engine cache statistics)
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+
+        lines: List[str] = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import cProfile
+import io
+import linecache
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Dict, List, Optional
+
+PSTATS_SORT_KEYS = ['cumulative', 'tottime', 'calls', 'ncalls']
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+# Only one capture at a time: cProfile and the sampler both observe the
+# whole event loop thread, so overlapping captures would be meaningless
+_capture_lock = threading.Lock()
+
+
+def _acquire_capture() -> None:
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusyError('A profile capture is already running')
+
+
+async def cprofile_capture(
+    seconds: float,
+    sort_key: str = 'cumulative',
+    limit: int = 50
+) -> str:
+    '''
+    Profiles everything the event loop thread runs for `seconds` and
+    returns the pstats report.
+    '''
+    _acquire_capture()
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _capture_lock.release()
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(sort_key).print_stats(limit)
+    return out.getvalue()
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}:{}'.format(
+            code.co_filename, code.co_name, code.co_firstlineno
+        ))
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+def _sample(
+    thread_id: int,
+    seconds: float,
+    interval: float,
+    stop: threading.Event
+) -> Dict[str, int]:
+    samples: Dict[str, int] = collections.Counter()
+    ticks = int(seconds / interval)
+    for _ in range(ticks):
+        if stop.wait(interval):
+            break
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[_collapse(frame)] += 1
+
+    return samples
+
+
+async def sample_capture(
+    seconds: float,
+    interval: float = 0.005
+) -> str:
+    '''
+    Samples the event loop thread's stack every `interval` seconds from a
+    helper thread and returns collapsed stacks (`frame;frame;frame count`
+    per line), ready for flame graph tools. The loop's own sleep while
+    idle shows up as the selector's select() frame.
+    '''
+    _acquire_capture()
+    stop = threading.Event()
+    try:
+        loop = asyncio.get_event_loop()
+        samples = await loop.run_in_executor(
+            None, _sample, threading.get_ident(), seconds, interval, stop
+        )
+    finally:
+        stop.set()
+        _capture_lock.release()
+
+    return ''.join(
+        '{} {}\n'.format(stack, count)
+        for stack, count in sorted(samples.items())
+    )
+
+
+# tracemalloc snapshots: the previous one is kept so that growth between
+# two calls can be reported
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def start_tracemalloc(nframes: int = 1) -> None:
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(nframes)
+    _last_snapshot = None
+
+
+def stop_tracemalloc() -> None:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ])
+
+
+async def tracemalloc_top(
+    limit: int = 20,
+    key_type: str = 'lineno',
+    compare: bool = False
+) -> Dict:
+    '''
+    Reports the top allocation sites; with `compare` the sizes are the
+    growth since the previous snapshot.
+    '''
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError('tracemalloc is not tracing')
+
+    # Snapshot filtering and grouping are CPU heavy: keep them off the loop
+    loop = asyncio.get_event_loop()
+    snapshot = await loop.run_in_executor(None, _take_snapshot)
+    previous = _last_snapshot
+    _last_snapshot = snapshot
+
+    current, peak = tracemalloc.get_traced_memory()
+    top: List[Dict] = []
+    if compare and previous is not None:
+        diffs = await loop.run_in_executor(
+            None, snapshot.compare_to, previous, key_type
+        )
+        for diff in diffs[:limit]:
+            top.append({
+                'site': str(diff.traceback),
+                'size': diff.size,
+                'size_diff': diff.size_diff,
+                'count': diff.count,
+                'count_diff': diff.count_diff
+            })
+    else:
+        stats = await loop.run_in_executor(
+            None, snapshot.statistics, key_type
+        )
+        for stat in stats[:limit]:
+            top.append({
+                'site': str(stat.traceback),
+                'size': stat.size,
+                'count': stat.count
+            })
+
+    return {
+        'traced_memory': current,
+        'traced_memory_peak': peak,
+        'compared': bool(compare and previous is not None),
+        'top': top
+    }
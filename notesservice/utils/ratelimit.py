@@ -0,0 +1,146 @@
+from collections import OrderedDict
+import math
+import time
+from typing import Dict, List, Union
+
+from notesservice.utils.metrics import MetricsRegistry
+
+DEFAULT_RATE = 50.0
+DEFAULT_BURST = 100.0
+DEFAULT_MAX_CLIENTS = 100000
+DEFAULT_SWEEP_INTERVAL = 10.0
+DEFAULT_KEY_HEADER = 'X-API-Key'
+
+
+# Creating TokenBucketTable class
+class TokenBucketTable:
+    '''
+    One token bucket per client: `rate` tokens per second up to `burst`.
+    Buckets are [tokens, last update] lists in a dict kept in least
+    recently used order, so a sweep pops idle clients (their bucket would
+    be full again, same as a new one) off the front without scanning the
+    table, and the least recently seen client is dropped beyond
+    `max_clients`. Every check is O(1) amortized.
+    '''
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: float = DEFAULT_BURST,
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+        sweep_interval: float = DEFAULT_SWEEP_INTERVAL
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.sweep_interval = sweep_interval
+        # Time for an empty bucket to fill up again
+        self._idle_after = burst / rate
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._last_sweep = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, cost: float = 1.0, now: float = None) -> float:
+        '''
+        Takes `cost` tokens from the bucket of `key`.
+
+        Returns:
+            0 if the tokens were taken, else the seconds until the bucket
+            holds enough of them (nothing is taken then)
+        '''
+        now = time.monotonic() if now is None else now
+        # A cost above the burst could never be paid
+        cost = min(cost, self.burst)
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(
+                self.burst, bucket[0] + (now - bucket[1]) * self.rate
+            )
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.rate
+
+    def sweep(self, now: float = None) -> int:
+        # Least recently used first: stop at the first client not idle
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        removed = 0
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if now - bucket[1] < self._idle_after:
+                break
+            self._buckets.popitem(last=False)
+            removed += 1
+        return removed
+
+
+# Creating RateLimiter class
+class RateLimiter:
+    '''
+    Per-client rate limiting configured by the `rate-limit` section.
+    Clients are keyed by the API key header when `key` is `api-key` and
+    the header is sent, else by IP. A request costs `costs[route]` tokens,
+    or `costs[route][method]` (default 1), so full lists can cost more
+    than entry reads.
+    '''
+    def __init__(self, config: Dict, metrics: MetricsRegistry) -> None:
+        self.by_api_key = config.get('key', 'ip') == 'api-key'
+        self.key_header = config.get('header', DEFAULT_KEY_HEADER)
+        self.costs: Dict[str, Union[float, Dict[str, float]]] = (
+            config.get('costs') or {}
+        )
+        self.table = TokenBucketTable(
+            rate=float(config.get('rate', DEFAULT_RATE)),
+            burst=float(config.get('burst', DEFAULT_BURST)),
+            max_clients=config.get('max-clients', DEFAULT_MAX_CLIENTS),
+            sweep_interval=float(
+                config.get('sweep-interval-seconds', DEFAULT_SWEEP_INTERVAL)
+            )
+        )
+        self._limited = metrics.counter(
+            'notesservice_rate_limited_total',
+            'Requests rejected by the per-client rate limit',
+            ('route',)
+        )
+        self._clients = metrics.gauge(
+            'notesservice_rate_limit_clients',
+            'Clients tracked by the rate limiter'
+        )
+        metrics.add_collector(
+            lambda: self._clients.set(len(self.table))
+        )
+
+    def client_key(self, remote_ip: str, api_key: str = None) -> str:
+        if self.by_api_key and api_key:
+            return 'key:' + api_key
+        return 'ip:' + remote_ip
+
+    def cost(self, route: str, method: str) -> float:
+        cost = self.costs.get(route, 1)
+        if isinstance(cost, dict):
+            return float(cost.get(method, 1))
+        return float(cost)
+
+    def check(self, route: str, method: str, client: str) -> int:
+        '''
+        Returns:
+            0 if the request is allowed, else the Retry-After seconds
+        '''
+        wait = self.table.take(client, self.cost(route, method))
+        if not wait:
+            return 0
+        self._limited.inc((route,))
+        return max(1, math.ceil(wait))
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from notesservice.utils.metrics import MetricsRegistry
+
+
+# Creating SingleFlight class
+class SingleFlight:
+    '''
+    Coalesces concurrent identical reads: callers asking for a key that is
+    already being read share the in-flight read instead of starting their
+    own, so a burst of requests for one hot note costs one DB read.
+
+    The read runs as its own task, so a caller that goes away (cancelled
+    request) does not cancel it for the others. `forget` detaches the
+    in-flight read of a key: callers already waiting on it keep their
+    result, callers arriving later start a fresh read.
+    '''
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        name: str = 'read',
+        enabled: bool = True
+    ) -> None:
+        self.name = name
+        self.enabled = enabled
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._coalesced = metrics.counter(
+            'notesservice_coalesced_reads_total',
+            'Reads served by sharing an identical in-flight read',
+            ('operation',)
+        )
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        if not self.enabled:
+            return await fn()
+
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self._coalesced.inc((self.name,))
+        # Shielded: a cancelled caller must not cancel the shared read
+        return await asyncio.shield(call)
+
+    def forget(self, key: Hashable) -> None:
+        self._calls.pop(key, None)
+
+    def _done(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Retrieved here in case every caller was cancelled meanwhile
+        if not call.cancelled():
+            call.exception()
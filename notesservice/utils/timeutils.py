@@ -0,0 +1,64 @@
+import aiotask_context as context  # type: ignore
+from contextlib import contextmanager
+import time
+from typing import Dict, Iterator, List, Optional
+
+PHASE_TIMINGS = 'phase_timings'
+
+
+def _get_phase_timings() -> Optional[Dict[str, List]]:
+    # Phase timers are no-ops outside a request (no task context, or timing
+    # was never started for the current task)
+    try:
+        return context.get(PHASE_TIMINGS)
+    except (AttributeError, ValueError):
+        return None
+
+
+def begin_phase_timing() -> None:
+    # name -> [start time of the running interval or None, total seconds]
+    context.set(PHASE_TIMINGS, {})
+
+
+def start_phase(name: str) -> None:
+    timings = _get_phase_timings()
+    if timings is None:
+        return
+
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [time.perf_counter(), 0.0]
+    else:
+        entry[0] = time.perf_counter()
+
+
+def stop_phase(name: str) -> None:
+    timings = _get_phase_timings()
+    if timings is None:
+        return
+
+    entry = timings.get(name)
+    if entry is not None and entry[0] is not None:
+        entry[1] += time.perf_counter() - entry[0]
+        entry[0] = None
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start_phase(name)
+    try:
+        yield
+    finally:
+        stop_phase(name)
+
+
+def get_phase_timings() -> Dict[str, float]:
+    # Completed phase durations in milliseconds
+    timings = _get_phase_timings() or {}
+    return {name: 1000.0 * entry[1] for name, entry in timings.items()}
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ', '.join(
+        '{};dur={:.3f}'.format(name, ms) for name, ms in timings.items()
+    )
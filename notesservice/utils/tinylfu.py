@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from typing import Generic, Hashable, List, TypeVar
+
+DEFAULT_WINDOW_FRACTION = 0.01
+DEFAULT_PROTECTED_FRACTION = 0.8
+
+# Keys tracked by a TinyLFUPolicy
+K = TypeVar('K', bound=Hashable)
+
+# Counters saturate at 15 (4 bits in the TinyLFU paper, a byte here)
+MAX_COUNT = 15
+
+# Halves every counter of a row with one bytes.translate() call
+HALVE = bytes(i >> 1 for i in range(256))
+
+
+# Creating CountMinSketch class
+class CountMinSketch:
+    '''
+    Approximate access frequencies in `depth` rows of `width` counters.
+    After `sample_size` increments every counter is halved, so the
+    estimates follow recent popularity rather than all time counts.
+    '''
+    def __init__(
+        self,
+        width: int = 1024,
+        depth: int = 4,
+        sample_size: int = None
+    ) -> None:
+        # Width rounded up to a power of two, indexes are masked
+        self.width = 1 << max(4, (width - 1).bit_length())
+        self.depth = depth
+        self.sample_size = sample_size or 10 * self.width
+        self.additions = 0
+        self._mask = self.width - 1
+        self._rows = [bytearray(self.width) for _ in range(depth)]
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        # Double hashing from the two halves of one 64 bit hash
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) & self._mask for i in range(self.depth)]
+
+    def increment(self, key: Hashable) -> None:
+        for row, i in zip(self._rows, self._indexes(key)):
+            if row[i] < MAX_COUNT:
+                row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(
+            row[i] for row, i in zip(self._rows, self._indexes(key))
+        )
+
+    def reset(self) -> None:
+        for row in self._rows:
+            row[:] = row.translate(HALVE)
+        self.additions //= 2
+
+
+# Creating TinyLFUPolicy class
+class TinyLFUPolicy(Generic[K]):
+    '''
+    W-TinyLFU eviction for entries weighted by size, within `max_bytes`.
+    New entries go to a small LRU window (`window_fraction` of the
+    budget). An entry pushed out of the window only replaces the least
+    recently used entry of the main area's probation segment if the
+    frequency sketch says it is accessed more often, so one-off scans
+    cannot flush the popular entries. A hit in probation moves an entry
+    to the protected segment (`protected_fraction` of the main area),
+    whose overflow goes back to probation.
+
+    The policy only tracks keys (of type K) and sizes; the caller stores
+    the values and drops the keys that add(), resize() and access() report
+    evicted.
+    '''
+    def __init__(
+        self,
+        max_bytes: int,
+        window_fraction: float = DEFAULT_WINDOW_FRACTION,
+        protected_fraction: float = DEFAULT_PROTECTED_FRACTION,
+        sketch_width: int = 4096
+    ) -> None:
+        self.max_bytes = max_bytes
+        self._window_max = int(max_bytes * window_fraction)
+        self._main_max = max_bytes - self._window_max
+        self._protected_max = int(self._main_max * protected_fraction)
+        self.sketch = CountMinSketch(sketch_width)
+        self._window: 'OrderedDict[K, int]' = OrderedDict()
+        self._probation: 'OrderedDict[K, int]' = OrderedDict()
+        self._protected: 'OrderedDict[K, int]' = OrderedDict()
+        self._window_bytes = 0
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        # Entries that left the window but lost against the probation
+        # victim
+        self.rejections = 0
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    def __contains__(self, key: object) -> bool:
+        return (
+            key in self._window or key in self._probation or
+            key in self._protected
+        )
+
+    @property
+    def size(self) -> int:
+        return self._window_bytes + self._probation_bytes + \
+            self._protected_bytes
+
+    def access(self, key: K) -> bool:
+        '''
+        Counts an access, hit or miss, and refreshes the recency of a
+        tracked key.
+
+        Returns:
+            whether the key is tracked
+        '''
+        self.sketch.increment(key)
+        if key in self._window:
+            self._window.move_to_end(key)
+        elif key in self._protected:
+            self._protected.move_to_end(key)
+        elif key in self._probation:
+            size = self._probation.pop(key)
+            self._probation_bytes -= size
+            self._protected[key] = size
+            self._protected_bytes += size
+            while self._protected_bytes > self._protected_max and \
+                    len(self._protected) > 1:
+                demoted, demoted_size = self._protected.popitem(last=False)
+                self._protected_bytes -= demoted_size
+                self._probation[demoted] = demoted_size
+                self._probation_bytes += demoted_size
+        else:
+            return False
+        return True
+
+    def add(self, key: K, size: int) -> List[K]:
+        '''
+        Tracks a new key in the window.
+
+        Returns:
+            the keys evicted to make room, the new key itself included if
+            it does not fit or is not admitted
+        '''
+        if key in self:
+            return self.resize(key, size)
+        if size > self.max_bytes:
+            return [key]
+        self._window[key] = size
+        self._window_bytes += size
+        return self._evict()
+
+    def resize(self, key: K, size: int) -> List[K]:
+        for segment in (self._window, self._probation, self._protected):
+            if key in segment:
+                delta = size - segment[key]
+                segment[key] = size
+                break
+        else:
+            return self.add(key, size)
+
+        if segment is self._window:
+            self._window_bytes += delta
+        elif segment is self._probation:
+            self._probation_bytes += delta
+        else:
+            self._protected_bytes += delta
+        if size > self.max_bytes:
+            self.remove(key)
+            return [key] + self._evict()
+        return self._evict()
+
+    def remove(self, key: K) -> None:
+        if key in self._window:
+            self._window_bytes -= self._window.pop(key)
+        elif key in self._probation:
+            self._probation_bytes -= self._probation.pop(key)
+        elif key in self._protected:
+            self._protected_bytes -= self._protected.pop(key)
+
+    def clear(self) -> None:
+        for segment in (self._window, self._probation, self._protected):
+            segment.clear()
+        self._window_bytes = self._probation_bytes = 0
+        self._protected_bytes = 0
+
+    def _evict(self) -> List[K]:
+        # Window overflow moves the oldest window entries to probation as
+        # candidates; then, while the main area is over its budget, the
+        # newest candidate duels the probation victim
+        candidates = []
+        while self._window_bytes > self._window_max and self._window:
+            key, size = self._window.popitem(last=False)
+            self._window_bytes -= size
+            self._probation[key] = size
+            self._probation_bytes += size
+            candidates.append(key)
+
+        evicted = []
+        while self._probation_bytes + self._protected_bytes > self._main_max:
+            if not self._probation:
+                key, size = self._protected.popitem(last=False)
+                self._protected_bytes -= size
+                evicted.append(key)
+                continue
+
+            victim = next(iter(self._probation))
+            while candidates and candidates[-1] not in self._probation:
+                candidates.pop()
+            candidate = candidates[-1] if candidates else None
+            if candidate is not None and candidate != victim and \
+                    self.sketch.estimate(candidate) <= \
+                    self.sketch.estimate(victim):
+                victim = candidate
+                self.rejections += 1
+            self._probation_bytes -= self._probation.pop(victim)
+            evicted.append(victim)
+        return evicted
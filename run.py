@@ -3,12 +3,22 @@
 import argparse
 import os
 import subprocess
+import sys
 from typing import List
 import unittest
 
 SOURCE_CODE = ['notesservice']
 TEST_CODE = ['tests']
-ALL_CODE = SOURCE_CODE + TEST_CODE
+BENCH_CODE = ['benchmarks']
+ALL_CODE = SOURCE_CODE + TEST_CODE + BENCH_CODE
+
+
+def comma_list(value: str) -> List[str]:
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def comma_int_list(value: str) -> List[int]:
+    return [int(v) for v in comma_list(value)]
 
 
 def arg_parser() -> argparse.ArgumentParser:
@@ -58,6 +68,264 @@ def arg_parser() -> argparse.ArgumentParser:
         help='turn on verbose output'
     )
 
+    bench_cmd_parser = subparsers.add_parser('bench')
+    bench_cmd_parser.add_argument(
+        '--suite',
+        choices=['storage', 'ids', 'herd', 'bodies', 'shards'],
+        default='storage',
+        help='storage: workload mix per engine; ids: SQLite insert '
+        'throughput and index size per id scheme; herd: bursts of '
+        'identical reads with and without read coalescing; bodies: store '
+        'size and latency per body compression algorithm; shards: '
+        'concurrent write throughput per SQLite shard count; '
+        'default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--rows',
+        type=int,
+        default=1000000,
+        help='rows inserted by the ids suite, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='rows per transaction in the ids suite, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--herd-size',
+        type=int,
+        default=100,
+        help='identical requests per burst in the herd suite, '
+        'default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--algorithms',
+        type=comma_list,
+        default='none,zlib,lzma',
+        help='comma separated body compression algorithms of the bodies '
+        'suite, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--body-size',
+        default='lognormal:8192:1.0',
+        help='body size distribution of the bodies suite, '
+        'default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--min-size',
+        type=int,
+        default=4096,
+        help='smallest body compressed in the bodies suite, '
+        'default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--corpus',
+        default=None,
+        help='text file the bodies suite takes note bodies from, '
+        'default: synthetic text'
+    )
+    bench_cmd_parser.add_argument(
+        '--shards',
+        type=comma_int_list,
+        default='1,2,4,8',
+        help='comma separated shard counts of the shards suite, '
+        'default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--engines',
+        type=comma_list,
+        default='memory,fs,sql',
+        help='comma separated storage engines, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--sizes',
+        type=comma_int_list,
+        default='1000',
+        help='comma separated number of preloaded notes, standard sizes: '
+        '1000,100000,1000000; default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--ops',
+        type=int,
+        default=1000,
+        help='operations per workload, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--list-ops',
+        type=int,
+        default=5,
+        help='full list operations, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        default=1,
+        help='concurrent operations, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='random seed for the workload, default: %(default)s'
+    )
+    bench_cmd_parser.add_argument(
+        '-o', '--output',
+        default=None,
+        help='JSON report file, default: stdout'
+    )
+    bench_cmd_parser.add_argument(
+        '--baseline',
+        default=None,
+        help='baseline report to compare with, '
+        'default: benchmarks/baselines/storage.json'
+    )
+    bench_cmd_parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='store the results as the new baseline'
+    )
+    bench_cmd_parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='relative change flagged as regression, default: %(default)s'
+    )
+
+    generate_cmd_parser = subparsers.add_parser('generate')
+    generate_cmd_parser.add_argument(
+        'store',
+        help='store to bulk load, as ENGINE:PATH, e.g. sql:./store.db '
+        'or fs:./notes'
+    )
+    generate_cmd_parser.add_argument(
+        '-n', '--count',
+        type=int,
+        default=100000,
+        help='number of notes, default: %(default)s'
+    )
+    generate_cmd_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='random seed, default: %(default)s'
+    )
+    generate_cmd_parser.add_argument(
+        '--body-size',
+        default='lognormal:400:1.0',
+        help='body size distribution: fixed:N, uniform:MIN:MAX or '
+        'lognormal:MEDIAN:SIGMA, default: %(default)s'
+    )
+    generate_cmd_parser.add_argument(
+        '--type-mix',
+        default='personal=0.5,work=0.5',
+        help='note type weights, default: %(default)s'
+    )
+    generate_cmd_parser.add_argument(
+        '--updated-on-days',
+        type=float,
+        default=365,
+        help='spread of updated_on in days, default: %(default)s'
+    )
+    generate_cmd_parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=10000,
+        help='notes per bulk insert, default: %(default)s'
+    )
+
+    reshard_cmd_parser = subparsers.add_parser('reshard')
+    reshard_cmd_parser.add_argument(
+        '-n', '--shards',
+        type=int,
+        required=True,
+        help='shard count of the new store'
+    )
+    reshard_cmd_parser.add_argument(
+        '--config',
+        default='./configs/notesservice-local.yaml',
+        help='service config whose notes-db section is the current store, '
+        'default: %(default)s'
+    )
+    reshard_cmd_parser.add_argument(
+        '--path',
+        default=None,
+        help='SQLite path of the new store, default: the current path'
+    )
+    reshard_cmd_parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=10000,
+        help='notes per bulk insert, default: %(default)s'
+    )
+
+    backup_cmd_parser = subparsers.add_parser('backup')
+    backup_cmd_parser.add_argument(
+        '-o', '--output',
+        required=True,
+        help='path of the backup: a file for sql stores, a directory for '
+        'fs stores'
+    )
+    backup_cmd_parser.add_argument(
+        '--config',
+        default='./configs/notesservice-local.yaml',
+        help='service config whose notes-db section is the store, '
+        'default: %(default)s'
+    )
+
+    load_cmd_parser = subparsers.add_parser('loadtest')
+    load_cmd_parser.add_argument(
+        '--engine',
+        choices=['memory', 'fs', 'sql'],
+        default='memory',
+        help='storage engine of the service, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '-r', '--rate',
+        type=float,
+        default=200,
+        help='offered load in requests/sec, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '-d', '--duration',
+        type=float,
+        default=10,
+        help='duration in seconds, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '--mix',
+        default='get=60,list=2,post=15,put=18,delete=5',
+        help='request mix weights, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '--connections',
+        type=int,
+        default=16,
+        help='max keep-alive connections, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '--preload',
+        type=int,
+        default=100,
+        help='notes created before the run, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '--uniform',
+        action='store_true',
+        help='uniform instead of Poisson arrivals'
+    )
+    load_cmd_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='random seed, default: %(default)s'
+    )
+    load_cmd_parser.add_argument(
+        '-o', '--output',
+        default=None,
+        help='JSON report file, default: stdout'
+    )
+
     return parser
 
 
@@ -80,6 +348,180 @@ def run_tests(suite_name: str, verbose: bool) -> None:
     unittest.TextTestRunner(verbosity=verbosity).run(test_suite)
 
 
+def run_bench(args) -> None:
+    if args.suite == 'ids':
+        from benchmarks.ids import run_id_benchmark
+
+        run_id_benchmark(
+            rows=args.rows,
+            batch_size=args.batch_size,
+            seed=args.seed,
+            output=args.output
+        )
+        return
+
+    if args.suite == 'herd':
+        from benchmarks.herd import run_herd_benchmark
+
+        # --ops and --list-ops are the number of bursts
+        run_herd_benchmark(
+            engines=args.engines,
+            sizes=args.sizes,
+            rounds=args.ops,
+            list_rounds=args.list_ops,
+            herd_size=args.herd_size,
+            seed=args.seed,
+            output=args.output
+        )
+        return
+
+    if args.suite == 'bodies':
+        from benchmarks.bodies import run_body_benchmark
+
+        # Bodies are never compressed in memory
+        run_body_benchmark(
+            engines=[e for e in args.engines if e != 'memory'],
+            sizes=args.sizes,
+            reads=args.ops,
+            list_ops=args.list_ops,
+            body_size=args.body_size,
+            algorithms=args.algorithms,
+            min_size=args.min_size,
+            corpus=args.corpus,
+            seed=args.seed,
+            output=args.output
+        )
+        return
+
+    if args.suite == 'shards':
+        from benchmarks.shards import run_shard_benchmark
+
+        run_shard_benchmark(
+            shard_counts=args.shards,
+            sizes=args.sizes,
+            concurrency=args.concurrency,
+            reads=args.ops,
+            list_ops=args.list_ops,
+            seed=args.seed,
+            output=args.output
+        )
+        return
+
+    from benchmarks.storage import run_storage_benchmark, STORAGE_BASELINE
+
+    regressions = run_storage_benchmark(
+        engines=args.engines,
+        sizes=args.sizes,
+        ops=args.ops,
+        list_ops=args.list_ops,
+        concurrency=args.concurrency,
+        seed=args.seed,
+        output=args.output,
+        baseline=args.baseline or STORAGE_BASELINE,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance
+    )
+    if regressions:
+        print('{} regression(s) against the baseline'.format(
+            len(regressions)
+        ), file=sys.stderr)
+        sys.exit(1)
+
+
+def run_generate(args) -> None:
+    from data.synthetic import generate_notes, load_store
+    from notesservice.utils.asyncutils import run_coroutine
+    import time
+
+    engine, _, path = args.store.partition(':')
+    if engine not in ['fs', 'sql'] or not path:
+        sys.exit('store must be fs:PATH or sql:PATH')
+
+    notes = generate_notes(
+        args.count,
+        seed=args.seed,
+        body_size=args.body_size,
+        type_mix=args.type_mix,
+        updated_on_days=args.updated_on_days
+    )
+    start = time.perf_counter()
+    _, count = run_coroutine(
+        load_store({engine: path}, notes, args.batch_size)
+    )
+    elapsed = time.perf_counter() - start
+    print('Loaded {} notes into {} in {:.1f}s ({:.0f} notes/s)'.format(
+        count, args.store, elapsed, count / elapsed if elapsed else 0
+    ))
+
+
+def run_reshard(args) -> None:
+    from notesservice.database.db_engines import reshard_store
+    from notesservice.database.sharded_db import shard_paths
+    from notesservice.utils.asyncutils import run_coroutine
+    import time
+    import yaml
+
+    with open(args.config, encoding='utf-8') as f:
+        notes_db_config = yaml.load(f.read(), Loader=yaml.SafeLoader)[
+            'notes-db'
+        ]
+
+    start = time.perf_counter()
+    try:
+        count = run_coroutine(reshard_store(
+            notes_db_config, args.shards, args.path, args.batch_size
+        ))
+    except (FileExistsError, ValueError) as e:
+        sys.exit(str(e))
+    elapsed = time.perf_counter() - start
+    print('Copied {} notes into {} in {:.1f}s'.format(
+        count,
+        ', '.join(shard_paths(
+            args.path or notes_db_config['sql'], args.shards
+        )),
+        elapsed
+    ))
+    print('Set shards: {}{} in notes-db to serve the new store'.format(
+        args.shards, ' and sql: ' + args.path if args.path else ''
+    ))
+
+
+def run_backup(args) -> None:
+    from notesservice.database.db_engines import backup_store
+    from notesservice.utils.asyncutils import run_coroutine
+    import yaml
+
+    with open(args.config, encoding='utf-8') as f:
+        notes_db_config = yaml.load(f.read(), Loader=yaml.SafeLoader)[
+            'notes-db'
+        ]
+
+    try:
+        summary = run_coroutine(backup_store(notes_db_config, args.output))
+    except (FileExistsError, KeyError, ValueError) as e:
+        sys.exit(str(e))
+    print('Backed up {} bytes to {} in {:.1f}s (sync token {})'.format(
+        summary['bytes'], summary['path'], summary['seconds'],
+        summary['seq']
+    ))
+
+
+def run_loadtest(args) -> None:
+    from benchmarks.http_load import run_load_test
+
+    run_load_test(
+        engine=args.engine,
+        rate=args.rate,
+        duration=args.duration,
+        mix=args.mix,
+        connections=args.connections,
+        preload=args.preload,
+        poisson=not args.uniform,
+        seed=args.seed,
+        output=args.output
+    )
+
+
 def main(args=None) -> None:
     os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
@@ -91,6 +533,11 @@ def main(args=None) -> None:
         'typecheck': lambda: run_checker(args.checker, args.paths),
         'lint': lambda: run_checker(args.linter, args.paths),
         'test': lambda: run_tests(args.suite, args.verbose),
+        'bench': lambda: run_bench(args),
+        'generate': lambda: run_generate(args),
+        'reshard': lambda: run_reshard(args),
+        'backup': lambda: run_backup(args),
+        'loadtest': lambda: run_loadtest(args),
     }
 
     actions.get(args.func, parser.print_help)()
@@ -0,0 +1,40 @@
+# Copyright (c) 2020. All rights reserved.
+
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.http_load import parse_mix, run_load_test
+
+
+class HttpLoadTest(unittest.TestCase):
+    def test_parse_mix(self) -> None:
+        self.assertEqual(parse_mix('get=3,post=1'), {'get': 3.0, 'post': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('patch=1')
+
+    def test_load_run(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'load.json')
+            run_load_test(
+                engine='memory', rate=100, duration=1, connections=4,
+                preload=5, seed=1, output=output
+            )
+            with open(output) as f:
+                results = json.load(f)['results']
+
+        overall = results['overall']
+        self.assertGreater(overall['requests'], 50)
+        self.assertEqual(overall['errors'], 0)
+        self.assertLessEqual(results['connections'], 4)
+        for key in ['p50_ms', 'p90_ms', 'p99_ms', 'p999_ms']:
+            self.assertIn(key, overall)
+        self.assertEqual(
+            sum(b['count'] for b in overall['histogram_ms']),
+            overall['requests']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
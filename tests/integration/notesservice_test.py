@@ -12,6 +12,7 @@ import yaml
 from notesservice import LOGGER_NAME
 from notesservice.datamodel import Note
 from notesservice.service import NotesService
+from notesservice.utils.metrics import Counter, Histogram
 from data import notes_data_suite
 
 
@@ -70,6 +71,36 @@ class NotesServiceWithInMemoryDBTest(asynctest.TestCase):
             all_notes[id] = note
         self.assertEqual(len(all_notes), 2)
 
+    def test_coalesced_reads(self) -> None:
+        id_ = next(iter(self.notes_data))
+        note1 = self.notes_data[list(self.notes_data)[1]]
+
+        async def herd():
+            gets = [
+                asyncio.ensure_future(self.service.get_note(id_))
+                for _ in range(10)
+            ]
+            await asyncio.sleep(0)
+            # Callers after the update must not share the reads before it
+            await self.service.update_note(id_, note1)
+            after = await self.service.get_note(id_)
+            return await asyncio.gather(*gets), after
+
+        before, after = run_coroutine(herd())
+        # One shared read, which may have seen either version
+        self.assertEqual(before, [before[0]] * 10)
+        self.assertEqual(after['title'], note1['title'])
+
+        metrics = self.service.metrics
+        coalesced = metrics.get('notesservice_coalesced_reads_total')
+        assert isinstance(coalesced, Counter)
+        self.assertEqual(coalesced.value(('note',)), 9)
+        durations = metrics.get('notesservice_db_operation_duration_seconds')
+        assert isinstance(durations, Histogram)
+        self.assertEqual(
+            durations.count(('InMemoryNotesDB', 'read_note', 'ok')), 2
+        )
+
     def test_crud_notes(self) -> None:
         ids = list(self.notes_data.keys())
         self.assertGreaterEqual(len(ids), 2)
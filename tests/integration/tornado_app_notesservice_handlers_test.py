@@ -149,6 +149,143 @@ class TestNotesServiceApp(NotesServiceTornadoAppTestSetup):
         self.assertEqual(r.code, 200, all_notes)
         self.assertEqual(len(all_notes), 0, all_notes)
 
+    def test_patch(self):
+        r = self.fetch(
+            APP_VERSION + NOTES_ENTRY_URI_FORMAT_SR.format(id=''),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0),
+        )
+        note_uri = r.headers['Location']
+
+        r = self.fetch(
+            note_uri,
+            method='PATCH',
+            headers=self.headers,
+            body=json.dumps({'title': 'Patched title'}),
+        )
+        self.assertEqual(r.code, 204)
+        r = self.fetch(note_uri, method='GET', headers=None)
+        note = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(note['title'], 'Patched title')
+        self.assertEqual(note['body'], self.addr0['body'])
+        self.assertEqual(note['note_type'], self.addr0['note_type'])
+
+        # PATCH: error cases
+        for body, code in [
+            ('it is not json', 400),
+            ('["title"]', 400),
+            ('{"title": ""}', 400),
+            ('{"note_type": "school"}', 400),
+            ('{"body": null}', 400),
+        ]:
+            r = self.fetch(
+                note_uri, method='PATCH', headers=self.headers, body=body
+            )
+            self.assertEqual(r.code, code, body)
+        r = self.fetch(
+            APP_VERSION + NOTES_ENTRY_URI_FORMAT_SR.format(id='1234'),
+            method='PATCH',
+            headers=self.headers,
+            body=json.dumps({'title': 'x'}),
+        )
+        self.assertEqual(r.code, 404)
+
+    def test_multi_get(self):
+        ids = []
+        for addr in [self.addr0, self.addr1]:
+            r = self.fetch(
+                APP_VERSION + NOTES_ENTRY_URI_FORMAT_SR.format(id=''),
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(addr),
+            )
+            self.assertEqual(r.code, 201)
+            ids.append(r.headers['Location'].rsplit('/', 1)[-1])
+
+        r = self.fetch(
+            APP_VERSION + '/notes?ids={},no-such-id,{}'.format(*ids),
+            method='GET',
+            headers=None,
+        )
+        self.assertEqual(r.code, 200)
+        response = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(sorted(response['notes']), sorted(ids))
+        self.assertEqual(response['missing'], ['no-such-id'])
+
+        r = self.fetch(
+            APP_VERSION + '/notes/multi-get',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps({'ids': ids[:1] * 2}),
+        )
+        self.assertEqual(r.code, 200)
+        response = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(list(response['notes']), ids[:1])
+        self.assertEqual(response['missing'], [])
+
+        # Error cases
+        for body in ['not json', '{"ids": "a,b"}', '{"ids": []}']:
+            r = self.fetch(
+                APP_VERSION + '/notes/multi-get',
+                method='POST',
+                headers=self.headers,
+                body=body,
+            )
+            self.assertEqual(r.code, 400, body)
+        r = self.fetch(APP_VERSION + '/notes?ids=,', method='GET')
+        self.assertEqual(r.code, 400)
+
+    def test_changes_endpoint(self):
+        changes_uri = APP_VERSION + '/notes/changes'
+
+        # Full sync of an empty store
+        r = self.fetch(changes_uri, method='GET', headers=None)
+        self.assertEqual(r.code, 200)
+        changes = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(changes['notes'], {})
+        self.assertEqual(changes['deleted'], [])
+
+        uris = []
+        for addr in [self.addr0, self.addr1]:
+            r = self.fetch(
+                APP_VERSION + NOTES_ENTRY_URI_FORMAT_SR.format(id=''),
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(addr),
+            )
+            self.assertEqual(r.code, 201)
+            uris.append(r.headers['Location'])
+
+        r = self.fetch(changes_uri + '?since=0', method='GET', headers=None)
+        changes = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(len(changes['notes']), 2)
+        self.assertFalse(changes['more'])
+        token = changes['token']
+
+        # Only the deletion after the token
+        r = self.fetch(uris[0], method='DELETE', headers=None)
+        self.assertEqual(r.code, 204)
+        r = self.fetch(
+            changes_uri + '?since=' + token, method='GET', headers=None
+        )
+        changes = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(changes['notes'], {})
+        self.assertEqual(changes['deleted'], [uris[0].rsplit('/', 1)[-1]])
+
+        # Paging
+        r = self.fetch(changes_uri + '?limit=1', method='GET', headers=None)
+        changes = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(len(changes['notes']), 1)
+        self.assertTrue(changes['more'])
+
+        # Error cases
+        for query, code in [
+            ('?since=abc', 400), ('?limit=0', 400), ('?since=99999', 410)
+        ]:
+            r = self.fetch(changes_uri + query, method='GET', headers=None)
+            self.assertEqual(r.code, code, query)
+
 
 if __name__ == '__main__':
     tornado.testing.main()
@@ -0,0 +1,116 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asyncio
+import unittest
+
+from notesservice.utils.admission import (
+    AdmissionController,
+    AdmissionRejectedError,
+    ConcurrencyLimiter
+)
+from notesservice.utils.metrics import MetricsRegistry
+
+
+class ConcurrencyLimiterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def test_queue_and_handover(self) -> None:
+        limiter = ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.queued, 1)
+
+            with self.assertRaises(AdmissionRejectedError) as ctx:
+                await limiter.acquire()
+            self.assertEqual(ctx.exception.reason, 'queue_full')
+
+            # The slot goes to the waiter
+            limiter.release()
+            await waiter
+            self.assertEqual((limiter.in_flight, limiter.queued), (1, 0))
+            limiter.release()
+            self.assertEqual(limiter.in_flight, 0)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_queue_timeout(self) -> None:
+        limiter = ConcurrencyLimiter(
+            limit=1, queue_size=4, queue_timeout=0.01, retry_after=3
+        )
+
+        async def scenario():
+            self.assertTrue(limiter.try_acquire())
+            with self.assertRaises(AdmissionRejectedError) as ctx:
+                await limiter.acquire()
+            self.assertEqual(ctx.exception.reason, 'queue_timeout')
+            self.assertEqual(ctx.exception.retry_after, 3)
+            self.assertEqual(limiter.queued, 0)
+            limiter.release()
+            self.assertEqual(limiter.in_flight, 0)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_cancelled_waiter(self) -> None:
+        limiter = ConcurrencyLimiter(limit=1, queue_size=4, queue_timeout=1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            self.assertEqual(limiter.queued, 0)
+            limiter.release()
+            self.assertEqual(limiter.in_flight, 0)
+
+        self.loop.run_until_complete(scenario())
+
+    def test_adaptive_limit(self) -> None:
+        limiter = ConcurrencyLimiter(
+            limit=10, target_latency=0.05, min_limit=2, backoff=0.5
+        )
+        limiter.limit = 4.0
+
+        # Fast requests grow the limit by about one per limit requests
+        for _ in range(4):
+            limiter._adapt(admitted_at=100.0, now=100.01)
+        self.assertAlmostEqual(limiter.limit, 4.92, places=2)
+
+        # A burst of slow requests admitted before the decrease is one
+        # decrease
+        limiter._adapt(admitted_at=100.0, now=101.0)
+        limiter._adapt(admitted_at=100.5, now=101.1)
+        self.assertAlmostEqual(limiter.limit, 2.46, places=2)
+        limiter._adapt(admitted_at=101.2, now=102.0)
+        self.assertEqual(limiter.limit, 2.0)
+
+        for _ in range(100):
+            limiter._adapt(admitted_at=200.0, now=200.0)
+        self.assertEqual(limiter.limit, 10.0)
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_route_limiters(self) -> None:
+        controller = AdmissionController({
+            'default': {'max-concurrency': 16, 'queue-timeout-ms': 20},
+            'routes': {'notes': {'max-concurrency': 2}, 'changes': None},
+            'adaptive': {'enabled': True, 'target-latency-ms': 10}
+        }, MetricsRegistry())
+
+        notes = controller.limiter('notes')
+        assert notes is not None
+        self.assertEqual(notes.max_limit, 2)
+        self.assertEqual(notes.queue_timeout, 0.02)
+        self.assertEqual(notes.target_latency, 0.01)
+        self.assertIs(controller.limiter('notes'), notes)
+        note = controller.limiter('note')
+        assert note is not None
+        self.assertEqual(note.max_limit, 16)
+        self.assertIsNone(controller.limiter('changes'))
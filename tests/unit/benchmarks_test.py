@@ -0,0 +1,58 @@
+# Copyright (c) 2020. All rights reserved.
+
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks import compare_results, percentile
+from benchmarks.storage import run_storage_benchmark, WORKLOADS
+
+
+class BenchmarkHelpersTest(unittest.TestCase):
+    def test_percentile(self) -> None:
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_compare_results(self) -> None:
+        baseline = [{'engine': 'sql', 'ops_per_sec': 100.0, 'p99_ms': 1.0}]
+        results = [{'engine': 'sql', 'ops_per_sec': 70.0, 'p99_ms': 1.1}]
+        regressions = compare_results(
+            results, baseline, ['engine'], ['ops_per_sec'], ['p99_ms'], 0.2
+        )
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]['metric'], 'ops_per_sec')
+
+
+class StorageBenchmarkTest(unittest.TestCase):
+    def test_storage_benchmark(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            output = os.path.join(tmp, 'report.json')
+            run_storage_benchmark(
+                engines=['memory', 'sql'], sizes=[20], ops=10, list_ops=1,
+                concurrency=2, output=output, baseline=baseline,
+                save_baseline=True
+            )
+            with open(baseline) as f:
+                report = json.load(f)
+
+            self.assertEqual(len(report['results']), 2 * len(WORKLOADS))
+            for row in report['results']:
+                self.assertGreater(row['ops_per_sec'], 0)
+                self.assertIn('p99_ms', row)
+                self.assertGreater(row['peak_rss_kb'], 0)
+
+            regressions = run_storage_benchmark(
+                engines=['memory'], sizes=[20], ops=10, list_ops=1,
+                concurrency=2, output=output, baseline=baseline,
+                tolerance=1e9
+            )
+            self.assertEqual(regressions, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
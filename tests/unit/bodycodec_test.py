@@ -0,0 +1,62 @@
+# Copyright (c) 2020. All rights reserved.
+
+import json
+import os
+import unittest
+
+from notesservice.database.bodycodec import (
+    BodyCodec,
+    FORMAT_LZMA,
+    FORMAT_ZLIB
+)
+
+BODY = 'meeting agenda todo buy milk call review draft release notes ' * 100
+
+
+class BodyCodecTest(unittest.TestCase):
+    def test_encode_body(self) -> None:
+        formats = [('zlib', FORMAT_ZLIB), ('lzma', FORMAT_LZMA)]
+        for algorithm, marker in formats:
+            codec = BodyCodec(algorithm, min_size=1024)
+            encoded = codec.encode_body(BODY)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(encoded[0], marker)
+            self.assertLess(len(encoded), len(BODY))
+            self.assertEqual(codec.decode_body(encoded), BODY)
+            self.assertEqual(codec.compressed, 1)
+            self.assertEqual(
+                codec.saved_bytes, len(BODY.encode('utf-8')) - len(encoded)
+            )
+
+    def test_plain_bodies(self) -> None:
+        codec = BodyCodec('zlib', min_size=1024)
+        # Below the threshold, and too random to get any smaller
+        self.assertEqual(codec.encode_body(BODY[:1023]), BODY[:1023])
+        noise = os.urandom(4096)
+        self.assertIs(codec.encode_record(noise, BODY), noise)
+        self.assertEqual(codec.compressed, 0)
+
+        # Compression off still reads compressed records
+        self.assertEqual(
+            BodyCodec().decode_body(codec.encode_body(BODY)), BODY
+        )
+        self.assertEqual(BodyCodec().encode_body(BODY), BODY)
+        self.assertEqual(BodyCodec().decode_body(''), '')
+
+    def test_encode_record(self) -> None:
+        codec = BodyCodec('lzma', min_size=1024)
+        note = {'id': 'abc', 'title': 'Title', 'body': BODY}
+        data = json.dumps(note).encode('utf-8')
+        encoded = codec.encode_record(data, BODY)
+        self.assertEqual(encoded[0], FORMAT_LZMA)
+        self.assertEqual(json.loads(codec.decode(encoded)), note)
+
+        small = json.dumps({**note, 'body': 'x'}).encode('utf-8')
+        self.assertIs(codec.encode_record(small, 'x'), small)
+        self.assertIs(codec.decode(small), small)
+
+    def test_invalid(self) -> None:
+        with self.assertRaises(ValueError):
+            BodyCodec('brotli')
+        with self.assertRaises(ValueError):
+            BodyCodec.decode(b'\x7fdata')
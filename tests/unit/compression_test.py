@@ -0,0 +1,62 @@
+# Copyright (c) 2020. All rights reserved.
+
+import gzip
+import unittest
+
+from notesservice.utils.compression import (
+    CompressedBodyCache,
+    CompressionPolicy,
+    gzip_compress
+)
+from notesservice.utils.metrics import Counter, MetricsRegistry
+
+
+class CompressedBodyCacheTest(unittest.TestCase):
+    def test_eviction(self) -> None:
+        cache = CompressedBodyCache(max_bytes=10)
+        cache.put(('a', 6), b'1234')
+        cache.put(('b', 6), b'5678')
+        self.assertEqual(cache.get(('a', 6)), b'1234')
+        cache.put(('c', 6), b'90ab')
+        # 'b' was the least recently used
+        self.assertIsNone(cache.get(('b', 6)))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, 8)
+
+        # Larger than the whole cache: not kept
+        cache.put(('d', 6), b'x' * 11)
+        self.assertIsNone(cache.get(('d', 6)))
+
+
+class CompressionPolicyTest(unittest.TestCase):
+    def test_route_settings(self) -> None:
+        policy = CompressionPolicy({
+            'min-size': 100,
+            'level': 4,
+            'routes': {'note': {'min-size': 4096}, 'metrics': None}
+        }, MetricsRegistry())
+        self.assertEqual(policy.route_settings('notes'), (100, 4))
+        self.assertEqual(policy.route_settings('note'), (4096, 4))
+        self.assertIsNone(policy.route_settings('metrics'))
+
+        self.assertTrue(policy.compressible('application/json; a=b'))
+        self.assertTrue(policy.compressible('text/plain'))
+        self.assertFalse(policy.compressible('image/png'))
+
+    def test_compress_cache(self) -> None:
+        metrics = MetricsRegistry()
+        policy = CompressionPolicy({}, metrics)
+        body = b'{"note": "' + b'abc' * 1000 + b'"}'
+
+        first = policy.compress(body, 6, '"etag"')
+        self.assertEqual(gzip.decompress(first), body)
+        self.assertIs(policy.compress(body, 6, '"etag"'), first)
+        self.assertEqual(gzip_compress(body, 6), first)
+
+        lookups = metrics.get('notesservice_compression_cache_total')
+        assert isinstance(lookups, Counter)
+        self.assertEqual(lookups.value(('miss',)), 1)
+        self.assertEqual(lookups.value(('hit',)), 1)
+        compressed = metrics.get('notesservice_compression_bytes_total')
+        assert isinstance(compressed, Counter)
+        self.assertEqual(compressed.value(('in',)), 2 * len(body))
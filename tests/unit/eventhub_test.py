@@ -0,0 +1,63 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asyncio
+import unittest
+
+from notesservice.utils.eventhub import EventHub
+from notesservice.utils.metrics import Counter, Gauge, MetricsRegistry
+
+
+class EventHubTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def value(self, name: str) -> float:
+        metric = self.metrics.get(name)
+        assert isinstance(metric, (Counter, Gauge))
+        return metric.value()
+
+    def test_publish_and_wait(self) -> None:
+        hub = EventHub(self.metrics, buffer_events=4, heartbeat=0.05)
+
+        async def scenario():
+            cursor = hub.subscribe()
+            waiters = [
+                asyncio.ensure_future(hub.wait(cursor)) for _ in range(3)
+            ]
+            await asyncio.sleep(0)
+            hub.publish('created', {'id': 'a'})
+            results = await asyncio.gather(*waiters)
+
+            # Heartbeat: woken up without frames
+            heartbeat = await hub.wait(hub.next_id)
+            hub.unsubscribe()
+            return results, heartbeat
+
+        results, heartbeat = self.loop.run_until_complete(scenario())
+        for frames, cursor, resync in results:
+            self.assertEqual(
+                frames, [b'id: 1\nevent: created\ndata: {"id": "a"}\n\n']
+            )
+            self.assertEqual((cursor, resync), (2, False))
+        self.assertEqual(heartbeat, ([], 2, False))
+        self.assertEqual(self.value('notesservice_stream_subscribers'), 0)
+
+    def test_drop_and_resync(self) -> None:
+        hub = EventHub(self.metrics, buffer_events=2, heartbeat=1.0)
+        cursor = hub.subscribe()
+        for i in range(3):
+            hub.publish('deleted', {'id': str(i)})
+
+        frames, cursor, resync = self.loop.run_until_complete(hub.wait(cursor))
+        self.assertEqual((frames, cursor, resync), ([], 4, True))
+
+        # Reconnect with Last-Event-ID inside the buffer
+        cursor = hub.subscribe('2')
+        frames, cursor, resync = self.loop.run_until_complete(hub.wait(cursor))
+        self.assertEqual(len(frames), 1)
+        self.assertFalse(resync)
+        self.assertEqual(self.value('notesservice_stream_resyncs_total'), 1)
@@ -0,0 +1,52 @@
+# Copyright (c) 2020. All rights reserved.
+
+import os
+import tempfile
+import time
+import unittest
+
+from benchmarks.ids import run_id_benchmark
+from notesservice.utils.idutils import (
+    id_generator,
+    id_timestamp_ms,
+    random_id,
+    time_ordered_id
+)
+
+
+class IdUtilsTest(unittest.TestCase):
+    def test_time_ordered_ids(self) -> None:
+        ids = [time_ordered_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        for id_ in ids[:10]:
+            self.assertEqual(len(id_), 32)
+            self.assertEqual(id_[12], '7')
+            self.assertIn(id_[16], '89ab')
+            int(id_, 16)
+
+        now_ms = int(time.time() * 1000)
+        created_ms = id_timestamp_ms(time_ordered_id())
+        assert created_ms is not None
+        self.assertLessEqual(abs(created_ms - now_ms), 5000)
+
+    def test_id_generator(self) -> None:
+        self.assertIs(id_generator('random'), random_id)
+        self.assertIs(id_generator('time-ordered'), time_ordered_id)
+        self.assertEqual(len(random_id()), 32)
+        self.assertIsNone(id_timestamp_ms('my-note'))
+        with self.assertRaises(ValueError):
+            id_generator('sequential')
+
+    def test_id_benchmark(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'report.json')
+            report = run_id_benchmark(rows=200, batch_size=50, output=output)
+            self.assertTrue(os.path.exists(output))
+
+        schemes = [r['scheme'] for r in report['results']]
+        self.assertEqual(schemes, ['random', 'time-ordered'])
+        for result in report['results']:
+            self.assertEqual(result['rows'], 200)
+            self.assertGreater(result['rows_per_sec'], 0)
+            self.assertGreater(result['file_bytes'], 0)
@@ -0,0 +1,59 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asyncio
+import logging
+import time
+import unittest
+
+from notesservice import LOGGER_NAME
+from notesservice.utils.loopmonitor import LoopMonitor
+from notesservice.utils.metrics import MetricsRegistry
+
+
+def block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class LoopMonitorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.metrics = MetricsRegistry()
+        self.logger = logging.getLogger(LOGGER_NAME + '.loopmonitor')
+        # an earlier logging.config.dictConfig() may have disabled it
+        self.logger.disabled = False
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def test_lag_and_slow_callback(self) -> None:
+        monitor = LoopMonitor(
+            self.metrics,
+            self.logger,
+            lag_interval=0.01,
+            slow_callback_threshold=0.05
+        )
+
+        async def scenario() -> None:
+            monitor.start(self.loop)
+            await asyncio.sleep(0.02)
+            block_the_loop(0.3)
+            await asyncio.sleep(0.05)
+            monitor.stop()
+
+        with self.assertLogs(self.logger, level='WARNING') as logs:
+            self.loop.run_until_complete(scenario())
+
+        slow_callbacks = self.metrics.get(
+            'notesservice_event_loop_slow_callbacks_total'
+        )
+        self.assertEqual(slow_callbacks.value(), 1)  # type: ignore
+        self.assertIn('block_the_loop', logs.output[0])
+
+        lag = self.metrics.get(
+            'notesservice_event_loop_lag_distribution_seconds'
+        )
+        self.assertGreater(lag.sum(), 0.1)  # type: ignore
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from notesservice.database.maintenance import (
+    MAX_VACUUM_PAGES,
+    MaintenancePolicy,
+    sqlite_checkpoint
+)
+
+
+class MaintenancePolicyTest(unittest.TestCase):
+    def test_from_config(self):
+        policy = MaintenancePolicy.from_config({
+            'interval-seconds': 1,
+            'wal-checkpoint-bytes': 1024,
+            'max-pause-ms': 10
+        })
+        self.assertEqual(policy.interval, 1.0)
+        self.assertEqual(policy.wal_checkpoint_bytes, 1024)
+        self.assertEqual(policy.max_pause, 0.01)
+        self.assertEqual(MaintenancePolicy.from_config({}).max_pause, 0.005)
+
+    def test_checkpoint_mode(self):
+        policy = MaintenancePolicy(wal_checkpoint_bytes=1024)
+        self.assertIsNone(policy.checkpoint_mode(0, True))
+        self.assertIsNone(policy.checkpoint_mode(1023, True))
+        self.assertEqual(policy.checkpoint_mode(1024, False), 'PASSIVE')
+        self.assertEqual(policy.checkpoint_mode(1024, True), 'TRUNCATE')
+
+        policy.record_checkpoint('TRUNCATE', 1, 0.001)
+        policy.record_checkpoint('TRUNCATE', 0, 0.001)
+        policy.record_checkpoint('PASSIVE', 0, 0.001)
+        stats = policy.stats()
+        self.assertEqual(stats['maintenance_deferred'], 1)
+        self.assertEqual(stats['maintenance_truncations'], 1)
+        self.assertEqual(stats['maintenance_checkpoints'], 1)
+
+    def test_vacuum_slices(self):
+        policy = MaintenancePolicy(max_pause=0.004)
+        pages = policy.vacuum_pages
+        # Faster than the pause: grows, at most twice as large
+        policy.record_vacuum(pages, 0.001)
+        self.assertEqual(policy.vacuum_pages, 2 * pages)
+        # Slower: shrinks to the pages the pause allows
+        policy.record_vacuum(2 * pages, 0.016)
+        self.assertEqual(policy.vacuum_pages, pages // 2)
+        for _ in range(20):
+            policy.record_vacuum(policy.vacuum_pages, 0.0)
+            policy.record_vacuum(policy.vacuum_pages, 1e-9)
+        self.assertEqual(policy.vacuum_pages, MAX_VACUUM_PAGES)
+        policy.record_vacuum(1, 1.0)
+        self.assertEqual(policy.vacuum_pages, 1)
+
+    def test_optimize_due(self):
+        policy = MaintenancePolicy(optimize_interval=60)
+        policy.last_optimize = 0.0
+        self.assertFalse(policy.optimize_due(59))
+        self.assertTrue(policy.optimize_due(60))
+        policy.record_optimize(0.001, 60)
+        self.assertFalse(policy.optimize_due(119))
+        self.assertTrue(policy.optimize_due(121))
+        self.assertEqual(policy.stats()['maintenance_optimizations'], 1)
+
+    def test_sqlite_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'store.db')
+            connection = sqlite3.connect(path, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL;')
+            connection.execute('CREATE TABLE t (x);')
+            connection.execute('INSERT INTO t VALUES (1);')
+            self.assertGreater(os.path.getsize(path + '-wal'), 0)
+
+            # A reader holds the WAL: truncating would have to wait
+            connection.execute('BEGIN;')
+            connection.execute('SELECT * FROM t;').fetchall()
+            self.assertEqual(sqlite_checkpoint(path, 'TRUNCATE')[0], 1)
+            connection.execute('COMMIT;')
+
+            busy, frames, checkpointed = sqlite_checkpoint(path, 'TRUNCATE')
+            self.assertEqual((busy, frames, checkpointed), (0, 0, 0))
+            self.assertEqual(os.path.getsize(path + '-wal'), 0)
+            connection.close()
@@ -0,0 +1,54 @@
+# Copyright (c) 2020. All rights reserved.
+
+import unittest
+
+from notesservice.utils.metrics import MetricsRegistry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_counter_and_gauge(self) -> None:
+        metrics = MetricsRegistry()
+        counter = metrics.counter('requests_total', 'Requests', ('route',))
+        counter.inc(('notes',))
+        counter.inc(('notes',), amount=2)
+        self.assertEqual(counter.value(('notes',)), 3)
+        self.assertIs(metrics.counter('requests_total', 'Requests'), counter)
+
+        gauge = metrics.gauge('in_flight', 'In flight')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.value(), 1)
+
+        with self.assertRaises(ValueError):
+            metrics.gauge('requests_total', 'Requests')
+
+    def test_histogram_render(self) -> None:
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram(
+            'latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0)
+        )
+        histogram.observe(0.05, ('notes',))
+        histogram.observe(0.1, ('notes',))
+        histogram.observe(5.0, ('notes',))
+        self.assertEqual(histogram.count(('notes',)), 3)
+
+        text = metrics.render()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{route="notes",le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="notes",le="1.0"} 2', text)
+        self.assertIn(
+            'latency_seconds_bucket{route="notes",le="+Inf"} 3', text
+        )
+        self.assertIn('latency_seconds_count{route="notes"} 3', text)
+
+    def test_collectors_and_escaping(self) -> None:
+        metrics = MetricsRegistry()
+        metrics.add_collector(
+            lambda: metrics.gauge('size', 'Size', ('name',)).set(7, ('a"b',))
+        )
+        self.assertIn('size{name="a\\"b"} 7', metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,16 @@
 # Copyright (c) 2020. All rights reserved.
 
 from abc import ABCMeta, abstractmethod
+import asyncio
 import asynctest  # type: ignore
 from io import StringIO
+import json
 import os
+import sqlite3
 import subprocess
 import tempfile
-from typing import Dict
+import time
+from typing import Dict, List, Optional, Tuple
 import unittest
 import yaml
 
@@ -16,11 +20,18 @@ from notesservice.database.notes_db import (
     FilesystemNotesDB,
     SQLiteNotesDB
 )
+from notesservice.database.backup import BackupBusyError
+from notesservice.database.bodycodec import BodyCodec, FORMAT_ZLIB
+from notesservice.database.bodyrefs import BodyRefs
+from notesservice.database.changelog import ChangeLog, ChangesExpiredError
 from notesservice.database.db_engines import create_notes_db
+from notesservice.database.maintenance import MaintenancePolicy
+from notesservice.database.tiered_db import TieredNotesDB
 from notesservice.datamodel import Note
+from notesservice.utils.tinylfu import TinyLFUPolicy
 from tests.integration.notesservice_test import run_coroutine
 
-from data import notes_data_suite
+from data import notes_data_suite, synthetic_notes_data_suite
 
 
 class AbstractNotesDBTest(unittest.TestCase):
@@ -61,8 +72,63 @@ notes-db:
         self.assertEqual(type(db), SQLiteNotesDB)
         self.assertEqual(db.store, './tests/tmp/store.db')
 
+    def test_body_compression_config(self):
+        cfg = self.read_config('''
+notes-db:
+  sql: ./tests/tmp/store.db
+  body-compression:
+    algorithm: lzma
+    min-size: 2048
+        ''')
+
+        db = create_notes_db(cfg['notes-db'])
+        self.assertEqual(db.body_codec.algorithm, 'lzma')
+        self.assertEqual(db.body_codec.min_size, 2048)
+        self.assertIsNone(db.dedup_min_size)
+        db = create_notes_db({'fs': '/tmp', 'body-compression': None})
+        self.assertIsNone(db.body_codec.algorithm)
+        db = create_notes_db({'sql': 'x.db', 'body-dedup': {'min-size': 64}})
+        self.assertEqual(db.dedup_min_size, 64)
+
+    def test_hot_tier_config(self):
+        cfg = self.read_config('''
+notes-db:
+  fs: /tmp
+  hot-tier:
+    max-bytes: 4096
+        ''')
+
+        db = create_notes_db(cfg['notes-db'])
+        self.assertEqual(type(db), TieredNotesDB)
+        self.assertEqual(type(db.durable), FilesystemNotesDB)
+        self.assertEqual(db.policy.max_bytes, 4096)
+        self.assertEqual(db.store, '/tmp')
+        db = create_notes_db({'memory': None, 'hot-tier': {}})
+        self.assertEqual(type(db), InMemoryNotesDB)
+
+    def test_maintenance_config(self):
+        cfg = self.read_config('''
+notes-db:
+  sql: ./tests/tmp/store.db
+  shards: 2
+  maintenance:
+    max-pause-ms: 2
+        ''')
+
+        db = create_notes_db(cfg['notes-db'])
+        policies = [shard.maintenance for shard in db.shards]
+        self.assertIsNot(policies[0], policies[1])
+        self.assertEqual(policies[0].max_pause, 0.002)
+        db = create_notes_db({'sql': 'x.db', 'maintenance': None})
+        self.assertIsNone(db.maintenance)
+        create_notes_db({'fs': '/tmp', 'maintenance': {}})
+
 
 class AbstractNotesDBTestCase(metaclass=ABCMeta):
+    # Whether a bulk create with an existing or repeated id stores none
+    # of the batch
+    atomic_bulk_create = True
+
     def setUp(self) -> None:
         self.notes_data = {
             k: Note.from_api_dm(v)
@@ -129,6 +195,207 @@ class AbstractNotesDBTestCase(metaclass=ABCMeta):
         await self.notes_db.delete_note(new_id)
         self.assertEqual(await self.notes_count(), 0)  # type: ignore
 
+    @asynctest.fail_on(active_handles=True)
+    async def test_bulk_create(self) -> None:
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(50).values()
+        ]
+        count = await self.notes_db.create_notes(notes)
+
+        self.assertEqual(count, 50)  # type: ignore
+        self.assertEqual(await self.notes_count(), 50)  # type: ignore
+        note = await self.notes_db.read_note(notes[0].id)
+        self.assertEqual(  # type: ignore
+            note.to_api_dm(), notes[0].to_api_dm()
+        )
+        with self.assertRaises(KeyError):  # type: ignore
+            await self.notes_db.create_notes(notes[:1])
+
+        # A batch with an existing or a repeated id stores none of it
+        if not self.atomic_bulk_create:
+            return
+        new = [
+            Note.from_api_dm({**notes[0].to_api_dm(), 'id': id_})
+            for id_ in ['new1', 'new2']
+        ]
+        for batch in [new + notes[:1], new + new[1:]]:
+            with self.assertRaises(KeyError):  # type: ignore
+                await self.notes_db.create_notes(batch)
+            self.assertEqual(await self.notes_count(), 50)  # type: ignore
+            with self.assertRaises(KeyError):  # type: ignore
+                await self.notes_db.read_note('new1')
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_patch_note(self) -> None:
+        id, note = next(iter(self.notes_data.items()))
+        await self.notes_db.create_note(note, id)
+        token = (await self.notes_db.read_changes(0, 10)).token
+
+        await self.notes_db.patch_note(
+            id, {'title': 'New title', 'updated_on': 12345}
+        )
+        patched = (await self.notes_db.read_note(id)).to_api_dm()
+        self.assertEqual(  # type: ignore
+            patched,
+            {**note.to_api_dm(), 'title': 'New title', 'updated_on': 12345}
+        )
+
+        await self.notes_db.patch_note(id, {'note_type': 'work'})
+        patched_note = await self.notes_db.read_note(id)
+        self.assertEqual(patched_note.note_type.name, 'work')  # type: ignore
+        self.assertEqual(patched_note.body, note.body)  # type: ignore
+
+        changes = await self.notes_db.read_changes(token, 10)
+        self.assertEqual([i for i, _ in changes.notes], [id])  # type: ignore
+
+        with self.assertRaises(KeyError):  # type: ignore
+            await self.notes_db.patch_note('does-not-exist', {'title': 'x'})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_read_notes(self) -> None:
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(20).values()
+        ]
+        await self.notes_db.create_notes(notes)
+
+        ids = [note.id for note in notes[::2]] + ['does-not-exist']
+        found = await self.notes_db.read_notes(ids)
+        self.assertEqual(sorted(found), sorted(ids[:-1]))  # type: ignore
+        self.assertEqual(  # type: ignore
+            found[notes[0].id].to_api_dm(), notes[0].to_api_dm()
+        )
+        self.assertEqual(  # type: ignore
+            await self.notes_db.read_notes([]), {}
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_changes(self) -> None:
+        first_id, second_id = list(self.notes_data.keys())[:2]
+        for id, note in self.notes_data.items():
+            await self.notes_db.create_note(note, id)
+
+        changes = await self.notes_db.read_changes(0, 10)
+        self.assertEqual(  # type: ignore
+            sorted(id for id, _ in changes.notes), sorted(self.notes_data)
+        )
+        self.assertEqual(changes.deleted, [])  # type: ignore
+        self.assertFalse(changes.more)  # type: ignore
+
+        page = await self.notes_db.read_changes(0, 1)
+        self.assertEqual(len(page.notes), 1)  # type: ignore
+        self.assertTrue(page.more)  # type: ignore
+
+        token = changes.token
+        await self.notes_db.update_note(
+            first_id, self.notes_data[first_id]
+        )
+        await self.notes_db.delete_note(second_id)
+
+        changes = await self.notes_db.read_changes(token, 10)
+        self.assertEqual(  # type: ignore
+            [id for id, _ in changes.notes], [first_id]
+        )
+        self.assertEqual(changes.deleted, [second_id])  # type: ignore
+        self.assertGreater(changes.token, token)  # type: ignore
+
+        changes = await self.notes_db.read_changes(changes.token, 10)
+        self.assertEqual(changes.notes, [])  # type: ignore
+        self.assertEqual(changes.deleted, [])  # type: ignore
+
+        with self.assertRaises(ChangesExpiredError):  # type: ignore
+            await self.notes_db.read_changes(changes.token + 100, 10)
+
+        # Re-created notes replace their tombstone
+        await self.notes_db.create_note(self.notes_data[second_id], second_id)
+        changes = await self.notes_db.read_changes(token, 10)
+        self.assertEqual(changes.deleted, [])  # type: ignore
+        self.assertEqual(len(changes.notes), 2)  # type: ignore
+
+
+class ChangeLogTest(unittest.TestCase):
+    def test_compaction(self) -> None:
+        changes = ChangeLog(tombstone_retention=100)
+        changes.record_change('a')
+        changes.record_delete('b', deleted_on=1000)
+        changes.record_delete('c', deleted_on=1050)
+        token = changes.record_change('d')
+
+        self.assertEqual(changes.compact(now=1120), 1)
+        self.assertEqual(changes.horizon, 2)
+        self.assertEqual(changes.tombstones, 1)
+        with self.assertRaises(ChangesExpiredError):
+            changes.changes_since(1, 10)
+
+        entries, next_token, more = changes.changes_since(2, 10)
+        self.assertEqual(entries, [(3, 'c', True), (4, 'd', False)])
+        self.assertEqual((next_token, more), (token, False))
+
+        # A full sync needs no tombstones, so it never expires
+        entries, _, _ = changes.changes_since(0, 10)
+        self.assertEqual([id_ for _, id_, _ in entries], ['a', 'c', 'd'])
+
+    def test_paging(self) -> None:
+        changes = ChangeLog()
+        for i in range(10):
+            changes.record_change(str(i))
+        for i in range(0, 10, 3):
+            changes.record_delete(str(i))
+        changes.record_change('1')
+
+        pages = []
+        token, more = 0, True
+        while more:
+            entries, token, more = changes.changes_since(token, 3)
+            pages.append(entries)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(token, changes.seq)
+        self.assertEqual(
+            [change for page in pages for change in page],
+            [
+                (seq, id_, deleted_on is not None)
+                for seq, id_, deleted_on in changes.entries()
+            ]
+        )
+
+
+class BodyRefsTest(unittest.TestCase):
+    def test_pin_and_commit(self) -> None:
+        refs = BodyRefs()
+        refs.pin('a', 'h1')
+        self.assertEqual(refs.commit('a', 'h1'), [])
+        refs.pin('b', 'h1')
+        refs.commit('b', 'h1')
+        self.assertEqual(refs.refs('h1'), 2)
+
+        # Two racing writes of a: both bodies are held until committed
+        refs.pin('a', 'h2')
+        refs.pin('a', 'h3')
+        self.assertTrue(refs.pending)
+        self.assertEqual(refs.commit('a', 'h2'), [])
+        self.assertEqual(refs.commit('a', 'h3'), ['h2'])
+        self.assertFalse(refs.pending)
+        self.assertEqual(refs.entry('a'), ['a', 'h3', []])
+
+        refs.pin('b', 'h4')
+        self.assertEqual(refs.unpin('b', 'h4'), ['h4'])
+        self.assertEqual(refs.commit('b', None), ['h1'])
+        self.assertNotIn('b', refs)
+        self.assertEqual(refs.bodies, 1)
+
+    def test_load(self) -> None:
+        refs = BodyRefs()
+        entries: List[Tuple[str, Optional[str], List[str]]] = [
+            ('a', None, ['h1']), ('b', 'h1', []), ('a', 'h1', ['h2'])
+        ]
+        for id_, committed, pinned in entries:
+            refs.load(id_, committed, pinned)
+        self.assertEqual((refs.refs('h1'), refs.refs('h2')), (2, 1))
+        refs.load('a', None, [])
+        self.assertEqual(len(refs), 1)
+        self.assertEqual(refs.entries(), [['b', 'h1', []]])
+
 
 class InMemoryNotesDBTest(
     AbstractNotesDBTestCase,
@@ -142,6 +409,141 @@ class InMemoryNotesDBTest(
         return len(self.mem_db.db)
 
 
+class SpillingInMemoryNotesDBTest(
+    AbstractNotesDBTestCase,
+    asynctest.TestCase
+):
+    # The common tests, with room for about two notes in memory
+    def make_notes_db(self) -> AbstractNotesDB:
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='notesbook-spill')
+        self.mem_db = InMemoryNotesDB(
+            max_bytes=2048, spill_dir=self.tmp_dir.name
+        )
+        return self.mem_db
+
+    async def notes_count(self) -> int:
+        return len(self.mem_db.db)
+
+    def tearDown(self):
+        run_coroutine(self.mem_db.stop())
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    async def test_spill(self):
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(100).values()
+        ]
+        self.mem_db.policy = TinyLFUPolicy(
+            sum(self.mem_db.note_bytes(n) for n in notes[:10])
+        )
+        await self.mem_db.create_notes(notes)
+        stats = self.mem_db.stats()
+        self.assertLessEqual(
+            stats['resident_bytes'], self.mem_db.policy.max_bytes
+        )
+        self.assertEqual(stats['resident_notes'] + stats['spilled_notes'], 100)
+        self.assertGreaterEqual(stats['spilled_notes'], 90)
+        self.assertEqual(stats['spills'], stats['spilled_notes'])
+
+        # Spilled notes are faulted back in, the popular ones stay
+        spilled = [n for n in notes if isinstance(self.mem_db.db[n.id], int)]
+        for _ in range(3):
+            for note in spilled[:5]:
+                self.assertEqual(
+                    (await self.mem_db.read_note(note.id)).to_api_dm(),
+                    note.to_api_dm()
+                )
+        self.assertEqual(self.mem_db.stats()['faults'], 5)
+        for note in spilled[:5]:
+            self.assertIsInstance(self.mem_db.db[note.id], Note)
+
+        # Listings and syncs do not fault notes in
+        listed = {
+            id_: n.to_api_dm() async for id_, n in self.mem_db.read_all_notes()
+        }
+        self.assertEqual(listed, {n.id: n.to_api_dm() for n in notes})
+        changes = await self.mem_db.read_changes(0, 1000)
+        self.assertEqual(len(changes.notes), 100)
+        self.assertEqual(self.mem_db.stats()['faults'], 5)
+
+        # Deleting the spilled notes compacts the spill file
+        self.mem_db.spill.COMPACTION_MIN_BYTES = 0
+        spilled_ids = [
+            id_ for id_, entry in self.mem_db.db.items()
+            if isinstance(entry, int)
+        ]
+        for id_ in spilled_ids:
+            await self.mem_db.delete_note(id_)
+        while self.mem_db._compaction is not None:
+            await self.mem_db._compaction
+        stats = self.mem_db.stats()
+        self.assertEqual(stats['spilled_notes'], 0)
+        self.assertEqual(stats['spill_file_bytes'], 0)
+        self.assertEqual(stats['spill_garbage_bytes'], 0)
+
+    async def test_spill_updates(self):
+        note = Note.from_api_dm(next(iter(
+            synthetic_notes_data_suite(1).values()
+        )))
+        self.mem_db.policy = TinyLFUPolicy(1)
+        await self.mem_db.create_note(note, note.id)
+        self.assertIsInstance(self.mem_db.db[note.id], int)
+        await self.mem_db.patch_note(note.id, {'title': 'Patched'})
+        self.assertEqual(
+            (await self.mem_db.read_note(note.id)).title, 'Patched'
+        )
+        stats = self.mem_db.stats()
+        self.assertEqual(stats['resident_notes'], 0)
+        self.assertGreater(stats['spill_garbage_bytes'], 0)
+
+    async def test_spill_compaction(self):
+        # Notes written, read and deleted while the spill file is compacted
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(60).values()
+        ]
+        self.mem_db.policy = TinyLFUPolicy(1)
+        self.mem_db.spill.COMPACTION_MIN_BYTES = 0
+        await self.mem_db.create_notes(notes[:40])
+        for note in notes[:25]:
+            await self.mem_db.delete_note(note.id)
+        self.assertIsNotNone(self.mem_db._compaction)
+
+        patched = asyncio.gather(*[
+            self.mem_db.patch_note(note.id, {'title': 'Patched'})
+            for note in notes[25:35]
+        ])
+        await self.mem_db.create_notes(notes[40:])
+        for note in notes[35:40]:
+            await self.mem_db.delete_note(note.id)
+        await patched
+        while self.mem_db._compaction is not None:
+            await self.mem_db._compaction
+
+        expected = {
+            n.id: {**n.to_api_dm(), 'title': 'Patched'} for n in notes[25:35]
+        }
+        expected.update({n.id: n.to_api_dm() for n in notes[40:]})
+        listed = {
+            id_: n.to_api_dm() async for id_, n in self.mem_db.read_all_notes()
+        }
+        self.assertEqual(listed, expected)
+        stats = self.mem_db.stats()
+        self.assertEqual(stats['spilled_notes'], 30)
+        self.assertLess(
+            stats['spill_garbage_bytes'], stats['spill_file_bytes']
+        )
+
+    def test_memory_config(self):
+        db = create_notes_db({
+            'memory': {'max-bytes': 4096, 'spill-dir': self.tmp_dir.name}
+        })
+        self.assertEqual(db.policy.max_bytes, 4096)
+        self.assertEqual(db.spill.directory, self.tmp_dir.name)
+        self.assertIsNone(create_notes_db({'memory': None}).policy)
+
+
 class FilesystemNotesDBTest(
     AbstractNotesDBTestCase,
     asynctest.TestCase
@@ -172,6 +574,286 @@ class FilesystemNotesDBTest(
             with self.assertRaises(ValueError):
                 FilesystemNotesDB(tmpfilename)
 
+    async def test_change_log_reload(self):
+        for id, note in self.notes_data.items():
+            await self.fs_db.create_note(note, id)
+        deleted_id = list(self.notes_data.keys())[0]
+        await self.fs_db.delete_note(deleted_id)
+        changes = await self.fs_db.read_changes(0, 10)
+
+        reloaded = FilesystemNotesDB(self.store_dir)
+        await reloaded.start()
+        reloaded_changes = await reloaded.read_changes(0, 10)
+        self.assertEqual(  # type: ignore
+            [(id, n.to_api_dm()) for id, n in reloaded_changes.notes],
+            [(id, n.to_api_dm()) for id, n in changes.notes]
+        )
+        self.assertEqual(  # type: ignore
+            reloaded_changes.deleted, [deleted_id]
+        )
+        self.assertEqual(reloaded_changes.token, changes.token)  # type: ignore
+
+    async def test_change_log_rewrite(self):
+        # Rewrites run while other writes append to the log
+        self.fs_db.CHANGE_LOG_SLACK = 2
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(20).values()
+        ]
+        for note in notes:
+            await self.fs_db.create_note(note, note.id)
+        for _ in range(3):
+            await asyncio.gather(*[
+                self.fs_db.update_note(note.id, note) for note in notes[5:]
+            ])
+        await asyncio.gather(*[
+            self.fs_db.delete_note(note.id) for note in notes[:5]
+        ], *[
+            self.fs_db.update_note(note.id, note) for note in notes[5:]
+        ], *[
+            self.fs_db.create_note(note) for note in notes[:5]
+        ])
+        changes = await self.fs_db.read_changes(0, 100)
+
+        reloaded = FilesystemNotesDB(self.store_dir)
+        reloaded_changes = await reloaded.read_changes(0, 100)
+        self.assertEqual(  # type: ignore
+            [id for id, _ in reloaded_changes.notes],
+            [id for id, _ in changes.notes]
+        )
+        self.assertEqual(  # type: ignore
+            reloaded_changes.deleted, changes.deleted
+        )
+        self.assertEqual(reloaded_changes.token, changes.token)  # type: ignore
+
+    async def test_backup(self):
+        self.fs_db.dedup_min_size = 64
+        self.fs_db.BACKUP_SLICE_FILES = 1
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(20).values()
+        ]
+        shared = 'todo ' * 100
+        for note in notes[:2]:
+            note.body = shared
+        await self.fs_db.create_notes(notes)
+        expected = {n.id: n.to_api_dm() for n in notes}
+        bodies = self.fs_db.stats()['shared_bodies']
+
+        with tempfile.TemporaryDirectory(prefix='notesbook-fsdb') as tmp:
+            path = os.path.join(tmp, 'backup')
+            backup = asyncio.ensure_future(self.fs_db.backup(path))
+            await asyncio.sleep(0)
+            self.assertIsNotNone(self.fs_db._snapshot)
+            with self.assertRaises(BackupBusyError):
+                await self.fs_db.backup(path)
+
+            # Writes during the backup do not show in it
+            await self.fs_db.delete_note(notes[0].id)
+            await self.fs_db.delete_note(notes[1].id)
+            self.assertEqual(
+                self.fs_db.stats()['shared_bodies'], bodies - 1
+            )
+            await self.fs_db.patch_note(notes[2].id, {'title': 'Patched'})
+            await self.fs_db.create_note(notes[0], 'new')
+            summary = await backup
+            self.assertEqual(summary['notes'], 20)
+            self.assertEqual(summary['copied'], 0)
+            with self.assertRaises(FileExistsError):
+                await self.fs_db.backup(path)
+
+            restored = FilesystemNotesDB(path, dedup_min_size=64)
+            await restored.start()
+            self.assertEqual(
+                {id_: n.to_api_dm() async for id_, n in
+                 restored.read_all_notes()},
+                expected
+            )
+            self.assertEqual(restored.stats()['shared_bodies'], bodies)
+            changes = await restored.read_changes(0, 100)
+            self.assertEqual(changes.token, summary['seq'])
+            with open(os.path.join(path, '_meta', 'manifest.json')) as f:
+                manifest = json.load(f)
+            self.assertEqual(len(manifest['sizes']), summary['files'] - 1)
+            self.assertEqual(manifest['seq'], summary['seq'])
+
+    async def test_backup_after_writes_under_way(self):
+        # A write that changed its file but not yet the change log when
+        # the backup starts is in the backup, with its change
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(5).values()
+        ]
+        await self.fs_db.create_notes(notes)
+        log_changes = self.fs_db._log_changes
+
+        async def slow_log_changes(ids):
+            await asyncio.sleep(0.05)
+            await log_changes(ids)
+
+        self.fs_db._log_changes = slow_log_changes  # type: ignore
+        patch = asyncio.ensure_future(
+            self.fs_db.patch_note(notes[0].id, {'title': 'Patched'})
+        )
+        await asyncio.sleep(0.01)
+        with tempfile.TemporaryDirectory(prefix='notesbook-fsdb') as tmp:
+            path = os.path.join(tmp, 'backup')
+            summary = await self.fs_db.backup(path)
+            await patch
+            changes = await self.fs_db.read_changes(0, 100)
+            self.assertEqual(summary['seq'], changes.token)
+
+            restored = FilesystemNotesDB(path)
+            await restored.start()
+            note = await restored.read_note(notes[0].id)
+            self.assertEqual(note.title, 'Patched')
+
+    async def test_patch_races(self):
+        id_, note = next(iter(self.notes_data.items()))
+        await self.fs_db.create_note(note, id_)
+        file_read = self.fs_db._file_read
+
+        async def slow_file_read(id_):
+            note = await file_read(id_)
+            await asyncio.sleep(0.02)
+            return note
+
+        self.fs_db._file_read = slow_file_read  # type: ignore
+
+        # Concurrent patches of a note both apply
+        await asyncio.gather(
+            self.fs_db.patch_note(id_, {'title': 'Patched'}),
+            self.fs_db.patch_note(id_, {'body': 'Patched body'})
+        )
+        patched = await file_read(id_)
+        self.assertEqual(
+            (patched['title'], patched['body']), ('Patched', 'Patched body')
+        )
+
+        # A delete arriving between a patch's read and its write waits for
+        # it, and the note stays deleted
+        patch = asyncio.ensure_future(
+            self.fs_db.patch_note(id_, {'title': 'Again'})
+        )
+        await asyncio.sleep(0.01)
+        await self.fs_db.delete_note(id_)
+        await patch
+        with self.assertRaises(KeyError):
+            await self.fs_db.read_note(id_)
+        changes = await self.fs_db.read_changes(0, 10)
+        self.assertEqual(changes.deleted, [id_])
+        with self.assertRaises(KeyError):
+            await self.fs_db.patch_note(id_, {'title': 'Gone'})
+        self.assertFalse(self.fs_db._note_locks)
+
+    async def test_body_dedup(self):
+        self.fs_db.dedup_min_size = 64
+        shared = 'todo ' * 100
+        base = next(iter(self.notes_data.values())).to_api_dm()
+        notes = [
+            Note.from_api_dm({**base, 'id': id_, 'body': shared})
+            for id_ in ['n1', 'n2', 'n3']
+        ]
+        await self.fs_db.create_note(notes[0], 'n1')
+        await self.fs_db.create_notes(notes[1:])
+        bodies_dir = os.path.join(self.store_dir, '_meta', 'bodies')
+        self.assertEqual(len(os.listdir(bodies_dir)), 1)  # type: ignore
+        self.assertEqual(  # type: ignore
+            self.fs_db.stats()['shared_bodies'], 1
+        )
+        for id_ in ['n1', 'n2', 'n3']:
+            note = await self.fs_db.read_note(id_)
+            self.assertEqual(note.body, shared)  # type: ignore
+
+        # Patched and updated away from the shared body, then deleted
+        await self.fs_db.patch_note('n1', {'body': 'short'})
+        await self.fs_db.update_note(
+            'n2', Note.from_api_dm({**base, 'id': 'n2', 'body': 'x' * 80})
+        )
+        self.assertEqual(len(os.listdir(bodies_dir)), 2)  # type: ignore
+        await self.fs_db.delete_note('n3')
+        self.assertEqual(len(os.listdir(bodies_dir)), 1)  # type: ignore
+        self.assertEqual(  # type: ignore
+            (await self.fs_db.read_note('n1')).body, 'short'
+        )
+
+        # References are reloaded from the log, a body left behind by an
+        # interrupted write is collected at start
+        with open(os.path.join(bodies_dir, 'orphan.json'), 'w') as f:
+            f.write('{"body": ""}')
+        reloaded = FilesystemNotesDB(self.store_dir, dedup_min_size=64)
+        await reloaded.start()
+        self.assertEqual(len(os.listdir(bodies_dir)), 1)  # type: ignore
+        self.assertEqual(  # type: ignore
+            (await reloaded.read_note('n2')).body, 'x' * 80
+        )
+        await reloaded.delete_note('n2')
+        self.assertEqual(os.listdir(bodies_dir), [])  # type: ignore
+
+    async def test_body_removal_race(self):
+        # A body written again while its removal is in flight survives it
+        self.fs_db.dedup_min_size = 64
+        shared = 'todo ' * 100
+        base = next(iter(self.notes_data.values())).to_api_dm()
+        note = Note.from_api_dm({**base, 'id': 'n1', 'body': shared})
+        remove_files = self.fs_db._remove_files
+
+        def slow_remove_files(file_names):
+            time.sleep(0.05)
+            remove_files(file_names)
+
+        self.fs_db._remove_files = slow_remove_files  # type: ignore
+        for _ in range(3):
+            await self.fs_db.create_note(note, 'n1')
+            await asyncio.gather(
+                self.fs_db.delete_note('n1'),
+                self.fs_db.create_note(note, 'n2')
+            )
+            self.assertEqual(  # type: ignore
+                (await self.fs_db.read_note('n2')).body, shared
+            )
+            await self.fs_db.delete_note('n2')
+
+    async def test_no_body_dedup(self):
+        # Without deduplication no body log or bodies directory is made
+        for id, note in self.notes_data.items():
+            await self.fs_db.create_note(note, id)
+            await self.fs_db.update_note(id, note)
+        await self.fs_db.delete_note(id)
+        await self.fs_db.start()
+        self.assertEqual(  # type: ignore
+            os.listdir(os.path.join(self.store_dir, '_meta')),
+            ['changes.log']
+        )
+
+    async def test_compressed_bodies(self):
+        # Written before compression was turned on, then after
+        old_id, note = next(iter(self.notes_data.items()))
+        await self.fs_db.create_note(note, old_id)
+        self.fs_db.body_codec = BodyCodec('zlib', min_size=64)
+        large = Note.from_api_dm({**note.to_api_dm(), 'body': 'todo ' * 100})
+        new_id = await self.fs_db.create_note(large)
+
+        with open(self.fs_db._file_name(old_id), 'rb') as f:
+            self.assertEqual(f.read(1), b'{')  # type: ignore
+        with open(self.fs_db._file_name(new_id), 'rb') as f:
+            self.assertEqual(f.read(1)[0], FORMAT_ZLIB)  # type: ignore
+        self.assertEqual(  # type: ignore
+            (await self.fs_db.read_note(new_id)).body, large.body
+        )
+        self.assertEqual(  # type: ignore
+            (await self.fs_db.read_note(old_id)).body, note.body
+        )
+
+        await self.fs_db.patch_note(new_id, {'title': 'Patched'})
+        self.fs_db.body_codec = BodyCodec()
+        patched = await self.fs_db.read_note(new_id)
+        self.assertEqual(patched.title, 'Patched')  # type: ignore
+        self.assertEqual(patched.body, large.body)  # type: ignore
+        self.assertEqual(len([  # type: ignore
+            n async for n in self.fs_db.read_all_notes()
+        ]), 2)
+
 
 class SQLiteNotesDBTest(
     AbstractNotesDBTestCase,
@@ -202,6 +884,332 @@ class SQLiteNotesDBTest(
     async def test_db_creation(self):
         self.assertTrue(os.path.isfile(self.db_path))
 
+    async def test_read_notes_chunks(self):
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(50).values()
+        ]
+        await self.sql_db.create_notes(notes)
+        self.sql_db.READ_NOTES_CHUNK = 7
+        found = await self.sql_db.read_notes([note.id for note in notes])
+        self.assertEqual(len(found), 50)  # type: ignore
+
+    async def test_read_all_notes_batches(self):
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(50).values()
+        ]
+        await self.sql_db.create_notes(notes)
+        self.sql_db.READ_ALL_BATCH = 7
+        ids = [id_ async for id_, _ in self.sql_db.read_all_notes()]
+        self.assertEqual(  # type: ignore
+            ids, sorted(note.id for note in notes)
+        )
+
+        # Left early, the cursor is closed and the connection still usable
+        async for _ in self.sql_db.read_all_notes():
+            break
+        self.assertEqual(  # type: ignore
+            (await self.sql_db.read_note(ids[0])).id, ids[0]
+        )
+
+    async def test_backup(self):
+        self.sql_db.BACKUP_STEP_PAGES = 1
+        self.sql_db.BACKUP_STEP_PAUSE = 0.001
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(200).values()
+        ]
+        await self.sql_db.create_notes(notes[:100])
+        seq = self.sql_db.seq
+
+        path = self.db_path + '.backup'
+        self.addCleanup(os.remove, path)
+        backup = asyncio.ensure_future(self.sql_db.backup(path))
+        for note in notes[100:]:
+            await self.sql_db.create_note(note, note.id)
+        summary = await backup
+        self.assertGreater(summary['steps'], 1)
+
+        # A snapshot: exactly the notes written up to its sequence number
+        restored = SQLiteNotesDB(path)
+        await restored.start()
+        try:
+            count = len([n async for n in restored.read_all_notes()])
+            self.assertEqual(count, 100 + summary['seq'] - seq)
+            self.assertEqual(restored.seq, summary['seq'])
+        finally:
+            await restored.stop()
+        with self.assertRaises(FileExistsError):
+            await self.sql_db.backup(path)
+
+    async def test_maintenance(self):
+        self.sql_db.maintenance = MaintenancePolicy(
+            idle_seconds=0, wal_checkpoint_bytes=1, optimize_interval=0
+        )
+        await self.sql_db._start_maintenance()
+        self.sql_db._maintenance_task.cancel()
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(200).values()
+        ]
+        await self.sql_db.create_notes(notes)
+        await self.sql_db._clear()
+        size = os.path.getsize(self.db_path + '-wal')
+
+        await self.sql_db.maintain()
+        stats = self.sql_db.stats()
+        self.assertGreater(stats['maintenance_vacuumed_pages'], 0)
+        self.assertEqual(stats['freelist_pages'], 0)
+        self.assertEqual(stats['maintenance_optimizations'], 1)
+        self.assertEqual(stats['maintenance_truncations'], 1)
+        self.assertEqual(os.path.getsize(self.db_path + '-wal'), 0)
+        self.assertLess(os.path.getsize(self.db_path), size / 4)
+
+        # Requests defer vacuum and optimize, and make checkpoints passive
+        self.sql_db.maintenance.idle_seconds = 60
+        await self.sql_db.create_notes(notes)
+        await self.sql_db._clear()
+        await self.sql_db.maintain()
+        stats = self.sql_db.stats()
+        self.assertGreater(stats['freelist_pages'], 0)
+        self.assertEqual(stats['maintenance_optimizations'], 1)
+        self.assertEqual(stats['maintenance_checkpoints'], 1)
+        self.assertGreater(stats['wal_bytes'], 0)
+        # Nothing new to checkpoint
+        await self.sql_db.maintain()
+        self.assertEqual(self.sql_db.stats()['maintenance_checkpoints'], 1)
+
+    async def test_maintenance_task(self):
+        path = self.db_path + '.maintained'
+        self.addCleanup(os.remove, path)
+        notes_db = SQLiteNotesDB(path, maintenance=MaintenancePolicy(
+            interval=0.01, idle_seconds=0, optimize_interval=0
+        ))
+        await notes_db.start()
+        await asyncio.sleep(0.1)
+        task = notes_db._maintenance_task
+        await notes_db.stop()
+        self.assertTrue(task.cancelled())
+        self.assertGreater(notes_db.stats()['maintenance_optimizations'], 0)
+
+    async def test_maintenance_task_errors(self):
+        # A failed round, whatever the error, is counted and the next
+        # rounds still run
+        rounds = []
+
+        async def maintain():
+            rounds.append(None)
+            raise OSError('disk I/O')
+
+        self.sql_db.maintenance = MaintenancePolicy(interval=0.01)
+        self.sql_db.maintain = maintain  # type: ignore
+        task = asyncio.ensure_future(self.sql_db._maintain())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        self.assertGreater(len(rounds), 1)
+        self.assertEqual(
+            self.sql_db.stats()['maintenance_errors'], len(rounds)
+        )
+
+    async def test_maintenance_defers_to_writes(self):
+        self.sql_db.maintenance = MaintenancePolicy(
+            idle_seconds=0, optimize_interval=0
+        )
+        await self.sql_db._start_maintenance()
+        self.sql_db._maintenance_task.cancel()
+        async with self.sql_db.write_lock:
+            await self.sql_db.maintain()
+        self.assertEqual(
+            self.sql_db.stats()['maintenance_optimizations'], 0
+        )
+        await self.sql_db.maintain()
+        self.assertEqual(
+            self.sql_db.stats()['maintenance_optimizations'], 1
+        )
+
+    async def test_tombstone_compaction(self):
+        for id, note in self.notes_data.items():
+            await self.sql_db.create_note(note, id)
+        token = (await self.sql_db.read_changes(0, 10)).token
+        deleted_id = list(self.notes_data.keys())[0]
+        await self.sql_db.delete_note(deleted_id)
+        self.assertEqual(self.sql_db.stats()['tombstones'], 1)  # type: ignore
+
+        removed = await self.sql_db.compact_tombstones(
+            now=time.time() + self.sql_db.tombstone_retention + 1
+        )
+        self.assertEqual(removed, 1)  # type: ignore
+        self.assertEqual(self.sql_db.stats()['tombstones'], 0)  # type: ignore
+        with self.assertRaises(ChangesExpiredError):  # type: ignore
+            await self.sql_db.read_changes(token, 10)
+        changes = await self.sql_db.read_changes(0, 10)
+        self.assertEqual(len(changes.notes), 1)  # type: ignore
+
+    async def test_compressed_bodies(self):
+        old_id, note = next(iter(self.notes_data.items()))
+        await self.sql_db.create_note(note, old_id)
+        self.sql_db.body_codec = BodyCodec('lzma', min_size=64)
+        large = Note.from_api_dm({**note.to_api_dm(), 'body': 'todo ' * 100})
+        new_id = await self.sql_db.create_note(large)
+        await self.sql_db.patch_note(old_id, {'body': 'milk ' * 100})
+        self.assertEqual(  # type: ignore
+            self.sql_db.stats()['bodies_compressed'], 2
+        )
+
+        rows = await self.sql_db.connection.execute_fetchall(
+            'SELECT typeof(body) FROM notes;'
+        )
+        self.assertEqual(  # type: ignore
+            [r[0] for r in rows], ['blob', 'blob']
+        )
+        self.assertEqual(  # type: ignore
+            (await self.sql_db.read_note(old_id)).body, 'milk ' * 100
+        )
+
+        # Bodies are read back whatever the current setting
+        self.sql_db.body_codec = BodyCodec()
+        await self.sql_db.update_note(old_id, note)
+        found = await self.sql_db.read_notes([old_id, new_id])
+        self.assertEqual(found[old_id].body, note.body)  # type: ignore
+        self.assertEqual(found[new_id].body, large.body)  # type: ignore
+        changes = await self.sql_db.read_changes(0, 10)
+        self.assertEqual(  # type: ignore
+            sorted(n.body for _, n in changes.notes),
+            sorted([note.body, large.body])
+        )
+
+    async def test_body_dedup(self):
+        self.sql_db.dedup_min_size = 64
+        shared = 'todo ' * 100
+        base = next(iter(self.notes_data.values())).to_api_dm()
+        notes = [
+            Note.from_api_dm({**base, 'id': id_, 'body': shared})
+            for id_ in ['n1', 'n2', 'n3']
+        ]
+        await self.sql_db.create_note(notes[0], 'n1')
+        await self.sql_db.create_notes(notes[1:])
+
+        async def bodies():
+            return await self.sql_db.connection.execute_fetchall(
+                'SELECT refs FROM bodies ORDER BY refs;'
+            )
+
+        self.assertEqual(await bodies(), [(3,)])  # type: ignore
+        found = await self.sql_db.read_notes(['n1', 'n2', 'n3'])
+        self.assertEqual(  # type: ignore
+            {note.body for note in found.values()}, {shared}
+        )
+
+        # The same body again keeps its one copy
+        await self.sql_db.update_note('n1', notes[0])
+        await self.sql_db.patch_note('n2', {'body': 'short'})
+        await self.sql_db.update_note(
+            'n3', Note.from_api_dm({**base, 'id': 'n3', 'body': 'x' * 80})
+        )
+        self.assertEqual(await bodies(), [(1,), (1,)])  # type: ignore
+        await self.sql_db.delete_note('n1')
+        self.assertEqual(await bodies(), [(1,)])  # type: ignore
+        self.assertEqual(  # type: ignore
+            self.sql_db.stats()['shared_bodies'], 1
+        )
+
+        changes = await self.sql_db.read_changes(0, 10)
+        self.assertEqual(  # type: ignore
+            sorted(n.body for _, n in changes.notes), ['short', 'x' * 80]
+        )
+        all_notes = [n async for _, n in self.sql_db.read_all_notes()]
+        self.assertEqual(len(all_notes), 2)  # type: ignore
+
+        # Garbage collection recounts the references
+        await self.sql_db.connection.execute('UPDATE bodies SET refs = 5;')
+        await self.sql_db.connection.execute(
+            "INSERT INTO bodies VALUES (x'00', 'orphan', 1);"
+        )
+        self.assertEqual(await self.sql_db.collect_bodies(), 1)  # type: ignore
+        self.assertEqual(await bodies(), [(1,)])  # type: ignore
+
+    async def test_concurrent_body_dedup(self):
+        # Concurrent writes each release the body they replace once
+        self.sql_db.dedup_min_size = 64
+        shared = 'todo ' * 100
+        base = next(iter(self.notes_data.values())).to_api_dm()
+        await self.sql_db.create_notes([
+            Note.from_api_dm({**base, 'id': id_, 'body': shared})
+            for id_ in ['n1', 'n2']
+        ])
+        await asyncio.gather(
+            self.sql_db.update_note('n1', Note.from_api_dm(
+                {**base, 'id': 'n1', 'body': 'first ' * 100}
+            )),
+            self.sql_db.update_note('n1', Note.from_api_dm(
+                {**base, 'id': 'n1', 'body': 'second ' * 100}
+            )),
+            self.sql_db.patch_note('n1', {'body': 'third ' * 100})
+        )
+        self.assertEqual(  # type: ignore
+            (await self.sql_db.read_note('n2')).body, shared
+        )
+        self.assertEqual(  # type: ignore
+            (await self.sql_db.read_note('n1')).body, 'third ' * 100
+        )
+        self.assertEqual(await self.sql_db.collect_bodies(), 0)  # type: ignore
+        rows = await self.sql_db.connection.execute_fetchall(
+            'SELECT refs FROM bodies;'
+        )
+        self.assertEqual(list(rows), [(1,), (1,)])  # type: ignore
+
+    async def test_schema_migration(self):
+        self.assertEqual(  # type: ignore
+            await self.sql_db.schema_version(), SQLiteNotesDB.SCHEMA_VERSION
+        )
+
+        # Version 1 store, as written before schema versioning
+        v1_path = './tests/tmp/store-v1.db'
+        conn = sqlite3.connect(v1_path)
+        conn.execute('''
+            CREATE TABLE notes (
+                id varchar(32) PRIMARY KEY,
+                title varchar NOT NULL,
+                body varchar NOT NULL DEFAULT '',
+                note_type varchar
+                    CHECK( note_type IN ('personal', 'work') )
+                    NOT NULL,
+                updated_on bigint DEFAULT 0
+            );
+        ''')
+        v1_notes = {
+            k: v.to_api_dm() for k, v in self.notes_data.items()
+        }
+        v1_notes['my-own-id'] = {
+            **next(iter(v1_notes.values())), 'id': 'my-own-id'
+        }
+        conn.executemany(
+            'INSERT INTO notes VALUES(?,?,?,?,?);',
+            [list(note.values()) for note in v1_notes.values()]
+        )
+        conn.commit()
+        conn.close()
+
+        v1_db = SQLiteNotesDB(v1_path)
+        try:
+            await v1_db.start()
+            self.assertEqual(  # type: ignore
+                await v1_db.schema_version(), SQLiteNotesDB.SCHEMA_VERSION
+            )
+            for id_, note in v1_notes.items():
+                migrated = await v1_db.read_note(id_)
+                self.assertEqual(migrated.to_api_dm(), note)  # type: ignore
+            self.assertEqual(await v1_db.migrate(), 0)  # type: ignore
+
+            await v1_db.connection.execute('PRAGMA user_version = 99;')
+            await v1_db.connection.commit()
+            with self.assertRaises(RuntimeError):  # type: ignore
+                await v1_db.migrate()
+        finally:
+            await v1_db.stop()
+            os.remove(v1_path)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+# Copyright (c) 2020. All rights reserved.
+
+import unittest
+
+from notesservice.utils.metrics import Counter, MetricsRegistry
+from notesservice.utils.ratelimit import RateLimiter, TokenBucketTable
+
+
+class TokenBucketTableTest(unittest.TestCase):
+    def test_take(self) -> None:
+        table = TokenBucketTable(rate=10.0, burst=5.0)
+        for _ in range(5):
+            self.assertEqual(table.take('a', now=100.0), 0.0)
+        self.assertAlmostEqual(table.take('a', now=100.0), 0.1)
+        self.assertAlmostEqual(table.take('a', cost=3, now=100.0), 0.3)
+
+        # Refilled at `rate`, up to `burst`
+        self.assertEqual(table.take('a', cost=2, now=100.2), 0.0)
+        self.assertEqual(table.take('b', cost=5, now=100.2), 0.0)
+        self.assertEqual(table.take('a', cost=5, now=200.0), 0.0)
+
+        # A cost above the burst is clamped to it
+        self.assertEqual(table.take('c', cost=50, now=200.0), 0.0)
+
+    def test_sweep(self) -> None:
+        table = TokenBucketTable(rate=1.0, burst=10.0, sweep_interval=5.0)
+        table.take('a', now=100.0)
+        table.take('b', now=105.0)
+        table.take('c', now=108.0)
+        self.assertEqual(len(table), 3)
+
+        # Idle once the bucket would be full again: 10 s here
+        self.assertEqual(table.sweep(now=112.0), 1)
+        self.assertEqual(len(table), 2)
+
+        # Swept on the next take after the interval, 'b' was used again
+        table.take('b', now=113.0)
+        table.take('c', now=119.0)
+        self.assertEqual(len(table), 2)
+        table.take('d', now=124.0)
+        self.assertEqual(len(table), 2)
+
+    def test_max_clients(self) -> None:
+        table = TokenBucketTable(rate=1.0, burst=1.0, max_clients=2)
+        table.take('a', now=0.0)
+        table.take('b', now=0.0)
+        table.take('a', now=0.0)
+        table.take('c', now=0.0)
+        # 'b' was the least recently seen
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.take('b', now=0.0), 0.0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_check(self) -> None:
+        metrics = MetricsRegistry()
+        limiter = RateLimiter({
+            'key': 'api-key',
+            'rate': 1,
+            'burst': 10,
+            'costs': {'notes': {'GET': 10}, 'changes': 5}
+        }, metrics)
+
+        self.assertEqual(limiter.cost('notes', 'GET'), 10.0)
+        self.assertEqual(limiter.cost('notes', 'POST'), 1.0)
+        self.assertEqual(limiter.cost('changes', 'GET'), 5.0)
+        self.assertEqual(limiter.cost('note', 'GET'), 1.0)
+
+        client = limiter.client_key('10.0.0.1', 'k1')
+        self.assertEqual(client, 'key:k1')
+        self.assertEqual(limiter.client_key('10.0.0.1'), 'ip:10.0.0.1')
+
+        self.assertEqual(limiter.check('notes', 'GET', client), 0)
+        self.assertEqual(limiter.check('notes', 'GET', client), 10)
+        self.assertEqual(limiter.check('note', 'GET', 'key:k2'), 0)
+        limited = metrics.get('notesservice_rate_limited_total')
+        assert isinstance(limited, Counter)
+        self.assertEqual(limited.value(('notes',)), 1)
@@ -0,0 +1,140 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asynctest  # type: ignore
+import os
+import tempfile
+from typing import AsyncIterator, List
+
+from notesservice.database.changelog import ChangesExpiredError
+from notesservice.database.db_engines import create_notes_db, reshard_store
+from notesservice.database.notes_db import AbstractNotesDB, id_sort_key
+from notesservice.database.sharded_db import (
+    ShardedNotesDB,
+    shard_of,
+    shard_paths
+)
+from notesservice.datamodel import Note
+from notesservice.utils.asyncutils import merge_sorted
+from tests.unit.notes_db_test import AbstractNotesDBTestCase
+
+from data import synthetic_notes_data_suite
+
+
+async def iterate(values: List) -> AsyncIterator:
+    for value in values:
+        yield value
+
+
+class MergeSortedTest(asynctest.TestCase):
+    async def test_merge_sorted(self):
+        merged = [
+            v async for v in merge_sorted(
+                [iterate([1, 4, 9]), iterate([]), iterate([2, 3, 10])],
+                key=lambda v: v
+            )
+        ]
+        self.assertEqual(merged, [1, 2, 3, 4, 9, 10])
+
+
+class ShardedNotesDBTest(
+    AbstractNotesDBTestCase,
+    asynctest.TestCase
+):
+    # Atomic per shard only
+    atomic_bulk_create = False
+
+    def make_notes_db(self) -> AbstractNotesDB:
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='notesbook-shard')
+        self.db_config = {
+            'sql': os.path.join(self.tmp_dir.name, 'store.db'),
+            'shards': 3
+        }
+        self.sharded_db = create_notes_db(self.db_config)
+        self.loop.run_until_complete(self.sharded_db.start())
+        return self.sharded_db
+
+    async def notes_count(self) -> int:
+        return len([n async for n in self.sharded_db.read_all_notes()])
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.sharded_db.stop())
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    async def create_synthetic_notes(self, count: int) -> List[Note]:
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(count).values()
+        ]
+        self.assertEqual(await self.sharded_db.create_notes(notes), count)
+        return notes
+
+    async def test_sharding(self):
+        self.assertIsInstance(self.sharded_db, ShardedNotesDB)
+        self.assertEqual(
+            self.sharded_db.store, shard_paths(self.db_config['sql'], 3)
+        )
+        self.assertTrue(all(os.path.isfile(p) for p in self.sharded_db.store))
+
+        notes = await self.create_synthetic_notes(60)
+        new_id = await self.sharded_db.create_note(notes[0])
+        self.assertNotEqual(new_id, notes[0].id)
+        for i, shard in enumerate(self.sharded_db.shards):
+            ids = [id_ async for id_, _ in shard.read_all_notes()]
+            self.assertTrue(ids)
+            self.assertTrue(all(shard_of(id_, 3) == i for id_ in ids))
+
+        # The listing is in id order, like a single store
+        ids = [id_ async for id_, _ in self.sharded_db.read_all_notes()]
+        self.assertEqual(
+            ids, sorted([new_id] + [n.id for n in notes], key=id_sort_key)
+        )
+        self.assertEqual(self.sharded_db.stats()['shards'], 3)
+
+    async def test_changes_pages(self):
+        notes = await self.create_synthetic_notes(20)
+        for limit in [1, 2, 7]:
+            ids = []
+            token, more = 0, True
+            while more:
+                changes = await self.sharded_db.read_changes(token, limit)
+                self.assertLessEqual(len(changes.notes), limit)
+                ids.extend(id_ for id_, _ in changes.notes)
+                token, more = changes.token, changes.more
+            self.assertEqual(sorted(ids), sorted(n.id for n in notes))
+
+        with self.assertRaises(ChangesExpiredError):
+            await self.sharded_db.read_changes(token << 48 * 3, 10)
+
+    async def test_reshard(self):
+        notes = await self.create_synthetic_notes(50)
+        await self.sharded_db.delete_note(notes[0].id)
+        token = (await self.sharded_db.read_changes(0, 100)).token
+
+        await self.sharded_db.stop()
+        self.assertEqual(await reshard_store(self.db_config, 5), 49)
+        with self.assertRaises(FileExistsError):
+            await reshard_store(self.db_config, 5)
+
+        resharded = create_notes_db({**self.db_config, 'shards': 5})
+        await resharded.start()
+        try:
+            ids = [id_ async for id_, _ in resharded.read_all_notes()]
+            self.assertEqual(
+                ids, sorted([n.id for n in notes[1:]], key=id_sort_key)
+            )
+            # Tokens of the old store expire, a full sync works
+            with self.assertRaises(ChangesExpiredError):
+                await resharded.read_changes(token, 100)
+            changes = await resharded.read_changes(0, 100)
+            self.assertEqual(len(changes.notes), 49)
+            self.assertEqual(changes.deleted, [])
+        finally:
+            await resharded.stop()
+        await self.sharded_db.start()
+
+    def test_shards_config(self):
+        with self.assertRaises(ValueError):
+            create_notes_db({'fs': '/tmp', 'shards': 2})
+        db = create_notes_db({'sql': 'x.db', 'shards': 1})
+        self.assertEqual(db.store, 'x.db')
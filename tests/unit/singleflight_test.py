@@ -0,0 +1,110 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asyncio
+import unittest
+
+from notesservice.utils.metrics import Counter, MetricsRegistry
+from notesservice.utils.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.metrics = MetricsRegistry()
+        self.calls = 0
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    async def read(self, value=None):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def coalesced(self, operation: str = 'read') -> float:
+        counter = self.metrics.get('notesservice_coalesced_reads_total')
+        assert isinstance(counter, Counter)
+        return counter.value((operation,))
+
+    def test_coalesce(self) -> None:
+        reads = SingleFlight(self.metrics)
+
+        async def scenario():
+            return await asyncio.gather(
+                *[reads.do('a', lambda: self.read('A')) for _ in range(5)],
+                reads.do('b', lambda: self.read('B'))
+            )
+
+        results = self.loop.run_until_complete(scenario())
+        self.assertEqual(results, ['A'] * 5 + ['B'])
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.coalesced(), 4)
+        self.assertEqual(len(reads), 0)
+
+        # Done reads are not cached
+        self.loop.run_until_complete(reads.do('a', lambda: self.read('A')))
+        self.assertEqual(self.calls, 3)
+
+    def test_shared_error(self) -> None:
+        reads = SingleFlight(self.metrics)
+
+        async def scenario():
+            return await asyncio.gather(
+                *[reads.do('a', lambda: self.read(KeyError('a')))
+                  for _ in range(3)],
+                return_exceptions=True
+            )
+
+        results = self.loop.run_until_complete(scenario())
+        self.assertEqual(self.calls, 1)
+        for result in results:
+            self.assertIsInstance(result, KeyError)
+
+    def test_forget(self) -> None:
+        reads = SingleFlight(self.metrics)
+
+        async def scenario():
+            before = asyncio.ensure_future(
+                reads.do('a', lambda: self.read('old'))
+            )
+            await asyncio.sleep(0)
+            # A write lands while the read is in flight
+            reads.forget('a')
+            after = await reads.do('a', lambda: self.read('new'))
+            return await before, after
+
+        self.assertEqual(
+            self.loop.run_until_complete(scenario()), ('old', 'new')
+        )
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.coalesced(), 0)
+
+    def test_cancelled_caller(self) -> None:
+        reads = SingleFlight(self.metrics)
+
+        async def scenario():
+            first = asyncio.ensure_future(
+                reads.do('a', lambda: self.read('A'))
+            )
+            second = asyncio.ensure_future(
+                reads.do('a', lambda: self.read('A'))
+            )
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(self.loop.run_until_complete(scenario()), 'A')
+        self.assertEqual(self.calls, 1)
+
+    def test_disabled(self) -> None:
+        reads = SingleFlight(self.metrics, enabled=False)
+
+        async def scenario():
+            return await asyncio.gather(
+                *[reads.do('a', lambda: self.read('A')) for _ in range(3)]
+            )
+
+        self.assertEqual(self.loop.run_until_complete(scenario()), ['A'] * 3)
+        self.assertEqual(self.calls, 3)
@@ -0,0 +1,43 @@
+# Copyright (c) 2020. All rights reserved.
+
+import jsonschema  # type: ignore
+import unittest
+
+from notesservice import NOTES_SCHEMA
+from data import synthetic_notes_data_suite
+from data.synthetic import generate_notes, parse_body_size
+
+
+class SyntheticNotesDataTest(unittest.TestCase):
+    def test_schema_valid_and_deterministic(self) -> None:
+        notes = synthetic_notes_data_suite(200, seed=7)
+        self.assertEqual(len(notes), 200)
+        for id_, note in notes.items():
+            self.assertEqual(id_, note['id'])
+            self.assertEqual(len(id_), 32)
+            jsonschema.validate(note, NOTES_SCHEMA)
+
+        self.assertEqual(notes, synthetic_notes_data_suite(200, seed=7))
+        self.assertNotEqual(notes, synthetic_notes_data_suite(200, seed=8))
+
+    def test_options(self) -> None:
+        notes = list(generate_notes(
+            100,
+            body_size='fixed:64',
+            type_mix='work=1',
+            updated_on_days=1,
+            updated_on_end=86400
+        ))
+        for note in notes:
+            self.assertEqual(len(note['body']), 64)
+            self.assertEqual(note['note_type'], 'work')
+            self.assertTrue(0 <= note['updated_on'] <= 86400)
+
+        with self.assertRaises(ValueError):
+            parse_body_size('gaussian:1')
+        with self.assertRaises(KeyError):
+            list(generate_notes(1, type_mix='shopping=1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
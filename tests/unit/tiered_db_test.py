@@ -0,0 +1,154 @@
+# Copyright (c) 2020. All rights reserved.
+
+import asyncio
+import asynctest  # type: ignore
+import tempfile
+import unittest
+
+from notesservice.database.db_engines import create_notes_db
+from notesservice.database.notes_db import AbstractNotesDB, note_size
+from notesservice.database.tiered_db import TieredNotesDB
+from notesservice.datamodel import Note
+from notesservice.utils.tinylfu import CountMinSketch, TinyLFUPolicy
+from tests.unit.notes_db_test import AbstractNotesDBTestCase
+
+from data import synthetic_notes_data_suite
+
+
+class CountMinSketchTest(unittest.TestCase):
+    def test_estimate_and_reset(self) -> None:
+        sketch = CountMinSketch(width=64, sample_size=1000)
+        for _ in range(5):
+            sketch.increment('hot')
+        sketch.increment('warm')
+        self.assertEqual(sketch.estimate('hot'), 5)
+        self.assertGreaterEqual(sketch.estimate('warm'), 1)
+        self.assertEqual(sketch.estimate('cold'), 0)
+
+        for _ in range(20):
+            sketch.increment('hot')
+        self.assertEqual(sketch.estimate('hot'), 15)
+        sketch.reset()
+        self.assertEqual(sketch.estimate('hot'), 7)
+
+
+class TinyLFUPolicyTest(unittest.TestCase):
+    def test_scan_resistance(self) -> None:
+        policy: TinyLFUPolicy[int] = TinyLFUPolicy(
+            max_bytes=1000, window_fraction=0.1
+        )
+        for key in range(10):
+            self.assertEqual(policy.add(key, 50), [])
+        for _ in range(3):
+            for key in range(10):
+                self.assertTrue(policy.access(key))
+
+        # A scan of keys seen once cannot push out the popular ones
+        evicted = []
+        for key in range(100, 200):
+            policy.access(key)
+            evicted.extend(policy.add(key, 50))
+        self.assertTrue(all(key in policy for key in range(10)))
+        self.assertEqual(len(evicted), 100 - 10)
+        self.assertGreater(policy.rejections, 0)
+        self.assertLessEqual(policy.size, 1000)
+
+    def test_resize_and_remove(self) -> None:
+        policy: TinyLFUPolicy[str] = TinyLFUPolicy(max_bytes=1000)
+        self.assertEqual(policy.add('big', 2000), ['big'])
+        self.assertEqual(policy.add('a', 400), [])
+        self.assertEqual(policy.add('b', 400), [])
+        self.assertEqual(policy.resize('a', 2000), ['a'])
+        self.assertNotIn('a', policy)
+        policy.remove('b')
+        self.assertEqual((len(policy), policy.size), (0, 0))
+
+
+class TieredNotesDBTest(
+    AbstractNotesDBTestCase,
+    asynctest.TestCase
+):
+    def make_notes_db(self) -> AbstractNotesDB:
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='notesbook-tier')
+        self.tiered_db = create_notes_db({
+            'fs': self.tmp_dir.name,
+            'hot-tier': {'max-bytes': 1 << 20}
+        })
+        return self.tiered_db
+
+    async def notes_count(self) -> int:
+        return len([n async for n in self.tiered_db.read_all_notes()])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    async def test_hot_tier(self):
+        self.assertIsInstance(self.tiered_db, TieredNotesDB)  # type: ignore
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(20).values()
+        ]
+        await self.tiered_db.create_notes(notes)
+        self.assertEqual(len(self.tiered_db.policy), 0)  # type: ignore
+
+        for _ in range(3):
+            await self.tiered_db.read_note(notes[0].id)
+        found = await self.tiered_db.read_notes([n.id for n in notes[:2]])
+        self.assertEqual(len(found), 2)  # type: ignore
+        stats = self.tiered_db.stats()
+        self.assertEqual(  # type: ignore
+            (stats['hot_hits'], stats['hot_misses']), (3, 2)
+        )
+        self.assertEqual(stats['hot_promotions'], 2)  # type: ignore
+        self.assertEqual(stats['hot_notes'], 2)  # type: ignore
+
+        # Writes go through to both tiers
+        updated = Note.from_api_dm({
+            **notes[0].to_api_dm(), 'title': 'Updated'
+        })
+        await self.tiered_db.update_note(notes[0].id, updated)
+        await self.tiered_db.patch_note(notes[1].id, {'title': 'Patched'})
+        await self.tiered_db.durable.stop()
+        hot = await self.tiered_db.read_notes([n.id for n in notes[:2]])
+        self.assertEqual(  # type: ignore
+            [n.title for n in hot.values()], ['Updated', 'Patched']
+        )
+
+    async def test_budget(self):
+        notes = [
+            Note.from_api_dm(note)
+            for note in synthetic_notes_data_suite(50).values()
+        ]
+        budget = sum(note_size(n) for n in notes[:10])
+        tiered_db = TieredNotesDB(self.tiered_db.durable, max_bytes=budget)
+        for note in notes:
+            await tiered_db.create_note(note, note.id)
+        self.assertLessEqual(tiered_db.policy.size, budget)  # type: ignore
+        self.assertEqual(  # type: ignore
+            len(tiered_db.hot.db), len(tiered_db.policy)
+        )
+        # Notes created once do not replace the resident ones, a note
+        # read often does
+        self.assertGreater(tiered_db.policy.rejections, 0)  # type: ignore
+        self.assertEqual(tiered_db.demotions, 0)  # type: ignore
+        for _ in range(5):
+            await tiered_db.read_note(notes[-2].id)
+        self.assertIn(notes[-2].id, tiered_db.hot.db)  # type: ignore
+        self.assertGreater(tiered_db.demotions, 0)  # type: ignore
+
+        await tiered_db.delete_note(notes[-1].id)
+        self.assertNotIn(notes[-1].id, tiered_db.hot.db)  # type: ignore
+        with self.assertRaises(KeyError):  # type: ignore
+            await tiered_db.read_note(notes[-1].id)
+
+    async def test_read_racing_write(self):
+        id_, note = next(iter(self.notes_data.items()))
+        await self.tiered_db.durable.create_note(note, id_)
+        updated = Note.from_api_dm({**note.to_api_dm(), 'title': 'New'})
+        await asyncio.gather(
+            self.tiered_db.read_note(id_),
+            self.tiered_db.update_note(id_, updated)
+        )
+        note = await self.tiered_db.hot.read_note(id_)
+        self.assertEqual(note.title, 'New')  # type: ignore
@@ -1,16 +1,23 @@
 import aiotask_context as context  # type: ignore
+import asyncio
 import atexit
+import copy
+import gzip
 from io import StringIO
 import json
 import logging
 import logging.config
+import os
+import tempfile
+from typing import Dict, List
 import yaml
 
 from tornado.ioloop import IOLoop
+import tornado.httpclient
 import tornado.testing
 
 from notesservice import LOGGER_NAME
-from notesservice.tornado.app import make_notesservice_app
+from notesservice.tornado.app import make_notesservice_app, unless_refused
 
 from data import notes_data_suite
 
@@ -42,12 +49,16 @@ class NotesServiceTornadoAppTestSetup(tornado.testing.AsyncHTTPTestCase):
         self.addr0 = notes_data[keys[0]]
         self.addr1 = notes_data[keys[1]]
 
+    def get_config(self) -> Dict:
+        return TEST_CONFIG
+
     def get_app(self) -> tornado.web.Application:
-        logging.config.dictConfig(TEST_CONFIG['logging'])
+        config = self.get_config()
+        logging.config.dictConfig(config['logging'])
         logger = logging.getLogger(LOGGER_NAME)
 
         notes_service, app = make_notesservice_app(
-            config=TEST_CONFIG,
+            config=config,
             debug=True,
             logger=logger
         )
@@ -76,6 +87,466 @@ class NotesServiceTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
         self.assertEqual(info['code'], 404)
         self.assertEqual(info['message'], 'Unknown Endpoint')
 
+    def test_metrics_handler(self):
+        self.fetch('/does-not-exist', method='GET', headers=None)
+        r = self.fetch('/metrics', method='GET', headers=None)
+        text = r.body.decode('utf-8')
+
+        self.assertEqual(r.code, 200)
+        self.assertTrue(r.headers['Content-Type'].startswith('text/plain'))
+        self.assertIn(
+            'notesservice_http_requests_total'
+            '{method="GET",route="unknown",status="404"} 1.0',
+            text
+        )
+        self.assertIn('notesservice_http_requests_in_flight', text)
+
+    def test_admin_disabled(self):
+        r = self.fetch('/admin/profile', method='GET', headers=None)
+        self.assertEqual(r.code, 404)
+
+    def test_server_timing_disabled(self):
+        r = self.fetch('/v1/notes', method='GET', headers=None)
+        self.assertEqual(r.code, 200)
+        self.assertNotIn('Server-Timing', r.headers)
+
+
+class ServerTimingTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['instrumentation'] = {'server-timing': True}
+        return config
+
+    def test_server_timing_header(self):
+        r = self.fetch(
+            '/v1/notes',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+        self.assertEqual(r.code, 201)
+        timing = r.headers['Server-Timing']
+        for name in ['parse', 'validate', 'db', 'total']:
+            self.assertIn(name + ';dur=', timing)
+
+        r = self.fetch(r.headers['Location'], method='GET', headers=None)
+        self.assertEqual(r.code, 200)
+        self.assertIn('serialize;dur=', r.headers['Server-Timing'])
+
+
+class TimeOrderedIdTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['service']['id-scheme'] = 'time-ordered'
+        return config
+
+    def test_time_ordered_ids(self):
+        ids = []
+        for _ in range(3):
+            r = self.fetch(
+                '/v1/notes',
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(self.addr0)
+            )
+            self.assertEqual(r.code, 201)
+            ids.append(r.headers['Location'].rsplit('/', 1)[-1])
+
+        self.assertEqual(ids, sorted(ids))
+        for id_ in ids:
+            self.assertEqual(len(id_), 32)
+            self.assertEqual(id_[12], '7')
+
+
+class StreamTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['stream'] = {'heartbeat-seconds': 0.1}
+        return config
+
+    @tornado.testing.gen_test(timeout=10)
+    async def test_change_stream(self):
+        chunks: List[bytes] = []
+        stream = self.http_client.fetch(
+            self.get_url('/v1/notes/stream'),
+            streaming_callback=chunks.append,
+            request_timeout=1.0
+        )
+        while not chunks:
+            await asyncio.sleep(0.01)
+
+        r = await self.http_client.fetch(
+            self.get_url('/v1/notes'),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+        self.assertEqual(r.code, 201)
+        id_ = r.headers['Location'].rsplit('/', 1)[-1]
+        await self.http_client.fetch(
+            self.get_url(r.headers['Location']), method='DELETE'
+        )
+        # The stream only ends when the client gives up
+        with self.assertRaises(tornado.httpclient.HTTPClientError):
+            await stream
+
+        events = b''.join(chunks).decode('utf-8')
+        self.assertIn('event: created\ndata: {"id": "' + id_, events)
+        self.assertIn('id: 2\nevent: deleted\n', events)
+        # Heartbeats while idle
+        self.assertGreater(events.count(':\n\n'), 2)
+
+
+class AdminTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['admin'] = {'enabled': True, 'token': 'secret'}
+        return config
+
+    def admin_fetch(self, uri: str, method: str = 'GET', **kwargs):
+        return self.fetch(
+            uri,
+            method=method,
+            headers={'X-Admin-Token': 'secret'},
+            allow_nonstandard_methods=True,
+            **kwargs
+        )
+
+    def test_admin_token(self):
+        r = self.fetch('/admin/profile?seconds=0.1', method='GET')
+        self.assertEqual(r.code, 403)
+
+    def test_profile(self):
+        r = self.admin_fetch('/admin/profile?seconds=0.1')
+        self.assertEqual(r.code, 200)
+        self.assertIn('function calls', r.body.decode('utf-8'))
+
+        r = self.admin_fetch('/admin/profile?seconds=0.1&mode=sample')
+        self.assertEqual(r.code, 200)
+
+        r = self.admin_fetch('/admin/profile?seconds=0')
+        self.assertEqual(r.code, 400)
+
+    def test_tracemalloc(self):
+        r = self.admin_fetch('/admin/tracemalloc')
+        self.assertEqual(r.code, 409)
+
+        r = self.admin_fetch('/admin/tracemalloc', method='POST', body='')
+        self.assertEqual(r.code, 204)
+        try:
+            r = self.admin_fetch('/admin/tracemalloc?top=5')
+            self.assertEqual(r.code, 200)
+            report = json.loads(r.body.decode('utf-8'))
+            self.assertLessEqual(len(report['top']), 5)
+
+            r = self.admin_fetch('/admin/tracemalloc?compare=true')
+            report = json.loads(r.body.decode('utf-8'))
+            self.assertTrue(report['compared'])
+        finally:
+            r = self.admin_fetch('/admin/tracemalloc', method='DELETE')
+            self.assertEqual(r.code, 204)
+
+
+class BackupTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='notesbook-backup')
+        super().setUp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.tmp_dir.cleanup()
+
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['notes-db'] = {'fs': os.path.join(self.tmp_dir.name, 'store')}
+        config['admin'] = {
+            'enabled': True,
+            'token': 'secret',
+            'backup-dir': os.path.join(self.tmp_dir.name, 'backups')
+        }
+        return config
+
+    def admin_fetch(self, uri: str, method: str = 'GET', **kwargs):
+        return self.fetch(
+            uri,
+            method=method,
+            headers={'X-Admin-Token': 'secret'},
+            **kwargs
+        )
+
+    def test_backup(self):
+        r = self.admin_fetch('/admin/backup')
+        self.assertEqual(json.loads(r.body.decode('utf-8'))['state'], 'idle')
+
+        r = self.fetch(
+            '/v1/notes', method='POST', headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+        self.assertEqual(r.code, 201)
+        id_ = r.headers['Location'].rsplit('/', 1)[-1]
+
+        r = self.admin_fetch('/admin/backup', method='POST', body='')
+        self.assertEqual(r.code, 202)
+        for _ in range(100):
+            status = json.loads(
+                self.admin_fetch('/admin/backup').body.decode('utf-8')
+            )
+            if status['state'] != 'running':
+                break
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['result']['notes'], 1)
+        self.assertTrue(
+            os.path.isfile(os.path.join(status['path'], id_ + '.json'))
+        )
+
+
+class AdmissionTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['admission'] = {
+            'enabled': True,
+            'retry-after-seconds': 2,
+            'default': {'max-concurrency': 8},
+            # Nothing is admitted: every entry request is shed at once
+            'routes': {'note': {'max-concurrency': 0, 'queue-size': 0}}
+        }
+        return config
+
+    def test_shed(self):
+        r = self.fetch('/v1/notes/does-not-matter', method='GET')
+        self.assertEqual(r.code, 503)
+        self.assertEqual(r.headers['Retry-After'], '2')
+        self.assertEqual(json.loads(r.body.decode('utf-8'))['code'], 503)
+
+        r = self.fetch('/v1/notes', method='GET')
+        self.assertEqual(r.code, 200)
+
+        # Metrics are not admission controlled
+        r = self.fetch('/metrics', method='GET')
+        self.assertEqual(r.code, 200)
+        self.assertIn(
+            'notesservice_admission_shed_total'
+            '{route="note",reason="queue_full"} 1.0',
+            r.body.decode('utf-8')
+        )
+        self.assertIn(
+            'notesservice_admission_limit{route="notes"} 8',
+            r.body.decode('utf-8')
+        )
+
+
+class RateLimitTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['rate-limit'] = {
+            'enabled': True,
+            'key': 'api-key',
+            'rate': 0.5,
+            'burst': 3,
+            'costs': {'notes': {'GET': 3}}
+        }
+        return config
+
+    def test_rate_limit(self):
+        r = self.fetch('/v1/notes', method='GET')
+        self.assertEqual(r.code, 200)
+
+        r = self.fetch('/v1/notes/does-not-exist', method='GET')
+        self.assertEqual(r.code, 429)
+        self.assertEqual(r.headers['Retry-After'], '2')
+
+        # Other API keys have their own buckets
+        r = self.fetch(
+            '/v1/notes/does-not-exist',
+            method='GET',
+            headers={'X-API-Key': 'other'}
+        )
+        self.assertEqual(r.code, 404)
+
+        r = self.fetch('/metrics', method='GET')
+        self.assertEqual(r.code, 200)
+        self.assertIn(
+            'notesservice_rate_limited_total{route="note"} 1.0',
+            r.body.decode('utf-8')
+        )
+
+
+class CompressionTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['compression'] = {
+            'min-size': 1024,
+            'routes': {'changes': None}
+        }
+        return config
+
+    def fetch_gzip(self, uri: str, **headers):
+        return self.fetch(
+            uri,
+            method='GET',
+            headers={'Accept-Encoding': 'gzip', **headers},
+            decompress_response=False
+        )
+
+    def test_compression_policy(self):
+        note = {**self.addr0, 'body': 'large ' * 500}
+        r = self.fetch(
+            '/v1/notes',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(note)
+        )
+        self.assertEqual(r.code, 201)
+
+        # Below min-size: sent as is
+        r = self.fetch(
+            '/v1/notes',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr1)
+        )
+        small = self.fetch_gzip(r.headers['Location'])
+        self.assertEqual(small.code, 200)
+        self.assertNotIn('Content-Encoding', small.headers)
+        self.assertEqual(small.headers['Vary'], 'Accept-Encoding')
+
+        first = self.fetch_gzip('/v1/notes')
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        notes = json.loads(gzip.decompress(first.body).decode('utf-8'))
+        self.assertEqual(len(notes), 2)
+
+        # Same ETag: served from the precompressed cache
+        second = self.fetch_gzip('/v1/notes')
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.headers['Etag'], first.headers['Etag'])
+
+        r = self.fetch_gzip(
+            '/v1/notes', **{'If-None-Match': first.headers['Etag']}
+        )
+        self.assertEqual(r.code, 304)
+
+        # Turned off for the route
+        r = self.fetch_gzip('/v1/notes/changes')
+        self.assertEqual(r.code, 200)
+        self.assertNotIn('Content-Encoding', r.headers)
+
+        r = self.fetch('/metrics', method='GET')
+        self.assertIn(
+            'notesservice_compression_cache_total{result="hit"} 1.0',
+            r.body.decode('utf-8')
+        )
+
+
+class RequestBodyTornadoAppUnitTests(NotesServiceTornadoAppTestSetup):
+    def get_config(self) -> Dict:
+        config = copy.deepcopy(TEST_CONFIG)
+        config['request-body'] = {
+            'max-bytes': 1000,
+            'routes': {'note': {'max-bytes': 4000}}
+        }
+        return config
+
+    def test_max_body_size(self):
+        large = json.dumps({**self.addr0, 'body': 'x' * 2000})
+        r = self.fetch(
+            '/v1/notes',
+            method='POST',
+            headers=self.headers,
+            body=large
+        )
+        self.assertEqual(r.code, 413)
+
+        r = self.fetch(
+            '/v1/notes',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+        self.assertEqual(r.code, 201)
+
+        # The entry route allows larger bodies
+        r = self.fetch(
+            r.headers['Location'],
+            method='PUT',
+            headers=self.headers,
+            body=large
+        )
+        self.assertEqual(r.code, 204)
+
+    @tornado.testing.gen_test
+    async def test_streamed_body_too_large(self):
+        async def body_producer(write):
+            for _ in range(4):
+                await write(b'x' * 500)
+
+        # Chunked: refused once the body grows past max-bytes
+        r = await self.http_client.fetch(
+            self.get_url('/v1/notes'),
+            method='POST',
+            headers=self.headers,
+            body_producer=body_producer,
+            raise_error=False
+        )
+        self.assertEqual(r.code, 413)
+
+        # A refused request does nothing, even one whose method does not
+        # read the body: a chunked DELETE (sent by hand, the client only
+        # chunks the bodies of POST, PUT and PATCH)
+        r = await self.http_client.fetch(
+            self.get_url('/v1/notes'),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+        location = r.headers['Location']
+        reader, writer = await asyncio.open_connection(
+            '127.0.0.1', self.get_http_port()
+        )
+        # Past max-bytes with its last chunk, all of it in one write: the
+        # server has the end of the body buffered when it answers 413
+        writer.write(
+            'DELETE {} HTTP/1.1\r\nHost: localhost\r\n'
+            'Transfer-Encoding: chunked\r\n\r\n'.format(location).encode()
+            + (b'1f4\r\n' + b'x' * 500 + b'\r\n') * 9
+            + b'0\r\n\r\n'
+        )
+        status = await reader.readline()
+        writer.close()
+        self.assertIn(b' 413 ', status)
+        location = self.get_url(location)
+        r = await self.http_client.fetch(
+            location, headers=self.headers, raise_error=False
+        )
+        self.assertEqual(r.code, 200)
+
+        r = await self.http_client.fetch(
+            self.get_url('/v1/notes'),
+            method='POST',
+            headers=self.headers,
+            body=b'{"title": "\xff"}',
+            raise_error=False
+        )
+        self.assertEqual(r.code, 400)
+
+    @tornado.testing.gen_test
+    async def test_unless_refused(self):
+        # Whether or not the server calls them after a 413
+        class Handler:
+            _finished = False
+
+            def __init__(self) -> None:
+                self.deleted: List[str] = []
+
+            @unless_refused
+            async def delete(self, id_: str) -> None:
+                self.deleted.append(id_)
+
+        handler = Handler()
+        await handler.delete('a')
+        handler._finished = True
+        await handler.delete('b')
+        self.assertEqual(handler.deleted, ['a'])
+
 
 if __name__ == '__main__':
     tornado.testing.main()